@@ -10,8 +10,29 @@ example:
 http://127.0.0.1:5000/run_chain?id=stanford-tok-pos-par&data=http://127.0.0.1:5000/get_file?fname=data/example.txt
 
 This runs the stanford-tok-pos-par chain on the file in the data field. The
-available chains are hard coded in the ServiceChains.CHAINS variable in the
-services module.
+available chains are defined in data/chains.json, steps of a chain that do not
+depend on each other run at the same time. Instead of a chain identifier you can
+give the annotation types you want and a chain producing them is planned from
+the registered services, note that # is written as %23 in a URL:
+
+http://127.0.0.1:5000/run_chain?produces=Token%23pos,NamedEntity&data=...
+
+The produces variable can also be used with /jobs and /run_chain_batch.
+
+To run a chain in the background use /jobs, which returns a job identifier right
+away. The status of the job can then be polled and when the job is done you can
+get the result page:
+
+$ curl "http://127.0.0.1:5000/jobs?id=stanford-tok-pos-par&data=..."
+$ curl http://127.0.0.1:5000/jobs/<job>
+$ curl http://127.0.0.1:5000/jobs/<job>/result
+
+To run a chain on many documents use /run_chain_batch, which returns one line of
+JSON for each document:
+
+$ curl -X POST -H "Content-Type: application/json" -d '["The door is open.", "Hi."]' \
+       "http://127.0.0.1:5000/run_chain_batch?id=stanford-tok-pos"
+$ curl -X POST -F data=@corpus.jsonl "http://127.0.0.1:5000/run_chain_batch?id=stanford-tok-pos"
 
 The site also includes a REST API to get a listing of all known services or just
 an individual service. The first invocation below gets you the information from
@@ -21,17 +42,57 @@ information for one service.
 $ curl -v http://127.0.0.1:5000/api/services
 $ curl -v http://127.0.0.1:5000/api/services/anc:gate.ner_2.3.0
 
+The list of services can be paged and restricted to some fields:
+
+$ curl -v "http://127.0.0.1:5000/api/services?offset=0&limit=20&fields=ids"
+$ curl -v "http://127.0.0.1:5000/api/services?fields=name,version"
+
+The chain that would be planned for some annotation types, with the estimated
+cost of each step in seconds, is available without running it:
+
+$ curl -v "http://127.0.0.1:5000/api/plan?produces=Token%23pos,NamedEntity"
+
+The registry of services is refreshed in the background, see refresh.py. The
+report of the last refresh is available and a refresh can be started with POST:
+
+$ curl -v http://127.0.0.1:5000/api/registry
+$ curl -v -X POST http://127.0.0.1:5000/api/registry
+
+Timings, payload sizes and annotation counts of service calls are kept for each
+service and can be scraped by Prometheus:
+
+$ curl http://127.0.0.1:5000/metrics
+
+Calls of services have timeouts and are retried, and a service that keeps
+failing is not called for a while, see policy.py. The recent latency
+percentiles of each service and the state of its circuit breaker are available
+with:
+
+$ curl -v http://127.0.0.1:5000/api/health
+
 """
 
 import json
+import functools
 
-from flask import Flask, request, render_template
+from flask import Flask, Response, request, render_template, abort, url_for
+from flask import make_response
+from flask import stream_with_context
 from flask_restful import Resource, Api
-import requests
 
-from services import LappsServices, ServiceChains
-from builder import HtmlBuilder
-from utils import info, debug, get_var, get_vars
+from services import LappsServices, ServiceChains, ServiceChain, result_error
+from planner import ChainPlanner, NoPlan
+from refresh import RegistryRefresher, REFRESH_INTERVAL
+from jobs import JOBS, JobQueueFull
+from batch import batch_directory, DirectoryNotAllowed
+from fetch import INPUT_FETCHER, InputTooLarge, InvalidInput, InputUnavailable
+from payloads import services_payload
+from results import RESULTS
+from metrics import METRICS
+from policy import POLICIES
+import visualization
+from builder import HtmlBuilder, DUMP_LIMIT
+from utils import info, debug, get_var
 
 
 app = Flask(__name__)
@@ -40,14 +101,34 @@ api = Api(app)
 
 LAPPS_SERVICES = LappsServices()
 LAPPS_SERVICE_CHAINS = ServiceChains(LAPPS_SERVICES)
+LAPPS_PLANNER = ChainPlanner(LAPPS_SERVICES)
+LAPPS_REFRESHER = RegistryRefresher(LAPPS_SERVICES)
+
+
+@app.before_request
+def start_background_tasks():
+    """Start refreshing the registry in the background. This is done when the
+    first request comes in rather than when the module is loaded, so that with
+    the preforking server in wsgi.py it happens in each worker and not in the
+    process the workers are forked from."""
+    if REFRESH_INTERVAL is not None:
+        LAPPS_REFRESHER.start()
 
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    """List all the services, ordered on what they produce."""
-    return render_template("index.html",
-                           builder=HtmlBuilder(),
-                           services=LAPPS_SERVICES)
+    """List all the services, ordered on what they produce. The page only
+    changes when the services change so browsers can use a cached copy."""
+    builder = HtmlBuilder()
+    etag = builder.categories_etag(LAPPS_SERVICES)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(render_template("index.html",
+                                                 builder=builder,
+                                                 services=LAPPS_SERVICES))
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/get_file', methods=['GET', 'POST'])
@@ -59,34 +140,261 @@ def get_file():
 
 @app.route('/run_chain', methods=['GET', 'POST'])
 def chain():
-    """Present the results of running a chain on a file."""
-    chain_identifier, url = get_vars(request, ["id", "data"])
-    info('chain=%s' % chain_identifier)
-    chain = LAPPS_SERVICE_CHAINS.get_chain(chain_identifier)
+    """Present the results of running a chain on a file. The ASGI application in
+    asgi.py serves this page with the chain running on asyncio."""
+    chain = get_chain(request.values)
+    url = request.values.get("data")
+    info('chain=%s' % chain.identifier)
     info('source-url=%s' % url)
-    data = requests.get(url).text
-    result = chain.run({
+    data = fetch_input(url, request.host)
+    metrics = []
+    result = chain.run(text_input(data), metrics=metrics)
+    return chain_page(chain, url, result, metrics)
+
+
+def text_input(data):
+    """Return the input of a chain for a text."""
+    return {
         "discriminator": "http://vocab.lappsgrid.org/ns/media/text", 
-        "payload": data})
+        "payload": data}
+
+
+def chain_page(chain, url, result, metrics, result_id=None):
+    """Render the result of running the chain on the document at the URL. If a
+    step of the chain failed the page has the error message and the status is
+    502, since the error came from a service and not from this site."""
     info("discriminator=%s" % result.get('discriminator'))
+    error = result_error(result)
+    if error is not None:
+        return render_template("chain.html",
+                               chain=chain,
+                               fname=url,
+                               error=error,
+                               metrics=metrics,
+                               builder=HtmlBuilder()), 502
     return render_template("chain.html",
                            chain=chain,
                            fname=url,
                            result=result,
+                           result_id=RESULTS.add(result, result_id),
+                           metrics=metrics,
                            builder=HtmlBuilder())
 
 
+@app.route('/jobs', methods=['GET', 'POST'])
+def submit_job():
+    """Start running a chain in the background and return the job identifier
+    right away, the job can then be polled at /jobs/<job>."""
+    chain = get_chain(request.values)
+    url = request.values.get("data")
+    try:
+        fetch = functools.partial(fetch_input, local_host=request.host)
+        job = JOBS.submit(chain, url, fetch)
+    except JobQueueFull as e:
+        return {'error': str(e)}, 503
+    info('chain=%s job=%s' % (chain.identifier, job.identifier))
+    response = job.as_json()
+    response['poll'] = url_for('job_status', job_identifier=job.identifier)
+    response['result'] = url_for('job_result', job_identifier=job.identifier)
+    return response, 202
+
+
+@app.route('/jobs/<job_identifier>')
+def job_status(job_identifier):
+    """Return the status of a job and of each step in its chain."""
+    job = JOBS.get(job_identifier)
+    if job is None:
+        abort(404)
+    return job.as_json()
+
+
+@app.route('/jobs/<job_identifier>/result')
+def job_result(job_identifier):
+    """Present the results of a finished job, use format=json to get the LIF
+    object instead of the web page."""
+    job = JOBS.get(job_identifier)
+    if job is None:
+        abort(404)
+    if job.status == 'failed':
+        # a job with a result failed in one of the services
+        return job.as_json(), 500 if job.result is None else 502
+    if job.status != 'done':
+        return job.as_json(), 202
+    if request.args.get('format') == 'json':
+        return job.result
+    return chain_page(job.chain, job.url, job.result, job.metrics, job.identifier)
+
+
+@app.route('/results/<result_id>/<tab>')
+def result_tab(result_id, tab):
+    """Return the HTML content of a top-level tab of a stored result. Tabs are
+    rendered on first request and then cached with the result."""
+    limit = None if request.args.get('full') else DUMP_LIMIT
+    return _result_tab(result_id, tab,
+                       lambda stored: HtmlBuilder().result_tab(stored, tab, limit))
+
+
+@app.route('/results/<result_id>/<int:view>/<sub>')
+def result_sub_tab(result_id, view, sub):
+    """Return the HTML content of a sub tab of a view in a stored result."""
+    limit = None if request.args.get('full') else DUMP_LIMIT
+    return _result_tab(result_id, (view, sub),
+                       lambda stored: HtmlBuilder().result_sub_tab(stored, view, sub, limit))
+
+
+def _result_tab(result_id, key, render):
+    stored = RESULTS.get(result_id)
+    if stored is None:
+        abort(404)
+    html = stored.cache.get(key)
+    if html is None:
+        html = render(stored)
+        if html is None:
+            abort(404)
+        if not isinstance(html, str):
+            # JSON dumps are streamed and not cached
+            return Response(stream_with_context(html), mimetype='text/html')
+        stored.cache[key] = html
+    return html
+
+
+@app.route('/annotations/<result_id>/<int:view>')
+def annotations(result_id, view):
+    """Return a page of the annotations in a view of a stored result, as an HTML
+    table or, with format=json, as a list of annotations. The offset and the
+    total number of annotations are in the X-Offset and X-Total headers."""
+    stored = RESULTS.get(result_id)
+    view = None if stored is None else stored.lif_view(view)
+    if view is None:
+        abort(404)
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', visualization.PAGE_SIZE))
+    except ValueError:
+        abort(400)
+    offset = max(0, offset)
+    limit = max(0, min(limit, 10 * visualization.PAGE_SIZE))
+    total = len(view)
+    if request.args.get('format') == 'json':
+        return {'offset': offset, 'limit': limit, 'total': total,
+                'annotations': visualization.annotation_records(
+                    view, stored.text(), offset, limit)}
+    table = visualization.annotations_table(view, stored.text(), offset, limit)
+    response = Response(stream_with_context(table.stream()), mimetype='text/html')
+    response.headers['X-Offset'] = offset
+    response.headers['X-Limit'] = limit
+    response.headers['X-Total'] = total
+    return response
+
+
+@app.route('/run_chain_batch', methods=['GET', 'POST'])
+def chain_batch():
+    """Run a chain on many documents and stream the results as JSON lines, in the
+    order of the input. The documents are taken from the server directory in
+    the dir variable, which must be below BATCH_DIRECTORY_ROOT, from an uploaded
+    JSONL file named data, from a JSON list in the request body, or from JSON
+    lines in the request body."""
+    chain = get_chain(request.values)
+    directory = request.values.get("dir")
+    if directory:
+        documents = batch_directory(directory)
+    elif 'data' in request.files:
+        documents = request.files['data'].stream
+    elif request.is_json:
+        documents = request.get_json()
+    else:
+        documents = request.stream
+    info('chain=%s batch' % chain.identifier)
+    lines = (json.dumps(result) + '\n' for result in chain.run_batch(documents))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+@app.route('/metrics')
+def metrics():
+    """Return the metrics of the service calls in the Prometheus text format."""
+    return Response(METRICS.prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+def get_chain(values):
+    """Return the chain with the identifier in the id variable, or plan a chain
+    for the comma-separated annotation types in the produces variable."""
+    chain_identifier = values.get("id")
+    if chain_identifier:
+        chain = LAPPS_SERVICE_CHAINS.get_chain(chain_identifier)
+    elif values.get("produces"):
+        chain = LAPPS_PLANNER.plan(values.get("produces"))
+    else:
+        chain = None
+    if chain is None:
+        abort(404)
+    return chain
+
+
+def job_chain(chain_identifier, service_identifiers):
+    """Return the chain of a job that was run by another process, or None if
+    one of its services is no longer registered, see JobManager.share()."""
+    chain = LAPPS_SERVICE_CHAINS.get_chain(chain_identifier)
+    if chain is not None and [s.identifier for s in chain.services] == service_identifiers:
+        return chain
+    services = [LAPPS_SERVICES.get_service(identifier) for identifier in service_identifiers]
+    if None in services:
+        return None
+    return ServiceChain(chain_identifier, services)
+
+
+def fetch_input(url, local_host=None):
+    """Return the text at the URL, the local host is the host of the request
+    and is used to read documents from this site directly from disk."""
+    return INPUT_FETCHER.fetch(url, local_host=local_host)
+
+
+@app.errorhandler(InputTooLarge)
+def input_too_large(e):
+    return {'error': str(e)}, 413
+
+
+@app.errorhandler(InvalidInput)
+def invalid_input(e):
+    return {'error': str(e)}, 400
+
+
+@app.errorhandler(InputUnavailable)
+def input_unavailable(e):
+    return {'error': str(e)}, 502
+
+
+@app.errorhandler(DirectoryNotAllowed)
+def directory_not_allowed(e):
+    return {'error': str(e)}, 403
+
+
+@app.errorhandler(NoPlan)
+def no_plan(e):
+    return {'error': str(e)}, 404
+
+
 class Services(Resource):
 
     """Return a JDON dictionary of all services with the identifier of the service
-    as the key and all information from the service manager as the value."""
+    as the key and all information from the service manager as the value. The
+    offset and limit parameters return a page of services, fields=ids returns
+    just a list of service keys and fields=name,version returns only some of
+    the information. The JSON is computed once for each version of the
+    services."""
 
     def get(self):
-        services = {}
-        for s in LAPPS_SERVICES:
-            key = "%s::%s" % (s.server, s.identifier)
-            services[key] = s.info
-        return { "services":  services }
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = request.args.get('limit')
+            limit = None if limit is None else int(limit)
+        except ValueError:
+            abort(400)
+        if offset < 0 or (limit is not None and limit < 0):
+            abort(400)
+        fields = request.args.get('fields')
+        fields = fields.split(',') if fields else None
+        payload = services_payload(LAPPS_SERVICES, offset, limit, fields)
+        return payload.response(request)
 
 
 class Service(Resource):
@@ -101,8 +409,57 @@ class Service(Resource):
                 'info': info}
 
 
+class Plan(Resource):
+
+    """Return the chain planned for the comma-separated annotation types in the
+    produces parameter, with for each step the service, the types it requires
+    and produces, its estimated cost and the steps it depends on."""
+
+    def get(self):
+        try:
+            chain = LAPPS_PLANNER.plan(request.args.get('produces', ''))
+        except NoPlan as e:
+            return {'error': str(e)}, 404
+        return LAPPS_PLANNER.describe(chain)
+
+
+class Health(Resource):
+
+    """Return for each service that was called the recent latency percentiles in
+    seconds, the number of calls by outcome, and its call policy with the state
+    of its circuit breaker and the numbers of retried, hedged and rejected
+    calls."""
+
+    def get(self):
+        health = {}
+        for identifier, latency in METRICS.latency().items():
+            health[identifier] = {'latency': latency, 'policy': None}
+        for identifier, policy in POLICIES.as_json().items():
+            health.setdefault(identifier, {'latency': None})['policy'] = policy
+        return health
+
+
+class Registry(Resource):
+
+    """Return the number of services, the version of the registry and the report
+    of the last refresh, a POST starts a refresh in the background."""
+
+    def get(self):
+        return {'services': len(LAPPS_SERVICES),
+                'version': LAPPS_SERVICES.version,
+                'refresh': LAPPS_REFRESHER.report}
+
+    def post(self):
+        LAPPS_REFRESHER.start()
+        LAPPS_REFRESHER.trigger()
+        return {'refresh': 'started'}, 202
+
+
 api.add_resource(Services, '/api/services')
 api.add_resource(Service, '/api/services/<string:identifier>')
+api.add_resource(Plan, '/api/plan')
+api.add_resource(Registry, '/api/registry')
+api.add_resource(Health, '/api/health')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,126 @@
+"""asgi.py
+
+ASGI entry point that runs chains on asyncio, for example with uvicorn:
+
+$ cd code
+$ uvicorn asgi:application --port 8000
+
+Requests to /run_chain are handled here. The chain runs with run_async() and
+its service calls are sent with the asyncio clients in clients.py, so waiting
+for the services costs a coroutine per call instead of a thread, and one
+process can have hundreds of service calls in flight. All other pages are
+served by the Flask application in app.py, which runs in threads through
+asgiref's WSGI adapter.
+
+Needs httpx, asgiref and an ASGI server:
+
+$ pip3 install httpx asgiref uvicorn
+
+Run one process per CPU with --workers, each worker loads the registry
+snapshot written by the first one, see services.py. As with wsgi.py, results
+and jobs are shared through RESULT_STORE_DIR and JOB_STORE_DIR so any worker
+can return the parts of a result page or the state of a job.
+
+"""
+
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import request
+
+from app import app, get_chain, fetch_input, text_input, chain_page
+from app import start_background_tasks, job_chain
+from clients import ASYNC_CLIENTS
+from jobs import JOBS
+from results import RESULTS
+from utils import info
+
+
+RESULTS.share()
+JOBS.share(job_chain)
+
+WSGI_APPLICATION = WsgiToAsgi(app)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/run_chain':
+        body = await read_body(receive)
+        response = await run_chain(scope, body)
+        await send_response(send, response)
+    else:
+        await WSGI_APPLICATION(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    """Start the background refresh of the registry when the server starts and
+    close the connections of the asyncio clients when it stops."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_background_tasks()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await ASYNC_CLIENTS.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def run_chain(scope, body):
+    """Return the response for /run_chain, see app.chain(). The request context
+    is only entered around code that does not wait, since the contexts of Flask
+    may be kept per thread. Errors are turned into responses by the error
+    handlers of the Flask application."""
+    try:
+        with request_context(scope, body):
+            chain = get_chain(request.values)
+            url = request.values.get("data")
+            host = request.host
+        info('chain=%s' % chain.identifier)
+        info('source-url=%s' % url)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, fetch_input, url, host)
+        metrics = []
+        result = await chain.run_async(text_input(data), metrics=metrics)
+        with request_context(scope, body):
+            return app.make_response(chain_page(chain, url, result, metrics))
+    except Exception as e:
+        with request_context(scope, body):
+            return app.make_response(app.handle_user_exception(e))
+
+
+def request_context(scope, body):
+    """Return a Flask request context for the HTTP request in the ASGI scope."""
+    headers = [(name.decode('latin-1'), value.decode('latin-1'))
+               for name, value in scope['headers']]
+    host = dict((name.lower(), value) for name, value in headers).get('host')
+    if host is None and scope.get('server'):
+        host = '%s:%d' % tuple(scope['server'])
+    base_url = '%s://%s%s' % (scope.get('scheme', 'http'), host or 'localhost',
+                              scope.get('root_path', ''))
+    return app.test_request_context(
+        scope['path'], base_url=base_url, query_string=scope['query_string'],
+        method=scope['method'], data=body,
+        headers=[(name, value) for name, value in headers if name.lower() != 'host'])
+
+
+async def read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def send_response(send, response):
+    """Send a werkzeug response."""
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.headers.items()]
+    await send({'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': headers})
+    await send({'type': 'http.response.body',
+                'body': response.get_data()})
@@ -0,0 +1,216 @@
+"""batch.py
+
+Running a service chain on a corpus of documents.
+
+The BatchRunner pipelines documents through the steps of a chain. Each step has
+its own thread pool and a document moves on to the pool of the next step as soon
+as a step is done with it, so while step 2 works on document 1 step 1 can work
+on document 2. Results are handed out in the order of the input:
+
+>>> runner = BatchRunner(chain, step_workers=4)
+>>> for result in runner.run(iter_documents('data/corpus')):
+...     print(result['id'], 'error' in result)
+
+Errors in one document do not stop the batch, instead the error message is
+returned for that document. This includes documents that cannot be read, like
+malformed JSONL lines or files that are not UTF-8.
+
+"""
+
+import os
+import json
+import collections
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import config
+import services
+from utils import info
+
+
+TEXT_DISCRIMINATOR = "http://vocab.lappsgrid.org/ns/media/text"
+
+# Directory on the server below which /run_chain_batch may read the documents of
+# a batch from a directory, None to not allow that.
+BATCH_DIRECTORY_ROOT = getattr(config, 'BATCH_DIRECTORY_ROOT', None)
+
+
+class DocumentError(Exception):
+
+    """Generated by iter_documents() instead of the chain input of a document
+    that cannot be read."""
+
+
+class DirectoryNotAllowed(Exception):
+    pass
+
+
+def batch_directory(directory, root=BATCH_DIRECTORY_ROOT):
+    """Return the path of a directory given in a request, relative to the root.
+    Raises DirectoryNotAllowed if there is no root or if the directory is not
+    below it, also after following links."""
+    if root is None:
+        raise DirectoryNotAllowed("Reading documents from a directory is not allowed")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, directory))
+    if os.path.commonpath([root, path]) != root or not os.path.isdir(path):
+        raise DirectoryNotAllowed("No directory %s" % directory)
+    return path
+
+
+def text_input(text):
+    """Return the chain input for a text."""
+    return {"discriminator": TEXT_DISCRIMINATOR, "payload": text}
+
+
+def iter_documents(source):
+    """Generate (identifier, chain_input) pairs from a source, which is one of
+
+    - the path to a directory, each file is read as a text document
+    - a list of documents
+    - an open file or other iterator over JSONL lines, each line is a document
+
+    Documents from lists and JSONL lines are either strings with the text, chain
+    inputs with a discriminator and payload, or dictionaries with an optional id
+    and either a text or an input property. Identifiers default to the position
+    of the document in the source. For a document that cannot be read a
+    DocumentError is generated instead of the chain input."""
+    if isinstance(source, str):
+        for fname in sorted(os.listdir(source)):
+            path = os.path.join(source, fname)
+            if os.path.isfile(path):
+                try:
+                    with open(path, encoding='utf-8') as fh:
+                        yield fname, text_input(fh.read())
+                except (OSError, UnicodeDecodeError) as e:
+                    yield fname, DocumentError("cannot read %s: %s" % (fname, e))
+    elif isinstance(source, (list, tuple)):
+        for n, document in enumerate(source):
+            yield _document(n, document)
+    else:
+        n = 0
+        for line in source:
+            if isinstance(line, bytes):
+                try:
+                    line = line.decode('utf-8')
+                except UnicodeDecodeError as e:
+                    yield n, DocumentError("line is not UTF-8: %s" % e)
+                    n += 1
+                    continue
+            if line.strip():
+                try:
+                    document = json.loads(line)
+                except ValueError as e:
+                    yield n, DocumentError("malformed JSON: %s" % e)
+                else:
+                    yield _document(n, document)
+                n += 1
+
+
+def _document(n, document):
+    if isinstance(document, str):
+        return n, text_input(document)
+    if not isinstance(document, dict):
+        return n, DocumentError("not a string or an object")
+    if 'discriminator' in document:
+        return n, document
+    identifier = document.get('id', n)
+    if 'input' in document:
+        return identifier, document['input']
+    if 'text' in document:
+        return identifier, text_input(document['text'])
+    return identifier, DocumentError("document has no text or input")
+
+
+class BatchRunner(object):
+
+    """Pipelined execution of a chain on a sequence of documents."""
+
+    def __init__(self, chain, step_workers=4, window=64):
+        """The step_workers argument is either an integer or a list with an integer
+        for each step in the chain, it determines how many documents a step works
+        on at the same time. The window is the maximum number of documents that
+        are in the pipeline, which limits how much is kept in memory."""
+        self.chain = chain
+        if isinstance(step_workers, int):
+            step_workers = [step_workers] * len(chain.services)
+        self.step_workers = step_workers
+        self.window = window
+
+    def run(self, documents):
+        """Run the chain on the (identifier, chain_input) pairs in documents and
+        generate the results in the same order."""
+        pools = [ThreadPoolExecutor(max_workers=n) for n in self.step_workers]
+        pending = collections.deque()
+        count = errors = 0
+        try:
+            for doc_id, chain_input in documents:
+                pending.append((doc_id, self._start(pools, chain_input)))
+                if len(pending) >= self.window:
+                    result = self._result(*pending.popleft())
+                    count += 1
+                    errors += 'error' in result
+                    yield result
+            while pending:
+                result = self._result(*pending.popleft())
+                count += 1
+                errors += 'error' in result
+                yield result
+        finally:
+            for pool in pools:
+                pool.shutdown(wait=False)
+        info("batch of %d documents on %s done (%d errors)"
+             % (count, self.chain.identifier, errors))
+
+    def _start(self, pools, chain_input):
+        """Start processing a document and return a future for the result."""
+        done = Future()
+        if isinstance(chain_input, DocumentError):
+            done.set_exception(chain_input)
+            return done
+        try:
+            key, result = self.chain.get_cached(chain_input)
+        except Exception as e:
+            done.set_exception(e)
+            return done
+        if result is not None:
+            done.set_result(result)
+        else:
+            self._submit(pools, 0, chain_input, key, done, {})
+        return done
+
+    def _submit(self, pools, step, json_obj, key, done, view_sizes):
+        if step == len(self.chain.services):
+            self.chain.put_cached(key, json_obj)
+            done.set_result(json_obj)
+            return
+        service = self.chain.services[step]
+        future = pools[step].submit(self.chain.run_step, service, json_obj, None, view_sizes)
+
+        def next_step(future):
+            if future.exception() is not None:
+                done.set_exception(future.exception())
+                return
+            result = future.result()[0]
+            if services.result_error(result) is not None:
+                # the step failed, the next steps are not run
+                done.set_result(result)
+                return
+            try:
+                self._submit(pools, step + 1, result, key, done, view_sizes)
+            except Exception as e:
+                # for example when the pools were shut down
+                if not done.done():
+                    done.set_exception(e)
+
+        future.add_done_callback(next_step)
+
+    @staticmethod
+    def _result(doc_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            return {'id': doc_id, 'error': "%s: %s" % (e.__class__.__name__, e)}
+        error = services.result_error(result)
+        if error is not None:
+            return {'id': doc_id, 'error': error}
+        return {'id': doc_id, 'result': result}
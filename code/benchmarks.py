@@ -0,0 +1,590 @@
+"""benchmarks.py
+
+Benchmarks for parts of the application that do not need the LAPPS servers.
+They run on synthetic data, usage:
+
+$ python benchmarks.py async [REQUESTS] [CONCURRENCY] [LATENCY_MS]
+$ python benchmarks.py categories [NUMBER_OF_SERVICES]
+$ python benchmarks.py entities [TEXT_SIZE] [NUMBER_OF_ENTITIES]
+$ python benchmarks.py html [NUMBER_OF_NODES]
+$ python benchmarks.py lif [NUMBER_OF_ANNOTATIONS]
+$ python benchmarks.py load [REQUESTS] [CONCURRENCY] [TEXT_SIZE] [LATENCY_MS]
+$ python benchmarks.py planner [NUMBER_OF_SERVICES]
+$ python benchmarks.py resilience [REQUESTS] [LATENCY_MS] [FAILURE_PERCENT] [SLOW_PERCENT]
+$ python benchmarks.py startup [NUMBER_OF_SERVICES]
+
+async
+    Throughput, latency percentiles and peak number of threads of /run_chain
+    served by the threaded Flask application and by the asyncio application in
+    asgi.py, for many concurrent requests to the mock services. Needs httpx,
+    asgiref and uvicorn.
+
+categories
+    Compare the time it takes to render the index page when the categorized
+    services are built for each request and when they are cached.
+
+entities
+    Compare the span-based entity highlighter with the old implementation that
+    looped over all characters.
+
+html
+    Throughput and peak memory of writing a tree of html_utils objects into one
+    string and of streaming it in chunks.
+
+lif
+    Compare the memory used by the annotations of a view as a list of
+    dictionaries and as a LifView.
+
+load
+    Throughput and latency percentiles of /run_chain for all chains, with the
+    application and the mock services in mock_service.py running on local
+    ports and concurrent clients. Result caching is switched off.
+
+planner
+    Time it takes to build the planner index and compute the costs of all
+    annotation types, and to plan chains for random sets of annotation types.
+
+resilience
+    Failed chains and latency percentiles of running a chain on mock services
+    that fail or are slow for some of the calls, without retries, with retries,
+    and with retries and hedged calls, see policy.py.
+
+startup
+    Time and memory it takes to load a registry of services from the service
+    manager listings and one metadata file per service, and from a registry
+    snapshot.
+
+"""
+
+import io
+import os
+import gc
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import threading
+import tempfile
+import contextlib
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, render_template
+
+from services import LappsServices, LappsService, BRANDEIS
+from builder import HtmlBuilder
+import visualization
+from html_utils import Tag, Text
+from lif import LifView
+
+
+ANNOTATION_TYPES = [
+    'http://vocab.lappsgrid.org/%s' % t for t in
+    ('Token', 'Token#pos', 'Token#lemma', 'Sentence', 'Paragraph', 'NamedEntity',
+     'Person', 'Location', 'Organization', 'Date', 'PhraseStructure',
+     'Constituent', 'DependencyStructure', 'Dependency', 'Coreference', 'Markable')]
+
+
+def synthetic_services(n, seed=42, requires=0):
+    """Return a LappsServices instance with n services whose metadata produce
+    random sets of annotation types and require up to the given number of other
+    types. Nothing is loaded from disk or network."""
+    rng = random.Random(seed)
+    services = LappsServices.__new__(LappsServices)
+    services.services = []
+    services.services_idx = {}
+    services.version = 0
+    for i in range(n):
+        identifier = 'synthetic:service_%05d_1.0.0' % i
+        service = LappsService(BRANDEIS, identifier, {'serviceId': identifier},
+                               load_metadata=False)
+        produces = rng.sample(ANNOTATION_TYPES, rng.randint(0, 3))
+        required = []
+        if requires:
+            others = [t for t in ANNOTATION_TYPES if t not in produces]
+            required = rng.sample(others, rng.randint(0, requires))
+        service.metadata = {'payload': {'version': '1.0.0',
+                                        'requires': {'annotations': required},
+                                        'produces': {'annotations': produces}}}
+        services.services.append(service)
+        services.services_idx[identifier] = service
+    services.categorize()
+    return services
+
+
+def timeit(fun, repeat):
+    """Run the function repeat times and return the average time in seconds."""
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fun()
+    return (time.perf_counter() - t0) / repeat
+
+
+def report(name, seconds):
+    print("%-40s %10.3f ms" % (name, seconds * 1000))
+
+
+def benchmark_categories(n=3000, repeat=20):
+    services = synthetic_services(n)
+    app = Flask(__name__)
+    builder = HtmlBuilder()
+
+    def uncached():
+        services.rendered = {}
+        with app.test_request_context('/'):
+            render_template("index.html", builder=builder, services=services)
+
+    def cached():
+        with app.test_request_context('/'):
+            render_template("index.html", builder=builder, services=services)
+
+    print("\nIndex page with %d services in %d categories\n"
+          % (n, len(services.categories)))
+    t_uncached = timeit(uncached, repeat)
+    cached()
+    t_cached = timeit(cached, repeat)
+    report('built for each request', t_uncached)
+    report('cached with the registry', t_cached)
+    print("%-40s %10.1fx" % ('speedup', t_uncached / t_cached))
+
+
+def synthetic_text(size, seed=42):
+    """Return a text of about size characters."""
+    rng = random.Random(seed)
+    words = ['the', 'door', 'is', 'open', 'Johnny', 'Rotten', 'sleeps', 'Texas',
+             'and', 'Thelma', 'went', 'to', 'Grand', 'Canyon', 'awake', 'but']
+    chunks = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        chunks.append(word)
+        length += len(word) + 1
+    return ' '.join(chunks)[:size]
+
+
+def synthetic_entities_view(text, n, seed=42):
+    """Return a view with n entities at random non-overlapping offsets."""
+    rng = random.Random(seed)
+    step = max(1, len(text) // n)
+    annotations = []
+    for i in range(n):
+        start = i * step + rng.randint(0, max(0, step // 2))
+        end = min(len(text), start + rng.randint(1, max(1, step // 2)))
+        atype = rng.choice(['Person', 'Location', 'NamedEntity'])
+        annotations.append({'id': 'ne_%d' % i, 'start': start, 'end': end,
+                            '@type': 'http://vocab.lappsgrid.org/' + atype})
+    return {'metadata': {}, 'annotations': annotations}
+
+
+def entities_per_character(view, text):
+    """The old implementation of visualization.entities(), for comparison."""
+    starts = {}
+    ends = {}
+    for a in view['annotations']:
+        atype = a['@type'].split('/')[-1]
+        if atype in ('NamedEntity', 'Person', 'Location'):
+            starts[a.get('start')] = atype
+            ends[a.get('end')] = atype
+    s = io.StringIO()
+    for (i, c) in enumerate(text):
+        if i in starts:
+            s.write('<e style="color:blue;">')
+        if i in ends:
+            s.write('</e>')
+            s.write('<sup>%s</sup>' % visualization._abbreviate_entity_type(ends[i]))
+        s.write(c)
+    return s.getvalue()
+
+
+def benchmark_entities(size=2**20, n=50000, repeat=3):
+    text = synthetic_text(size)
+    view = synthetic_entities_view(text, n)
+    print("\nEntity highlighting on %d characters with %d entities\n" % (len(text), n))
+    t_old = timeit(lambda: entities_per_character(view, text), repeat)
+    lif_view = LifView(view)
+    t_new = timeit(lambda: visualization.entities(lif_view, text), repeat)
+    report('loop over characters', t_old)
+    report('copy slices between boundaries', t_new)
+    print("%-40s %10.1fx" % ('speedup', t_old / t_new))
+
+
+def synthetic_tree(n):
+    """Return a table with about n Tag and Text objects."""
+    table = Tag('table', attrs={'cellpadding': 5, 'cellspacing': 0, 'border': 1})
+    rows = max(1, n // 8)
+    for i in range(rows):
+        table.add(Tag('tr', attrs={'valign': 'top'},
+                      dtrs=[Tag('td', dtrs=Text('Token')),
+                            Tag('td', dtrs=Text("%d:%d" % (i, i + 5))),
+                            Tag('td', dtrs=Tag('b', dtrs=Text('word%d' % i)))]))
+    return table
+
+
+def measure(fun):
+    """Run the function and return the time it took and the peak memory."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fun()
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def benchmark_html(n=100000):
+    tree = synthetic_tree(n)
+    size = len(str(tree))
+
+    def consume():
+        for chunk in tree.stream():
+            pass
+
+    print("\nWriting a tree of about %d nodes (%d characters)\n" % (n, size))
+    for name, fun in (('str()', lambda: str(tree)), ('stream()', consume)):
+        seconds, peak = measure(fun)
+        print("%-20s %10.1f MB/s %10.1f MB peak" % (name, size / seconds / 2**20, peak / 2**20))
+
+
+def synthetic_tokens_view(text, seed=42):
+    """Return a view with a Token#pos annotation for each word in the text."""
+    rng = random.Random(seed)
+    annotations = []
+    start = 0
+    for n, word in enumerate(text.split(' ')):
+        annotations.append({'id': 'tok_%d' % n, 'start': start, 'end': start + len(word),
+                            '@type': 'http://vocab.lappsgrid.org/Token#pos',
+                            'features': {'word': word, 'pos': rng.choice(['NN', 'VB', 'DT'])}})
+        start += len(word) + 1
+    return {'metadata': {}, 'annotations': annotations}
+
+
+def retained_memory(fun):
+    """Return the result of the function and the memory it still holds on to."""
+    gc.collect()
+    tracemalloc.start()
+    result = fun()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def benchmark_lif(n=200000):
+    text = synthetic_text(n * 6)
+    view_json = json.dumps(synthetic_tokens_view(text))
+    view, dict_size = retained_memory(lambda: json.loads(view_json))
+    lif_view, lif_size = retained_memory(lambda: LifView(json.loads(view_json)))
+    print("\nA view with %d annotations\n" % len(view['annotations']))
+    print("%-40s %10.1f MB" % ('list of dictionaries', dict_size / 2**20))
+    print("%-40s %10.1f MB" % ('LifView', lif_size / 2**20))
+    print("%-40s %10.1fx" % ('reduction', dict_size / lif_size))
+    report('create LifView', timeit(lambda: LifView(view), 1))
+
+
+def percentile(values, p):
+    """Return the p-th percentile of the values, using the nearest rank."""
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))]
+
+
+def benchmark_load(requests=200, concurrency=8, size=2000, latency_ms=20):
+    import requests as http
+    from werkzeug.serving import make_server
+    import services
+    import mock_service
+    mock = mock_service.serve(latency=latency_ms / 1000)
+    services.use_service_backend(mock.url)
+    # measure the services and the application, not the result cache
+    services.RESULT_CACHE = None
+    import app
+    server = make_server('127.0.0.1', 0, app.app, threaded=True,
+                         request_handler=mock_service.QuietRequestHandler)
+    base = 'http://127.0.0.1:%d' % server.server_port
+    app.INPUT_FETCHER.local_hosts.add(base[7:])
+    thread = mock_service.threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    fd, fname = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as fh:
+        fh.write(synthetic_text(size).replace(' the ', '. The '))
+    session = http.Session()
+    adapter = http.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+
+    def run(chain):
+        t0 = time.perf_counter()
+        response = session.get('%s/run_chain' % base,
+                               params={'id': chain, 'data': '%s/get_file?fname=%s' % (base, fname)})
+        response.raise_for_status()
+        return time.perf_counter() - t0
+
+    print("\n/run_chain with %d requests from %d clients on %d characters, %d ms per service call\n"
+          % (requests, concurrency, size, latency_ms))
+    print("%-30s %8s %10s %10s %10s %10s" % ('chain', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    try:
+        for chain in sorted(app.LAPPS_SERVICE_CHAINS.chains):
+            # the application logs each step with info(), which is not shown here
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                run(chain)
+                t0 = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    latencies = list(pool.map(run, [chain] * requests))
+                seconds = time.perf_counter() - t0
+            print("%-30s %8.1f %10.1f %10.1f %10.1f %10.1f"
+                  % (chain, requests / seconds,
+                     *[percentile(latencies, p) * 1000 for p in (50, 90, 99, 100)]))
+    finally:
+        server.shutdown()
+        mock.shutdown()
+        os.remove(fname)
+
+
+def benchmark_async(requests=1000, concurrency=200, latency_ms=100):
+    try:
+        import httpx
+        import uvicorn
+        import asgiref
+    except ImportError as e:
+        exit("The async benchmark needs httpx, asgiref and uvicorn (%s)" % e)
+    from werkzeug.serving import make_server
+    import services
+    import mock_service
+    mock = mock_service.serve(latency=latency_ms / 1000)
+    services.use_service_backend(mock.url)
+    # measure the services and the application, not the result cache
+    services.RESULT_CACHE = None
+    import app
+    import asgi
+    server = make_server('127.0.0.1', 0, app.app, threaded=True,
+                         request_handler=mock_service.QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    asgi_server = uvicorn.Server(uvicorn.Config(asgi.application, log_level='warning'))
+    asgi_thread = threading.Thread(target=asgi_server.run, kwargs={'sockets': [sock]}, daemon=True)
+    asgi_thread.start()
+    while not asgi_server.started:
+        time.sleep(0.01)
+    bases = [('threaded', 'http://127.0.0.1:%d' % server.server_port),
+             ('asyncio', 'http://127.0.0.1:%d' % sock.getsockname()[1])]
+    for _, base in bases:
+        app.INPUT_FETCHER.local_hosts.add(base[7:])
+    fd, fname = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as fh:
+        fh.write(synthetic_text(2000).replace(' the ', '. The '))
+
+    async def load(base, chain, n):
+        """Send n requests, at most concurrency at the same time, and return the
+        seconds it took and the latency of each request."""
+        params = {'id': chain, 'data': '%s/get_file?fname=%s' % (base, fname)}
+        limits = httpx.Limits(max_connections=concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+
+            async def run():
+                async with semaphore:
+                    t0 = time.perf_counter()
+                    response = await client.get('%s/run_chain' % base, params=params)
+                    response.raise_for_status()
+                    return time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            latencies = await asyncio.gather(*[run() for _ in range(n)])
+            return time.perf_counter() - t0, latencies
+
+    def peak_threads(fun):
+        """Return the result of fun and the largest number of threads seen while
+        it ran."""
+        peak = [threading.active_count()]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.01):
+                peak[0] = max(peak[0], threading.active_count())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            return fun(), peak[0]
+        finally:
+            done.set()
+            sampler.join()
+
+    print("\n/run_chain with %d requests, %d at the same time, %d ms per service call\n"
+          % (requests, concurrency, latency_ms))
+    print("%-30s %-10s %8s %10s %10s %10s %8s"
+          % ('chain', 'server', 'req/s', 'p50 ms', 'p99 ms', 'max ms', 'threads'))
+    try:
+        for chain in sorted(app.LAPPS_SERVICE_CHAINS.chains):
+            for name, base in bases:
+                # the application logs each step with info(), which is not shown here
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    asyncio.run(load(base, chain, concurrency))
+                    (seconds, latencies), threads = peak_threads(
+                        lambda: asyncio.run(load(base, chain, requests)))
+                print("%-30s %-10s %8.1f %10.1f %10.1f %10.1f %8d"
+                      % (chain, name, requests / seconds,
+                         *[percentile(latencies, p) * 1000 for p in (50, 99, 100)], threads))
+    finally:
+        asgi_server.should_exit = True
+        asgi_thread.join()
+        server.shutdown()
+        mock.shutdown()
+        os.remove(fname)
+
+
+def benchmark_planner(n=5000, repeat=1000):
+    from planner import ChainPlanner
+    from metrics import MetricsRegistry, StepMetrics
+    services = synthetic_services(n, requires=2)
+    # give half of the services observed latencies
+    rng = random.Random(42)
+    metrics = MetricsRegistry()
+    for service in services.services[::2]:
+        step = StepMetrics(service.identifier)
+        step.network = rng.uniform(0.01, 2.0)
+        metrics.observe(step)
+    planner = ChainPlanner(services, metrics)
+    short_names = [t.split('/')[-1] for t in ANNOTATION_TYPES]
+    goals = [rng.sample(short_names, rng.randint(1, 3)) for _ in range(repeat)]
+    print("\nPlanner with %d services\n" % n)
+    # refresh() logs the size of the index with info()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        seconds = timeit(lambda: planner.refresh(force=True), 5)
+    report("build index and solve", seconds)
+    report("solve", timeit(planner._solve, 5))
+
+    def plan_all():
+        for types in goals:
+            planner._plans = {}
+            planner.plan(types)
+
+    report("plan (average over %d)" % repeat, timeit(plan_all, 1) / repeat)
+    chain = planner.plan(goals[0])
+    print("\nplan for %s: %d steps, cost %.3f seconds"
+          % (','.join(goals[0]), len(chain.services), sum(chain.costs)))
+
+
+def benchmark_resilience(requests=200, latency_ms=20, failure_percent=5, slow_percent=5):
+    import services
+    import mock_service
+    from policy import CallPolicies
+    mock = mock_service.serve(latency=latency_ms / 1000, failures=failure_percent / 100,
+                              slow=slow_percent / 100)
+    services.use_service_backend(mock.url)
+    # measure the services, not the result cache
+    services.RESULT_CACHE = None
+    policies = [('no retries', {'retries': 0}),
+                ('retries', {}),
+                ('retries and hedging at p90', {'hedge_percentile': 90})]
+    chain_input = {"discriminator": "http://vocab.lappsgrid.org/ns/media/text",
+                   "payload": mock_service.TEXT}
+    print("\nChain on mock services with %d ms latency, %d%% failing calls and %d%% calls"
+          " taking %d times longer, %d runs\n"
+          % (latency_ms, failure_percent, slow_percent, mock_service.SLOW_FACTOR, requests))
+    print("%-30s %8s %10s %10s %10s %8s %8s"
+          % ('policy', 'failed', 'p50 ms', 'p99 ms', 'max ms', 'retried', 'hedged'))
+    try:
+        # the services and chains log with info(), which is not shown here
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            chains = services.ServiceChains(LappsServices())
+        chain = chains.get_chain('stanford-tok-pos-sen-ner-par')
+        for name, settings in policies:
+            # breakers stay closed, they would only hide the failures
+            services.POLICIES = CallPolicies(defaults=dict(settings, breaker_failures=requests))
+
+            def run(_):
+                t0 = time.perf_counter()
+                result = chain.run(chain_input)
+                return time.perf_counter() - t0, services.is_error(result)
+
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    runs = list(pool.map(run, range(requests)))
+            latencies = [seconds for seconds, _ in runs]
+            states = services.POLICIES.as_json().values()
+            print("%-30s %8d %10.1f %10.1f %10.1f %8d %8d"
+                  % (name, sum(failed for _, failed in runs),
+                     *[percentile(latencies, p) * 1000 for p in (50, 99, 100)],
+                     sum(state['retried'] for state in states),
+                     sum(state['hedged'] for state in states)))
+    finally:
+        mock.shutdown()
+
+
+def synthetic_registry(directory, n, seed=42):
+    """Write service manager listings and a metadata file for n services in the
+    directory, in the layout of data/services."""
+    from mock_service import MockTool
+    rng = random.Random(seed)
+    short_names = [t.split('/')[-1] for t in ANNOTATION_TYPES]
+    os.makedirs(os.path.join(directory, 'info'))
+    os.makedirs(os.path.join(directory, 'metadata'))
+    elements = []
+    for i in range(n):
+        identifier = 'synthetic:service_%05d_1.0.0' % i
+        elements.append({'serviceId': identifier,
+                         'serviceName': identifier.split(':')[-1],
+                         'serviceDescription': 'Synthetic service number %d' % i,
+                         'serviceType': 'synthetic',
+                         'active': True})
+        produces = rng.sample(short_names, rng.randint(1, 3))
+        requires = rng.sample([t for t in short_names if t not in produces], rng.randint(0, 2))
+        metadata = MockTool('synthetic', requires, produces, None).metadata(identifier)
+        with open(os.path.join(directory, 'metadata', identifier + '.json'), 'w') as fh:
+            json.dump(metadata, fh, indent=4)
+    with open(os.path.join(directory, 'info', 'brandeis.json'), 'w') as fh:
+        json.dump(elements, fh, indent=4)
+    with open(os.path.join(directory, 'info', 'vassar.json'), 'w') as fh:
+        json.dump([], fh)
+
+
+def benchmark_startup(n=5000, repeat=5):
+    import services
+    directory = tempfile.mkdtemp()
+    synthetic_registry(directory, n)
+    services.BRANDEIS_SERVICES_INFO = os.path.join(directory, 'info', 'brandeis.json')
+    services.VASSAR_SERVICES_INFO = os.path.join(directory, 'info', 'vassar.json')
+    services.SERVICE_METADATA = os.path.join(directory, 'metadata')
+    snapshot = os.path.join(directory, 'registry.snapshot')
+    source_bytes = sum(os.path.getsize(os.path.join(root, fname))
+                       for root, _, fnames in os.walk(directory) for fname in fnames)
+    print("\nStartup with %d services\n" % n)
+    # loading the services logs with info()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        files = timeit(lambda: LappsServices(snapshot=False), repeat)
+        _, files_memory = retained_memory(lambda: LappsServices(snapshot=False))
+        LappsServices(snapshot=snapshot)
+        from_snapshot = timeit(lambda: LappsServices(snapshot=snapshot), repeat)
+        registry, snapshot_memory = retained_memory(lambda: LappsServices(snapshot=snapshot))
+        first_use = timeit(lambda: [s.metadata for s in registry.services], 1)
+    report("load from files", files)
+    report("load from snapshot", from_snapshot)
+    report("decode all metadata after snapshot", first_use)
+    print("%-40s %10.1f MB" % ("memory after loading from files", files_memory / 2**20))
+    print("%-40s %10.1f MB" % ("memory after loading from snapshot", snapshot_memory / 2**20))
+    print("%-40s %10.1f MB" % ("size of files", source_bytes / 2**20))
+    print("%-40s %10.1f MB" % ("size of snapshot", os.path.getsize(snapshot) / 2**20))
+    shutil.rmtree(directory)
+
+
+BENCHMARKS = {
+    'async': benchmark_async,
+    'categories': benchmark_categories,
+    'entities': benchmark_entities,
+    'html': benchmark_html,
+    'lif': benchmark_lif,
+    'load': benchmark_load,
+    'planner': benchmark_planner,
+    'resilience': benchmark_resilience,
+    'startup': benchmark_startup
+}
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        exit("Usage: python benchmarks.py (%s) [ARGS]" % '|'.join(sorted(BENCHMARKS)))
+    BENCHMARKS[sys.argv[1]](*[int(arg) for arg in sys.argv[2:]])
@@ -19,26 +19,71 @@ categories(self, services)
 
 chain(self, chain)
 
-result(self, result)
+timings(self, metrics)
+
+    Builds a table with the time spent in each step of a chain and the sizes
+    of the requests and responses.
+
+result(self, result, result_id=None)
+
+    Builds the tabs for a result. For stored results the content of the tabs
+    is created later by result_tab() and result_sub_tab(). The JSON in the LIF
+    and Annotations tabs of stored results is streamed and cut off after
+    DUMP_LIMIT characters, with a link to the complete JSON.
 
 """
 
 import os
 import io
 import json
-from flask import Markup
+import hashlib
+from flask import Markup, url_for
 
-from visualization import visualize
-from utils import dump
+import config
+from visualization import visualize, has_visualization
+from lif import LifView
+from utils import dump, iterdump_payload
 from html_utils import Tag, Text, Href, div, button
 
 
+# Number of characters of JSON shown in the LIF and Annotations tabs.
+DUMP_LIMIT = getattr(config, 'DUMP_LIMIT', 2**20)
+
+
 class HtmlBuilder(object):
 
     """Utility class to help create HTML code for the LAPPS-Flask site."""
 
     def categories(self, services):
-        """Builds an html <div> tag which contains a paragraph for each category."""
+        """Builds an html <div> tag which contains a paragraph for each category.
+        The result is cached with the services and only created again when
+        there is a new version of the services."""
+        return self._cached_categories(services, services.rendered)
+
+    def categories_etag(self, services):
+        """Return an ETag for the categories of the current version of the
+        services."""
+        # the cache is taken once, a refresh may replace it while this runs
+        rendered = services.rendered
+        etag = rendered.get('categories_etag')
+        if etag is None:
+            html = self._cached_categories(services, rendered)
+            etag = hashlib.md5(html.encode('utf-8')).hexdigest()
+            rendered['categories_etag'] = etag
+        return etag
+
+    def _cached_categories(self, services, rendered):
+        """Return the categories from the rendered cache, or render them and add
+        them to that cache. A refresh of the registry replaces its rendered
+        cache after the new categories are in, so HTML rendered for an older
+        version only ever ends up in the cache of that version."""
+        html = rendered.get('categories')
+        if html is None:
+            html = self._categories(services)
+            rendered['categories'] = html
+        return html
+
+    def _categories(self, services):
         div = Tag('div')
         for annotation_types in sorted(services.categories):
             p = Tag('p')
@@ -65,27 +110,131 @@ class HtmlBuilder(object):
             dd.add_all([Text(service.identifier), Tag('br')])
         return Markup(str(dl))
 
-    def result(self, result):
-        """Builds a <div> tag which contains the results of the analysis."""
-        text = result['payload']['text']['@value']
-        json_str = dump(result['payload'])
+    def timings(self, metrics):
+        """Builds a table with a row for each StepMetrics object in metrics, with
+        the time spent serializing the input, waiting for the service, on failed
+        attempts and retries and parsing the result, the request and response
+        sizes, the estimated bytes saved by sending only the required views and
+        the number of annotations in the result."""
+        header = ['step', 'service', 'serialize', 'network', 'retrying', 'deserialize', 'total',
+                  'request', 'response', 'saved', 'annotations', '']
+        table = Tag('table', attrs={'class': 'bordered timings', 'cellspacing': 0})
+        table.add(Tag('tr', dtrs=[Tag('th', dtrs=Text(h)) for h in header]))
+        for step, m in enumerate(metrics, start=1):
+            note = 'error' if m.error else 'cached' if m.cached else ''
+            cells = [str(step), m.service.split(':')[-1],
+                     _ms(m.serialize), _ms(m.network), _ms(m.retrying), _ms(m.deserialize),
+                     _ms(m.seconds() + m.retrying),
+                     _kb(m.request_bytes), _kb(m.response_bytes), _kb(m.saved_bytes),
+                     str(m.annotations), note]
+            table.add(Tag('tr', dtrs=[Tag('td', dtrs=Text(c)) for c in cells]))
+        totals = ['', 'total',
+                  _ms(sum(m.serialize for m in metrics)),
+                  _ms(sum(m.network for m in metrics)),
+                  _ms(sum(m.retrying for m in metrics)),
+                  _ms(sum(m.deserialize for m in metrics)),
+                  _ms(sum(m.seconds() + m.retrying for m in metrics)),
+                  _kb(sum(m.request_bytes for m in metrics)),
+                  _kb(sum(m.response_bytes for m in metrics)),
+                  _kb(sum(m.saved_bytes for m in metrics)), '', '']
+        table.add(Tag('tr', dtrs=[Tag('th', dtrs=Text(c)) for c in totals]))
+        return Markup(str(table))
+
+    def result(self, result, result_id=None):
+        """Builds a <div> tag which contains the results of the analysis. If the
+        result was stored with an identifier, only the tabs are created and the
+        content of a tab is loaded from the server when the tab is first
+        shown, see result_tab() and result_sub_tab()."""
         views = result['payload']['views']
-        buttons = [tab_button('Text'),
-                   tab_button('LIF')]
-        contents = [tab_text('Text', text),
-                    tab_text('LIF', json_str)]
-        ViewIdentifier.count = 0
-        for view in views:
-            view_identifier = view.get('id', ViewIdentifier.new())
-            annotation_types = view['metadata']['contains'].keys()
-            annotation_types = [os.path.basename(at) for at in annotation_types]
-            buttons.append(tab_button(view_identifier))
-            contents.append(tab_content(view_identifier, annotation_types, view, text))
+        identifiers = ['Text', 'LIF'] + view_identifiers(views)
+        buttons = [tab_button(identifier) for identifier in identifiers]
+        if result_id is None:
+            text = result['payload']['text']['@value']
+            annotations = [dump(view.get('annotations')) for view in views]
+            lif = ''.join(iterdump_payload(result['payload'], annotations.__getitem__))
+            contents = [tab_text('Text', text), tab_text('LIF', lif)]
+            for n, view in enumerate(views):
+                identifier = identifiers[n + 2]
+                contents.append(tab_content(identifier, annotation_types(view),
+                                            view, text, annotations[n]))
+        else:
+            urls = [url_for('result_tab', result_id=result_id, tab=tab)
+                    for tab in ['text', 'lif'] + [str(n) for n in range(len(views))]]
+            contents = [tab_lazy(identifier, 'tab_c1', url)
+                        for identifier, url in zip(identifiers, urls)]
         main_div = Tag('div')
         main_div.add(div({'class': 'tab'}, buttons))
         main_div.add_all(contents)
         return Markup(str(main_div))
 
+    def result_tab(self, stored, tab, limit=DUMP_LIMIT):
+        """Return the content of a top-level tab of a stored result, where tab is
+        text, lif or the number of a view. Returns None if there is no such tab.
+        The content of a view is the list of its sub tabs, which are loaded
+        lazily themselves. The content of the LIF tab is a generator of strings
+        with at most limit characters of JSON."""
+        if tab == 'text':
+            return str(result_pre(stored.text()))
+        if tab == 'lif':
+            more_url = url_for('result_tab', result_id=stored.identifier, tab=tab, full=1)
+            chunks = iterdump_payload(stored.result['payload'], stored.annotations_json)
+            return result_pre_stream(chunks, limit, more_url)
+        view = stored.view(int(tab)) if tab.isdigit() else None
+        if view is None:
+            return None
+        n = int(tab)
+        identifier = view_identifiers(stored.views())[n]
+        sub_identifiers = ['Metadata', 'Annotations'] + annotation_types(view)
+        sub_tabs = div({'class': 'tab2'},
+                       [tab_button_sub("%s:%s" % (identifier, sub))
+                        for sub in sub_identifiers])
+        contents = [tab_lazy("%s:%s" % (identifier, sub), 'tab_c2',
+                             url_for('result_sub_tab', result_id=stored.identifier,
+                                     view=n, sub=sub))
+                    for sub in sub_identifiers]
+        return str(Tag('div', dtrs=[sub_tabs] + contents))
+
+    def result_sub_tab(self, stored, n, sub, limit=DUMP_LIMIT):
+        """Return the content of the sub tab of view n of a stored result, where
+        the sub tab is Metadata, Annotations or an annotation type. Returns None
+        if there is no such sub tab. The content of the Annotations tab is a
+        generator of strings with at most limit characters of JSON."""
+        view = stored.view(n)
+        if view is None:
+            return None
+        if sub == 'Metadata':
+            return str(result_pre(dump(view.get('metadata'))))
+        if sub == 'Annotations':
+            more_url = url_for('result_sub_tab', result_id=stored.identifier,
+                               view=n, sub=sub, full=1)
+            return result_pre_stream([stored.annotations_json(n)], limit, more_url)
+        if sub not in annotation_types(view):
+            return None
+        identifier = "%s:%s" % (view_identifiers(stored.views())[n], sub)
+        if has_visualization(identifier):
+            return str(result_pre(visualize(identifier, stored.lif_view(n), stored.text())))
+        return str(annotations_table(
+            url_for('annotations', result_id=stored.identifier, view=n)))
+
+
+def _ms(seconds):
+    return "%.1f ms" % (seconds * 1000)
+
+
+def _kb(size):
+    return "%.1f KB" % (size / 1024)
+
+
+def view_identifiers(views):
+    """Return the identifiers of the views, views without an identifier are named
+    after their position."""
+    return [view.get('id', "View-%d" % n) for n, view in enumerate(views, start=1)]
+
+
+def annotation_types(view):
+    """Return the short names of the annotation types in a view."""
+    return [os.path.basename(at) for at in view['metadata']['contains'].keys()]
+
 
 def tab_button(identifier):
     """The button used for a top-level clickable tab."""
@@ -109,10 +258,41 @@ def tab_text_sub(identifier, content):
 
 def tab_text_aux(identifier, _class, content):
     return div({'id': identifier, 'class': _class, 'style': "display: none;"},
-               div({'class': 'result pre'}, Text(content)))
+               result_pre(content))
+
 
+def tab_lazy(identifier, _class, url):
+    """A tab whose content is loaded from the URL when it is first shown, see
+    display() in tabs.js."""
+    return div({'id': identifier, 'class': _class, 'style': "display: none;",
+                'data-url': url},
+               Text('Loading...'))
 
-def tab_content(identifier, annotation_types, view, text):
+
+def result_pre(content):
+    return div({'class': 'result pre'}, Text(content))
+
+
+def result_pre_stream(chunks, limit=None, more_url=None):
+    """Generate the HTML of result_pre() for content that is given in chunks. With
+    a limit the content is cut off after that many characters and followed by a
+    link to the more_url."""
+    yield '\n<div class="result pre">'
+    size = 0
+    for chunk in chunks:
+        if limit is not None and size + len(chunk) > limit:
+            yield chunk[:limit - size]
+            yield '\n</div>\n'
+            yield str(div({'class': 'more'},
+                          Tag('a', attrs={'href': more_url, 'target': '_blank'},
+                              dtrs=Text('show more'))))
+            return
+        size += len(chunk)
+        yield chunk
+    yield '\n</div>\n'
+
+
+def tab_content(identifier, annotation_types, view, text, annotations_json):
     meta_id = "%s:Metadata" % identifier
     anno_id = "%s:Annotations" % identifier
     content = div({'id': identifier, 'class': 'tab_c1', 'style': "display: none;"}, [])
@@ -120,18 +300,20 @@ def tab_content(identifier, annotation_types, view, text):
                                [tab_button_sub(meta_id), tab_button_sub(anno_id)]))
     content.add_all([
         tab_text_sub(meta_id, dump(view.get('metadata'))),
-        tab_text_sub(anno_id, dump(view.get('annotations')))])
+        tab_text_sub(anno_id, annotations_json)])
+    lif_view = LifView(view)
     for annotation_type in annotation_types:
         id_sub = identifier + ':' + annotation_type
         sub_tabs.add(tab_button_sub(id_sub))
-        content.add(tab_text_sub(id_sub, visualize(id_sub, view, text)))
+        content.add(tab_text_sub(id_sub, visualize(id_sub, lif_view, text)))
     return content
 
-        
-class ViewIdentifier(object):
-    """Class that generates new view identifiers if needed."""
-    count = 0
-    @classmethod
-    def new(cls):
-        ViewIdentifier.count += 1
-        return "View-%d" % ViewIdentifier.count
+
+def annotations_table(annotations_url):
+    """A table of annotations that is filled in a page at a time from the
+    annotations URL, see loadAnnotations() in tabs.js."""
+    return div({'class': 'result annotations', 'data-url': annotations_url,
+                'data-offset': 0},
+               [div({'class': 'rows'}, Text('&nbsp;')),
+                button({'class': 'more', 'onclick': "loadAnnotations(this)"},
+                       Text('more'))])
@@ -0,0 +1,218 @@
+"""cache.py
+
+Content-addressed cache for the results of LAPPS services and service chains.
+
+Keys are created from the identifier and version of a service and a hash of the
+JSON input, so a key only ever refers to one result:
+
+>>> key = RESULT_CACHE.key(service.identifier, version, digest(input_string))
+>>> RESULT_CACHE.put(key, result)
+>>> RESULT_CACHE.get(key)
+
+There are two tiers. The memory tier is an LRU cache of JSON objects and the
+disk tier stores results as JSON files in RESULT_CACHE_DIR. Both tiers have a
+size limit in bytes and entries expire after RESULT_CACHE_TTL seconds. Results
+handed out by the cache are shared, so they should not be changed by callers.
+
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import config
+
+
+# Set to False to switch off all caching of results.
+RESULT_CACHING = getattr(config, 'RESULT_CACHING', True)
+
+# Size limits in bytes of the two tiers, the disk directory, and the number of
+# seconds a result stays valid.
+RESULT_CACHE_MEMORY = getattr(config, 'RESULT_CACHE_MEMORY', 100 * 2**20)
+RESULT_CACHE_DISK = getattr(config, 'RESULT_CACHE_DISK', 1024 * 2**20)
+RESULT_CACHE_DIR = getattr(config, 'RESULT_CACHE_DIR', 'data/cache/results')
+RESULT_CACHE_TTL = getattr(config, 'RESULT_CACHE_TTL', 7 * 24 * 3600)
+
+
+def digest(string):
+    """Return the SHA-256 hash of a string."""
+    return hashlib.sha256(string.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+
+    """Two-tier LRU cache with size limits, expiration and hit/miss counters. It
+    can be used from several threads at the same time."""
+
+    def __init__(self, memory_size=RESULT_CACHE_MEMORY, disk_size=RESULT_CACHE_DISK,
+                 directory=RESULT_CACHE_DIR, ttl=RESULT_CACHE_TTL):
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.directory = directory
+        self.ttl = ttl
+        # key -> (time created, size in bytes, JSON object)
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        # the bytes used on disk are only counted when the disk is first used
+        self.disk_bytes = None
+        self.counts = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+                       'stores': 0, 'evictions': 0, 'expirations': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """Return a key created from the string value of all the parts."""
+        return digest('\t'.join(str(p) for p in parts))
+
+    def get(self, key):
+        """Return the object stored under the key or None if there is none."""
+        with self._lock:
+            obj = self._get_from_memory(key)
+            if obj is not None:
+                self.counts['memory_hits'] += 1
+                return obj
+        created, size, obj = self._get_from_disk(key)
+        with self._lock:
+            if obj is None:
+                self.counts['misses'] += 1
+                return None
+            self.counts['disk_hits'] += 1
+            self._put_in_memory(key, created, size, obj)
+            return obj
+
+    def put(self, key, obj):
+        """Store a JSON object in both tiers."""
+        created = time.time()
+        entry = json.dumps({'created': created, 'result': obj})
+        size = len(entry)
+        with self._lock:
+            self.counts['stores'] += 1
+            self._put_in_memory(key, created, size, obj)
+        if self.directory is not None and size <= self.disk_size:
+            self._put_on_disk(key, entry)
+
+    def _expired(self, created):
+        return self.ttl is not None and created + self.ttl < time.time()
+
+    def _get_from_memory(self, key):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[0]):
+            self.counts['expirations'] += 1
+            self._remove_from_memory(key)
+            return None
+        self.memory.move_to_end(key)
+        return entry[2]
+
+    def _put_in_memory(self, key, created, size, obj):
+        if size > self.memory_size:
+            return
+        if key in self.memory:
+            self._remove_from_memory(key)
+        self.memory[key] = (created, size, obj)
+        self.memory_bytes += size
+        while self.memory_bytes > self.memory_size:
+            self.counts['evictions'] += 1
+            self._remove_from_memory(next(iter(self.memory)))
+
+    def _remove_from_memory(self, key):
+        created, size, obj = self.memory.pop(key)
+        self.memory_bytes -= size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def _get_from_disk(self, key):
+        if self.directory is None:
+            return None, None, None
+        path = self._path(key)
+        try:
+            with open(path) as fh:
+                entry = fh.read()
+                file_size = os.fstat(fh.fileno()).st_size
+            # touch the file so eviction from disk is least recently used
+            os.utime(path)
+        except OSError:
+            return None, None, None
+        entry_obj = json.loads(entry)
+        if self._expired(entry_obj['created']):
+            removed = self._remove_from_disk(path)
+            with self._lock:
+                self.counts['expirations'] += 1
+                if removed and self.disk_bytes is not None:
+                    self.disk_bytes = max(0, self.disk_bytes - file_size)
+            return None, None, None
+        return entry_obj['created'], len(entry), entry_obj['result']
+
+    def _put_on_disk(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(entry)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(size for path, mtime, size in self._disk_files())
+            else:
+                self.disk_bytes += len(entry)
+            if self.disk_bytes > self.disk_size:
+                self._evict_from_disk()
+
+    def _disk_files(self):
+        """Return (path, mtime, size) triples for all files in the disk tier."""
+        files = []
+        for root, dirs, fnames in os.walk(self.directory):
+            for fname in fnames:
+                if fname.endswith('.json'):
+                    path = os.path.join(root, fname)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((path, stat.st_mtime, stat.st_size))
+        return files
+
+    def _evict_from_disk(self):
+        """Remove the least recently used files until the disk tier is at 90% of
+        its maximum size, so we do not have to do this for every new entry."""
+        files = sorted(self._disk_files(), key=lambda f: f[1])
+        self.disk_bytes = sum(f[2] for f in files)
+        for path, mtime, size in files:
+            if self.disk_bytes <= self.disk_size * 0.9:
+                break
+            self._remove_from_disk(path)
+            self.disk_bytes -= size
+            self.counts['evictions'] += 1
+
+    @staticmethod
+    def _remove_from_disk(path):
+        """Remove the file, returns False if it was already removed."""
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
+
+    def stats(self):
+        """Return a dictionary with counters and sizes."""
+        with self._lock:
+            stats = dict(self.counts)
+            stats['memory_entries'] = len(self.memory)
+            stats['memory_bytes'] = self.memory_bytes
+            stats['disk_bytes'] = self.disk_bytes
+            return stats
+
+    def clear(self):
+        """Remove everything from the memory tier."""
+        with self._lock:
+            self.memory = OrderedDict()
+            self.memory_bytes = 0
+
+
+RESULT_CACHE = ResultCache() if RESULT_CACHING else None
@@ -0,0 +1,261 @@
+"""clients.py
+
+Factory for the zeep clients used to talk to LAPPS services.
+
+All services on a server share one requests session with a pooled keep-alive
+connection adapter and one zeep transport, so TCP and TLS connections are
+reused between services on the same host. WSDL documents are cached on disk by
+the zeep transport and parsed clients are cached in memory, so a WSDL is parsed
+only once per process:
+
+>>> client = CLIENTS.get_client('brandeis', wsdl_url)
+>>> client.service.getMetadata()
+
+ASYNC_CLIENTS does the same for zeep's asyncio clients, which send SOAP calls
+with an httpx connection pool so that one thread can wait for many calls at the
+same time. It needs httpx (pip3 install httpx) and is used from one event loop:
+
+>>> client = await ASYNC_CLIENTS.get_client('brandeis', wsdl_url)
+>>> await client.service.execute(input_string)
+
+Pool sizes, timeouts and the location of the WSDL cache can be set in
+config.py, see config.sample.py.
+
+"""
+
+import os
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+
+import requests
+import zeep
+from zeep.cache import SqliteCache
+
+try:
+    import httpx
+except ImportError:
+    # only needed for the asyncio clients
+    httpx = None
+
+import config
+from config import BRANDEIS_USER, BRANDEIS_PASSWORD
+from config import VASSAR_USER, VASSAR_PASSWORD
+
+
+# Maximum number of connections kept alive per host.
+POOL_SIZE = getattr(config, 'POOL_SIZE', 32)
+
+# Maximum number of connections per host of the asyncio clients, which is the
+# number of calls to one server that can be waiting at the same time.
+ASYNC_POOL_SIZE = getattr(config, 'ASYNC_POOL_SIZE', 256)
+
+# Number of seconds to wait for loading a WSDL document and for a SOAP call,
+# None means to wait forever, which is what zeep does by default.
+WSDL_TIMEOUT = getattr(config, 'WSDL_TIMEOUT', 30)
+OPERATION_TIMEOUT = getattr(config, 'OPERATION_TIMEOUT', None)
+
+# Where WSDL documents are cached and for how many seconds they are kept.
+WSDL_CACHE = getattr(config, 'WSDL_CACHE', 'data/services/wsdl.sqlite')
+WSDL_CACHE_TIMEOUT = getattr(config, 'WSDL_CACHE_TIMEOUT', 7 * 24 * 3600)
+
+CREDENTIALS = {
+    'brandeis': (BRANDEIS_USER, BRANDEIS_PASSWORD),
+    'vassar': (VASSAR_USER, VASSAR_PASSWORD)
+}
+
+
+class PooledTransport(zeep.transports.Transport):
+
+    """A zeep transport that is shared between threads. The operation timeout
+    can be overruled for the current thread only with call_timeout(), which
+    zeep's own settings() cannot do because it changes the shared transport."""
+
+    def __init__(self, *args, **kwargs):
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    @property
+    def operation_timeout(self):
+        return getattr(self._local, 'timeout', self._operation_timeout)
+
+    @operation_timeout.setter
+    def operation_timeout(self, timeout):
+        self._operation_timeout = timeout
+
+    @contextmanager
+    def call_timeout(self, timeout):
+        self._local.timeout = timeout
+        try:
+            yield
+        finally:
+            del self._local.timeout
+
+
+class ClientFactory(object):
+
+    """Creates and caches zeep clients. Transports are shared per server and
+    clients are shared per WSDL URL."""
+
+    def __init__(self, pool_size=POOL_SIZE, wsdl_timeout=WSDL_TIMEOUT,
+                 operation_timeout=OPERATION_TIMEOUT, wsdl_cache=WSDL_CACHE):
+        self.pool_size = pool_size
+        self.wsdl_timeout = wsdl_timeout
+        self.operation_timeout = operation_timeout
+        self.wsdl_cache = wsdl_cache
+        self.transports = {}
+        self.clients = {}
+        self._lock = threading.Lock()
+        # one lock per WSDL so that different WSDLs can be parsed in parallel
+        # while the same WSDL is never parsed twice
+        self._wsdl_locks = {}
+
+    def get_transport(self, server):
+        """Return the zeep transport for the server, create it if needed."""
+        with self._lock:
+            transport = self.transports.get(server)
+            if transport is None:
+                transport = self._create_transport(server)
+                self.transports[server] = transport
+            return transport
+
+    def _create_transport(self, server):
+        if server not in CREDENTIALS:
+            exit("Unknown server: %s" % server)
+        session = requests.Session()
+        session.auth = requests.auth.HTTPBasicAuth(*CREDENTIALS[server])
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        cache = None
+        if self.wsdl_cache is not None:
+            os.makedirs(os.path.dirname(self.wsdl_cache) or '.', exist_ok=True)
+            cache = SqliteCache(path=self.wsdl_cache, timeout=WSDL_CACHE_TIMEOUT)
+        return PooledTransport(
+            session=session, cache=cache, timeout=self.wsdl_timeout,
+            operation_timeout=self.operation_timeout)
+
+    def get_client(self, server, wsdl):
+        """Return the client for the WSDL URL, create it if needed."""
+        client = self.clients.get(wsdl)
+        if client is not None:
+            return client
+        with self._lock:
+            wsdl_lock = self._wsdl_locks.setdefault(wsdl, threading.Lock())
+        transport = self.get_transport(server)
+        with wsdl_lock:
+            client = self.clients.get(wsdl)
+            if client is None:
+                client = zeep.Client(wsdl, transport=transport)
+                self.clients[wsdl] = client
+        return client
+
+    def reset(self):
+        """Forget all transports and clients."""
+        with self._lock:
+            for transport in self.transports.values():
+                transport.session.close()
+            self.transports = {}
+            self.clients = {}
+            self._wsdl_locks = {}
+
+    def forget(self):
+        """Forget all transports and clients without closing them or waiting for
+        locks. Used in a forked process, whose connections are shared with the
+        parent process and whose locks may have been held by parent threads."""
+        self._lock = threading.Lock()
+        self.transports = {}
+        self.clients = {}
+        self._wsdl_locks = {}
+
+
+class AsyncClientFactory(object):
+
+    """Creates and caches zeep asyncio clients, with one transport per server and
+    one client per WSDL URL like ClientFactory. The transports keep their httpx
+    connection pools and must only be used from one event loop. WSDL documents
+    are still loaded synchronously by zeep, so clients are created in a thread
+    of the event loop's default executor."""
+
+    def __init__(self, pool_size=ASYNC_POOL_SIZE, wsdl_timeout=WSDL_TIMEOUT,
+                 operation_timeout=OPERATION_TIMEOUT, wsdl_cache=WSDL_CACHE):
+        self.pool_size = pool_size
+        self.wsdl_timeout = wsdl_timeout
+        self.operation_timeout = operation_timeout
+        self.wsdl_cache = wsdl_cache
+        self.transports = {}
+        self.clients = {}
+        # clients being created, so callers asking for the same WSDL wait for
+        # the same client
+        self._pending = {}
+
+    def get_transport(self, server):
+        """Return the zeep transport for the server, create it if needed."""
+        transport = self.transports.get(server)
+        if transport is None:
+            transport = self._create_transport(server)
+            self.transports[server] = transport
+        return transport
+
+    def _create_transport(self, server):
+        if httpx is None:
+            raise RuntimeError("The asyncio clients need httpx, use pip3 install httpx")
+        if server not in CREDENTIALS:
+            exit("Unknown server: %s" % server)
+        auth = httpx.BasicAuth(*CREDENTIALS[server])
+        limits = httpx.Limits(max_connections=self.pool_size,
+                              max_keepalive_connections=self.pool_size)
+        cache = None
+        if self.wsdl_cache is not None:
+            os.makedirs(os.path.dirname(self.wsdl_cache) or '.', exist_ok=True)
+            cache = SqliteCache(path=self.wsdl_cache, timeout=WSDL_CACHE_TIMEOUT)
+        return zeep.transports.AsyncTransport(
+            client=httpx.AsyncClient(auth=auth, limits=limits,
+                                     timeout=self.operation_timeout),
+            wsdl_client=httpx.Client(auth=auth, timeout=self.wsdl_timeout),
+            cache=cache)
+
+    async def get_client(self, server, wsdl):
+        """Return the client for the WSDL URL, create it if needed."""
+        client = self.clients.get(wsdl)
+        if client is not None:
+            return client
+        future = self._pending.get(wsdl)
+        if future is None:
+            create = functools.partial(zeep.AsyncClient, wsdl, transport=self.get_transport(server))
+            future = asyncio.get_running_loop().run_in_executor(None, create)
+            future.add_done_callback(functools.partial(self._created, wsdl))
+            self._pending[wsdl] = future
+        # a caller that is cancelled does not cancel the creation for the others
+        return await asyncio.shield(future)
+
+    def _created(self, wsdl, future):
+        self._pending.pop(wsdl, None)
+        if not future.cancelled() and future.exception() is None:
+            self.clients[wsdl] = future.result()
+
+    async def aclose(self):
+        """Close the connections and forget all transports and clients."""
+        transports = list(self.transports.values())
+        self.forget()
+        for transport in transports:
+            await transport.aclose()
+            transport.wsdl_client.close()
+
+    def forget(self):
+        """Forget all transports and clients without closing them."""
+        self.transports = {}
+        self.clients = {}
+        self._pending = {}
+
+
+CLIENTS = ClientFactory()
+ASYNC_CLIENTS = AsyncClientFactory()
+
+# a forked process, for example a worker of the server in wsgi.py, creates its
+# own clients and connections
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=CLIENTS.forget)
+    os.register_at_fork(after_in_child=ASYNC_CLIENTS.forget)
@@ -4,3 +4,124 @@ BRANDEIS_PASSWORD = '<brandeis-password>'
 
 VASSAR_USER = '<vassar-username>'
 VASSAR_PASSWORD = '<vassar-username>'
+
+# Optional settings, the values below are the defaults.
+
+# BOOTSTRAP_WORKERS = 16
+# METADATA_TIMEOUT = 30
+
+# Snapshot of the service registry used for fast startups, None to switch off.
+# REGISTRY_SNAPSHOT = 'data/services/registry.snapshot'
+
+# Background refresh of the registry: seconds between refreshes (None to only
+# refresh on a POST to /api/registry), seconds after which metadata are fetched
+# again, and the number of metadata requests sent at the same time.
+# REFRESH_INTERVAL = 86400
+# METADATA_TTL = 604800
+# REFRESH_WORKERS = 4
+
+# Connection pool size per server, timeouts in seconds for loading WSDL
+# documents and for SOAP calls (None means no timeout, calls of execute use
+# SERVICE_TIMEOUT below), and the on-disk WSDL cache (None means no disk cache).
+# POOL_SIZE = 32
+# WSDL_TIMEOUT = 30
+# OPERATION_TIMEOUT = None
+# WSDL_CACHE = 'data/services/wsdl.sqlite'
+# WSDL_CACHE_TIMEOUT = 604800
+
+# Connections per server of the asyncio clients used by asgi.py, which is the
+# number of calls to one server that can be in flight at the same time.
+# ASYNC_POOL_SIZE = 256
+
+# Calls of services, see policy.py: timeout in seconds, retries of failed calls
+# and the seconds before the first retry, the percentile of recent latencies
+# after which a slow call is sent again (None for never) and the number of
+# recent calls that needs, and the failed calls in a row after which a circuit
+# breaker opens and the seconds until it lets a trial call through. Settings
+# for single services go in SERVICE_POLICIES, for example
+# {'brandeis_eldrad_grid_1:stanfordnlp.parser_2.0.4': {'timeout': 600, 'retries': 0}}.
+# SERVICE_TIMEOUT = 120
+# SERVICE_RETRIES = 2
+# RETRY_BACKOFF = 0.5
+# HEDGE_PERCENTILE = None
+# HEDGE_MIN_CALLS = 20
+# BREAKER_FAILURES = 5
+# BREAKER_RESET = 30
+# SERVICE_POLICIES = {}
+
+# Caching of service and chain results, sizes are in bytes and the time to
+# live is in seconds.
+# RESULT_CACHING = True
+# RESULT_CACHE_MEMORY = 104857600
+# RESULT_CACHE_DISK = 1073741824
+# RESULT_CACHE_DIR = 'data/cache/results'
+# RESULT_CACHE_TTL = 604800
+
+# Send services only the views with the annotation types they require and merge
+# the views they add into the document locally.
+# DELTA_TRANSFER = True
+
+# Chain definitions, and the number of steps of a chain that can run at the same
+# time. Steps that do not need each other's annotations run in parallel.
+# CHAINS_FILE = 'data/chains.json'
+# CHAIN_WORKERS = 8
+
+# Chain planner: the cost in seconds of a service that was not called yet, and
+# the seconds after which the costs of services are updated from the metrics.
+# PLANNER_DEFAULT_COST = 1.0
+# PLANNER_REFRESH = 60
+
+# Batch mode: documents processed at the same time by each step of a chain, and
+# the maximum number of documents in the pipeline.
+# BATCH_STEP_WORKERS = 4
+# BATCH_WINDOW = 64
+
+# Directory on the server whose subdirectories can be given as the dir variable
+# of /run_chain_batch, None to not allow reading documents from the server.
+# BATCH_DIRECTORY_ROOT = 'data/corpora'
+
+# Background jobs: chains running at the same time, jobs that can wait in the
+# queue, finished jobs that are kept for polling, and the directory where they
+# are shared between processes (see wsgi.py).
+# JOB_WORKERS = 4
+# JOB_QUEUE = 32
+# JOB_KEEP = 100
+# JOB_STORE_DIR = 'data/cache/jobs'
+
+# Fetching input documents: maximum size in bytes, timeouts in seconds, bytes
+# kept in the cache, and hosts whose get_file URLs are read from disk.
+# INPUT_MAX_SIZE = 10485760
+# INPUT_CONNECT_TIMEOUT = 5
+# INPUT_READ_TIMEOUT = 30
+# INPUT_CACHE_SIZE = 52428800
+# LOCAL_HOSTS = ['127.0.0.1:5000', 'localhost:5000']
+
+# Number of chain results kept on the server for loading parts of result pages,
+# and the directory where they are shared between processes (see wsgi.py).
+# RESULT_STORE_SIZE = 50
+# RESULT_STORE_DIR = 'data/cache/stored'
+
+# Number of characters of JSON shown in the LIF and Annotations tabs of a result,
+# the tabs have a link to the complete JSON.
+# DUMP_LIMIT = 1048576
+
+# Upper bounds of the histogram buckets on /metrics, for the seconds spent in
+# service calls, the sizes in bytes of requests and responses, and the number
+# of annotations in results.
+# METRICS_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# METRICS_BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# METRICS_ANNOTATIONS_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Number of recent calls of a service used for the latency percentiles on
+# /api/health and for hedging.
+# METRICS_LATENCY_WINDOW = 1000
+
+# Server that stands in for the LAPPS Grid, for example the mock started with
+# "python mock_service.py", and the latency in seconds of each call to the mock
+# and its random variation as a fraction, and the fractions of calls to the mock
+# that fail and that are slow.
+# SERVICE_BACKEND = 'http://127.0.0.1:5001'
+# MOCK_LATENCY = 0.05
+# MOCK_JITTER = 0.2
+# MOCK_FAILURES = 0.0
+# MOCK_SLOW = 0.0
@@ -0,0 +1,167 @@
+"""fetch.py
+
+Fetching the input documents for service chains.
+
+The InputFetcher uses one pooled requests session with timeouts, stops reading
+when a document is larger than the maximum size, and reads files directly from
+disk when the URL points at the get_file endpoint of this site. Fetched
+documents are cached by URL and revalidated with ETag and Last-Modified headers:
+
+>>> fetcher = InputFetcher(local_hosts=['127.0.0.1:5000'])
+>>> text = fetcher.fetch('http://127.0.0.1:5000/get_file?fname=data/example.txt')
+
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+import config
+
+
+# Maximum size in bytes of an input document.
+INPUT_MAX_SIZE = getattr(config, 'INPUT_MAX_SIZE', 10 * 2**20)
+
+# Timeouts in seconds for connecting and for reading.
+INPUT_CONNECT_TIMEOUT = getattr(config, 'INPUT_CONNECT_TIMEOUT', 5)
+INPUT_READ_TIMEOUT = getattr(config, 'INPUT_READ_TIMEOUT', 30)
+
+# Number of bytes of fetched documents kept in the cache.
+INPUT_CACHE_SIZE = getattr(config, 'INPUT_CACHE_SIZE', 50 * 2**20)
+
+# Hosts that are this site, URLs with the get_file endpoint on these hosts are
+# read from disk. The host of the current request is also treated as local.
+LOCAL_HOSTS = getattr(config, 'LOCAL_HOSTS', ['127.0.0.1:5000', 'localhost:5000'])
+
+CHUNK_SIZE = 64 * 1024
+
+
+class InputTooLarge(Exception):
+    pass
+
+
+class InvalidInput(Exception):
+
+    """Raised when there is no input URL, when it is not valid, or when it points
+    at a file on this site that cannot be read."""
+
+
+class InputUnavailable(Exception):
+
+    """Raised when the input cannot be fetched from another site."""
+
+
+class InputFetcher(object):
+
+    def __init__(self, max_size=INPUT_MAX_SIZE, cache_size=INPUT_CACHE_SIZE,
+                 local_hosts=LOCAL_HOSTS, pool_size=8,
+                 timeout=(INPUT_CONNECT_TIMEOUT, INPUT_READ_TIMEOUT)):
+        self.max_size = max_size
+        self.cache_size = cache_size
+        self.local_hosts = set(local_hosts)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # url -> (etag, last_modified, text)
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, url, local_host=None):
+        """Return the text at the URL. The local_host is the host of the current
+        request, which is treated as local for this call only, so that hosts
+        sent by clients are not collected. Raises InputTooLarge if the document
+        is larger than the maximum size, InvalidInput for a URL that cannot be
+        used and InputUnavailable if the document cannot be fetched."""
+        if not url:
+            raise InvalidInput("No input URL given")
+        fname = self._local_file(url, local_host)
+        if fname is not None:
+            try:
+                return self._read_file(fname)
+            except OSError as e:
+                raise InvalidInput("Cannot read %s: %s" % (fname, e.strerror))
+        try:
+            return self._fetch_url(url)
+        except (requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema,
+                requests.exceptions.InvalidURL) as e:
+            raise InvalidInput("Invalid input URL %s: %s" % (url, e))
+        except requests.exceptions.RequestException as e:
+            raise InputUnavailable("Cannot fetch %s: %s" % (url, e))
+
+    def _local_file(self, url, local_host=None):
+        """Return the file name if the URL is for the get_file endpoint on this
+        site, return None otherwise."""
+        parsed = urlparse(url)
+        local = parsed.netloc in self.local_hosts or parsed.netloc == local_host
+        if local and parsed.path == '/get_file':
+            fnames = parse_qs(parsed.query).get('fname')
+            if fnames:
+                return fnames[0]
+        return None
+
+    def _read_file(self, fname):
+        if os.path.getsize(fname) > self.max_size:
+            raise InputTooLarge("%s is larger than %d bytes" % (fname, self.max_size))
+        with open(fname) as fh:
+            return fh.read()
+
+    def _fetch_url(self, url):
+        with self._lock:
+            cached = self.cache.get(url)
+        headers = {}
+        if cached is not None:
+            etag, last_modified, text = cached
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+        with self.session.get(url, headers=headers, stream=True,
+                              timeout=self.timeout) as response:
+            if response.status_code == 304 and cached is not None:
+                with self._lock:
+                    if url in self.cache:
+                        self.cache.move_to_end(url)
+                return cached[2]
+            response.raise_for_status()
+            text = self._read_response(url, response)
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+        if etag is not None or last_modified is not None:
+            self._cache(url, etag, last_modified, text)
+        return text
+
+    def _read_response(self, url, response):
+        length = response.headers.get('Content-Length')
+        if length is not None and length.isdigit() and int(length) > self.max_size:
+            raise InputTooLarge("%s is larger than %d bytes" % (url, self.max_size))
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            if size > self.max_size:
+                raise InputTooLarge("%s is larger than %d bytes" % (url, self.max_size))
+            chunks.append(chunk)
+        return b''.join(chunks).decode(response.encoding or 'utf-8', errors='replace')
+
+    def _cache(self, url, etag, last_modified, text):
+        size = len(text)
+        if size > self.cache_size:
+            return
+        with self._lock:
+            if url in self.cache:
+                self.cache_bytes -= len(self.cache.pop(url)[2])
+            self.cache[url] = (etag, last_modified, text)
+            self.cache_bytes += size
+            while self.cache_bytes > self.cache_size:
+                old_url, (etag, last_modified, old_text) = self.cache.popitem(last=False)
+                self.cache_bytes -= len(old_text)
+
+
+INPUT_FETCHER = InputFetcher()
@@ -0,0 +1,41 @@
+"""gunicorn.conf.py
+
+Settings for running the application in several processes, see wsgi.py:
+
+$ gunicorn -c gunicorn.conf.py
+
+Settings given on the command line overrule the ones below, for example use
+--workers 4 --bind 0.0.0.0:8000.
+
+"""
+
+import gc
+import multiprocessing
+
+
+wsgi_app = 'wsgi:application'
+bind = '127.0.0.1:8000'
+
+# Most of the time of a request is spent waiting for services, so each worker
+# runs several requests at the same time in threads.
+workers = multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = 8
+
+# Running a chain can take minutes.
+timeout = 600
+
+# Load the application in the master process so that the registry is loaded
+# once and shared with the workers.
+preload_app = True
+
+
+def when_ready(server):
+    """Called in the master process after the application was loaded and before
+    the workers are forked. The objects created so far are moved to a generation
+    that the garbage collector does not visit, otherwise a collection in a worker
+    would write to all their memory pages and make the worker copy them."""
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+        server.log.info("Froze %d objects before forking workers" % gc.get_freeze_count())
@@ -58,32 +58,82 @@ There are also some abbreviations:
 
 """
 
-import io
+
+# Tags that are written on their own lines.
+BLOCK_TAGS = frozenset(['div', 'table', 'tr', 'td', 'p', 'blockquote', 'ol', 'ul'])
+
+# Size in characters of the chunks handed out by HtmlObject.stream().
+CHUNK_SIZE = 16 * 1024
 
 
 class HtmlObject(object):
 
     """Abstract class."""
 
+    __slots__ = ()
+
     def __str__(self):
-        buffer = io.StringIO()
-        self.write(buffer)
-        return buffer.getvalue()
+        return ''.join(self.stream())
+
+    def write(self, buffer, indent=''):
+        for chunk in self.stream(indent=indent):
+            buffer.write(chunk)
+
+    def stream(self, indent='', chunk_size=CHUNK_SIZE):
+        """Generate the HTML string in chunks of about chunk_size characters, for
+        example to hand to a Flask streaming response. The tree is walked with
+        an explicit stack so deep trees do not hit the recursion limit."""
+        parts = []
+        size = 0
+        # items are (object, indentation, True if the tag needs to be closed)
+        stack = [(self, indent, False)]
+        while stack:
+            obj, indent, closing = stack.pop()
+            if closing:
+                if obj.is_block():
+                    part = "\n%s</%s>\n" % (indent, obj.tag)
+                else:
+                    part = "</%s>" % obj.tag
+            elif isinstance(obj, Text):
+                part = obj.text.strip()
+            else:
+                block = obj.is_block()
+                attrs = obj._attribute_string()
+                if not obj.dtrs:
+                    part = "%s<%s%s/>" % (indent, obj.tag, attrs)
+                    if block:
+                        part = "\n%s\n" % part
+                else:
+                    part = "%s<%s%s>" % (indent, obj.tag, attrs)
+                    if block:
+                        part = "\n" + part
+                    stack.append((obj, indent, True))
+                    dtr_indent = indent + '  '
+                    stack.extend((dtr, dtr_indent, False) for dtr in reversed(obj.dtrs))
+            parts.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield ''.join(parts)
+                parts = []
+                size = 0
+        if parts:
+            yield ''.join(parts)
+
 
-    
 class Text(HtmlObject):
 
     """Class that implements a text span."""
 
+    __slots__ = ('text',)
+
     def __init__(self, text):
         self.text = text
 
-    def write(self, buffer, indent=''):
-        buffer.write(self.text.strip())
-
 
 class Tag(HtmlObject):
 
+    __slots__ = ('tag', 'nl', 'attrs', 'dtrs')
+
     def __init__(self, tag, nl=True, attrs=None, dtrs=None):
         self.tag = tag
         self.nl = nl
@@ -98,8 +148,7 @@ class Tag(HtmlObject):
                 self.dtrs = [dtrs]
 
     def is_block(self):
-        block_tags = {'div', 'table', 'tr', 'td', 'p', 'blockquote', 'ol', 'ul'}
-        return self.tag.lower() in block_tags
+        return self.tag.lower() in BLOCK_TAGS
 
     def add(self, dtr):
         """Add a daughter, which is either a Tag or Text instance."""
@@ -110,35 +159,16 @@ class Tag(HtmlObject):
         """Add a list of daughters, which are either Tag or Text instances."""
         self.dtrs.extend(dtrs)
 
-    def write(self, buffer, indent=''):
-        attrs = self._attribute_string()
-        if self.is_block():
-               buffer.write("\n")
-        if not self.dtrs:
-            buffer.write("%s<%s%s/>" % (indent, self.tag, attrs))
-        else:
-            buffer.write("%s<%s%s>" % (indent, self.tag, attrs))
-            for dtr in self.dtrs:
-                dtr.write(buffer, indent=indent+'  ')
-            if self.is_block():
-                buffer.write("\n%s</%s>" % (indent, self.tag))
-            else:
-                buffer.write("</%s>" % self.tag)
-        if self.is_block():
-               buffer.write("\n")
-#        if self.nl:
-#            buffer.write("\n")
-
     def _attribute_string(self):
-        attrs = ''
-        if self.attrs:
-            pairs = self.attrs.items()
-            attrs = ' ' + ' '.join(["%s=\"%s\"" % (k, v) for k, v in pairs])
-        return attrs
+        if not self.attrs:
+            return ''
+        return ' ' + ' '.join(['%s="%s"' % pair for pair in self.attrs.items()])
 
 
 class Href(Tag):
 
+    __slots__ = ()
+
     def __init__(self, href, content):
         self.tag = 'a'
         self.nl = False
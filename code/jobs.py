@@ -0,0 +1,261 @@
+"""jobs.py
+
+Running service chains in the background.
+
+A JobManager runs chains in a pool of threads so that the web server does not
+have to wait for all the SOAP calls of a chain:
+
+>>> job = JOBS.submit(chain, url, fetch)
+>>> JOBS.get(job.identifier).as_json()
+{'job': '5e0f...', 'status': 'running', 'steps': [...], ...}
+
+The fetch argument is a function that takes the url and returns the text to
+process. The number of jobs that run at the same time, the number of jobs that
+can wait in the queue and the number of finished jobs kept around for polling
+can be set in config.py.
+
+When the application runs in more than one process, see wsgi.py, a job may be
+polled in a process that did not run it. The jobs can then be shared like the
+results in results.py: the state of a job is written to JOB_STORE_DIR each
+time it changes and read from there by the other processes.
+
+"""
+
+import os
+import json
+import time
+import uuid
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from batch import text_input
+from metrics import StepMetrics
+from services import is_error, result_error
+from utils import info, write_json
+
+
+JOB_WORKERS = getattr(config, 'JOB_WORKERS', 4)
+JOB_QUEUE = getattr(config, 'JOB_QUEUE', 32)
+JOB_KEEP = getattr(config, 'JOB_KEEP', 100)
+JOB_STORE_DIR = getattr(config, 'JOB_STORE_DIR', 'data/cache/jobs')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+CACHED = 'cached'
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job(object):
+
+    """A chain running on the text from a URL, with the status of the job and of
+    each step in the chain."""
+
+    def __init__(self, chain, url, identifier=None):
+        self.identifier = identifier or uuid.uuid4().hex
+        self.chain = chain
+        self.url = url
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.steps = [{'service': s.identifier, 'status': QUEUED, 'seconds': None}
+                      for s in chain.services]
+        self.result = None
+        self.error = None
+        # StepMetrics objects for the steps that were run
+        self.metrics = []
+
+    def progress(self, step, service, done):
+        """Callback handed to ServiceChain.run(), step counts from 1."""
+        step = self.steps[step - 1]
+        if done:
+            step['status'] = DONE
+            step['seconds'] = round(time.time() - step['started'], 3)
+            del step['started']
+        else:
+            step['status'] = RUNNING
+            step['started'] = time.time()
+
+    def is_finished(self):
+        return self.status in (DONE, FAILED)
+
+    def as_json(self):
+        return {
+            'job': self.identifier,
+            'chain': self.chain.identifier,
+            'data': self.url,
+            'status': self.status,
+            'error': self.error,
+            'steps': [{'service': s['service'], 'status': s['status'], 'seconds': s['seconds']}
+                      for s in self.steps],
+            'metrics': [m.as_json() for m in self.metrics],
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished}
+
+    @classmethod
+    def from_json(cls, obj, chain):
+        """Return the job written by another process, obj is the result of
+        as_json() with the result added."""
+        job = cls(chain, obj['data'], obj['job'])
+        job.status = obj['status']
+        job.error = obj['error']
+        job.steps = obj['steps']
+        job.metrics = [StepMetrics.from_json(m) for m in obj['metrics']]
+        job.created = obj['created']
+        job.started = obj['started']
+        job.finished = obj['finished']
+        job.result = obj.get('result')
+        return job
+
+
+class JobManager(object):
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE, keep=JOB_KEEP):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.keep = keep
+        self.jobs = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # directory shared with other processes, None if the jobs are not
+        # shared, and the function that gives the chain of a job read from it
+        self.directory = None
+        self.load_chain = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def share(self, load_chain, directory=JOB_STORE_DIR):
+        """Share the jobs with other processes that use the same directory. The
+        chain of a job run by another process is load_chain(identifier,
+        service_identifiers)."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.load_chain = load_chain
+
+    def active(self):
+        """Return the number of jobs that are queued or running."""
+        return len([job for job in self.jobs.values() if not job.is_finished()])
+
+    def submit(self, chain, url, fetch):
+        """Create a job for the chain and the URL and schedule it. Raises
+        JobQueueFull if too many jobs are waiting."""
+        with self._lock:
+            if self.active() >= self.workers + self.max_queued:
+                raise JobQueueFull("%d jobs waiting" % self.max_queued)
+            job = Job(chain, url)
+            self.jobs[job.identifier] = job
+            self._forget_finished_jobs()
+        self._save(job)
+        self.executor.submit(self._run, job, fetch)
+        return job
+
+    def get(self, job_identifier):
+        """Return the job, or None if it is not or no longer kept."""
+        job = self.jobs.get(job_identifier)
+        if job is not None or self.directory is None:
+            return job
+        try:
+            with open(self._path(job_identifier)) as fh:
+                obj = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        service_identifiers = [step['service'] for step in obj['steps']]
+        chain = self.load_chain(obj['chain'], service_identifiers)
+        if chain is None:
+            return None
+        return Job.from_json(obj, chain)
+
+    def _run(self, job, fetch):
+        job.status = RUNNING
+        job.started = time.time()
+        self._save(job)
+        try:
+            data = fetch(job.url)
+            progress = functools.partial(self._progress, job)
+            job.result = job.chain.run(text_input(data), progress=progress,
+                                       metrics=job.metrics)
+            self._finish_steps(job)
+            job.error = result_error(job.result)
+            job.status = DONE if job.error is None else FAILED
+        except Exception as e:
+            job.error = "%s: %s" % (e.__class__.__name__, e)
+            job.status = FAILED
+        job.finished = time.time()
+        self._save(job)
+        info("job %s %s in %.2f seconds"
+             % (job.identifier, job.status, job.finished - job.started))
+
+    @staticmethod
+    def _finish_steps(job):
+        """Set the status of the steps after the chain ran. No step runs if the
+        result for the chain was cached, otherwise steps that did not run
+        because an earlier step failed are skipped."""
+        started = [step for step in job.steps if step['status'] != QUEUED]
+        if not started and not is_error(job.result):
+            for step in job.steps:
+                step['status'] = CACHED
+            return
+        # the metrics are those of the started steps, in the order of the steps
+        for step, metrics in zip(started, job.metrics):
+            if metrics.error:
+                step['status'] = FAILED
+        for step in job.steps:
+            if step['status'] in (QUEUED, RUNNING):
+                step['status'] = SKIPPED
+
+    def _progress(self, job, step, service, done):
+        job.progress(step, service, done)
+        self._save(job)
+
+    def _save(self, job):
+        """Write the state of the job to the shared directory, with the result
+        once the job is finished."""
+        if self.directory is None:
+            return
+        with self._save_lock:
+            obj = job.as_json()
+            if job.is_finished():
+                obj['result'] = job.result
+            try:
+                write_json(self._path(job.identifier), obj, indent=None)
+            except OSError as e:
+                info("Could not write job %s: %s" % (job.identifier, e))
+                return
+        if job.is_finished():
+            self._remove_old_files()
+
+    def _path(self, identifier):
+        # identifiers come from URLs, so only use their name part
+        return os.path.join(self.directory, os.path.basename(identifier) + '.json')
+
+    def _remove_old_files(self):
+        """Keep the files of the jobs of any process that changed last. Running
+        jobs are written after each step, so their files are kept."""
+        try:
+            paths = [os.path.join(self.directory, fname)
+                     for fname in os.listdir(self.directory) if fname.endswith('.json')]
+            paths.sort(key=os.path.getmtime, reverse=True)
+        except OSError:
+            return
+        for path in paths[self.keep + self.workers + self.max_queued:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _forget_finished_jobs(self):
+        finished = [job for job in self.jobs.values() if job.is_finished()]
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job.identifier]
+
+
+JOBS = JobManager()
@@ -0,0 +1,175 @@
+"""lif.py
+
+Compact columnar representation of LIF views.
+
+The visualizations used to walk the list of annotation dictionaries of a view
+and test the type of each annotation, once for every annotation type shown. A
+LifView reads the annotations of a view once and stores them in columns: the
+annotation types are interned and stored as small integers, offsets are stored
+in arrays, and features are kept as JSON strings that are only turned into a
+dictionary when they are asked for. An index from annotation type to the
+positions of its annotations is built in the same pass:
+
+>>> view = LifView(lif['payload']['views'][0])
+>>> for i in view.indices('Token'):
+...     print(view.offsets(i), view.features(i).get('word'))
+
+Annotation types are given by their short name, that is, the part of the type
+URI after the last slash.
+
+The module also has helpers to send a service only the views it needs and to
+merge the views it returns into a document, see select_views() and
+merge_views().
+
+"""
+
+import json
+from array import array
+
+
+# Stored in the offset arrays for annotations without a start or end offset.
+NO_OFFSET = -1
+
+LIF_DISCRIMINATOR = 'http://vocab.lappsgrid.org/ns/media/jsonld#lif'
+
+
+def short_name(annotation_type):
+    return annotation_type.split('/')[-1]
+
+
+def base_type(annotation_type):
+    """Return the annotation type without the part after #, so that a view with
+    Token#pos annotations counts as a view with Token annotations."""
+    return annotation_type.split('#')[0]
+
+
+def is_lif(json_obj):
+    return (json_obj.get('discriminator') == LIF_DISCRIMINATOR
+            and isinstance(json_obj.get('payload'), dict))
+
+
+def views(json_obj):
+    return json_obj['payload'].get('views') or []
+
+
+def select_views(json_obj, required_types):
+    """Return the views of a LIF object that contain at least one of the required
+    annotation types, in the order of the document."""
+    required = set(base_type(t) for t in required_types)
+    selected = []
+    for view in views(json_obj):
+        contains = view.get('metadata', {}).get('contains', {})
+        if any(base_type(t) in required for t in contains):
+            selected.append(view)
+    return selected
+
+
+def with_views(json_obj, selected):
+    """Return a copy of a LIF object with only the selected views. Only the
+    dictionaries on the path to the views are copied."""
+    payload = dict(json_obj['payload'])
+    payload['views'] = selected
+    return dict(json_obj, payload=payload)
+
+
+def merge_views(json_obj, added):
+    """Return a copy of a LIF object with the added views after its own views.
+    Added views whose identifier is already used get a new identifier. The
+    given objects are not changed, so they can be shared with a cache."""
+    own = views(json_obj)
+    used = set(view.get('id') for view in own)
+    renamed = []
+    for view in added:
+        if view.get('id') in used:
+            n = len(own) + len(renamed)
+            while 'v%d' % n in used:
+                n += 1
+            view = dict(view, id='v%d' % n)
+        used.add(view.get('id'))
+        renamed.append(view)
+    return with_views(json_obj, own + renamed), renamed
+
+
+class LifView(object):
+
+    def __init__(self, view):
+        self.identifier = view.get('id')
+        self.metadata = view.get('metadata', {})
+        # annotation types, their short names and for each type the positions of
+        # its annotations, all indexed on the type identifier
+        self.types = []
+        self.short_names = []
+        self.positions = []
+        # the columns, with one element per annotation
+        self.type_ids = array('I')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.ids = []
+        self._features = []
+        # labels are stored as a feature by only a few old services
+        self._labels = {}
+        type_ids = {}
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        for i, annotation in enumerate(view.get('annotations', [])):
+            atype = annotation['@type']
+            type_id = type_ids.get(atype)
+            if type_id is None:
+                type_id = type_ids[atype] = len(self.types)
+                self.types.append(atype)
+                self.short_names.append(short_name(atype))
+                self.positions.append(array('I'))
+            self.type_ids.append(type_id)
+            self.positions[type_id].append(i)
+            start = annotation.get('start')
+            end = annotation.get('end')
+            self.starts.append(NO_OFFSET if start is None else start)
+            self.ends.append(NO_OFFSET if end is None else end)
+            self.ids.append(annotation.get('id'))
+            features = annotation.get('features')
+            self._features.append(encode(features) if features else None)
+            label = annotation.get('label')
+            if label is not None:
+                self._labels[i] = label
+
+    def __len__(self):
+        return len(self.type_ids)
+
+    def type_id(self, name):
+        """Return the identifier of the annotation type with the short name, or
+        None if the view has no annotations of that type."""
+        try:
+            return self.short_names.index(name)
+        except ValueError:
+            return None
+
+    def indices(self, *names):
+        """Return the positions of the annotations whose type has one of the short
+        names, in the order of the annotations in the view."""
+        type_ids = [n for n, name in enumerate(self.short_names) if name in names]
+        if len(type_ids) == 1:
+            return self.positions[type_ids[0]]
+        return sorted(i for type_id in type_ids for i in self.positions[type_id])
+
+    def type(self, i):
+        return self.types[self.type_ids[i]]
+
+    def short_type(self, i):
+        return self.short_names[self.type_ids[i]]
+
+    def offsets(self, i):
+        """Return the start and end of annotation i, None for missing offsets."""
+        start = self.starts[i]
+        end = self.ends[i]
+        return (None if start == NO_OFFSET else start,
+                None if end == NO_OFFSET else end)
+
+    def label(self, i):
+        return self._labels.get(i)
+
+    def features(self, i):
+        """Return a new dictionary with the features of annotation i."""
+        features = self._features[i]
+        return {} if features is None else json.loads(features)
+
+    def feature(self, i, name, default=None):
+        return self.features(i).get(name, default)
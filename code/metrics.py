@@ -0,0 +1,275 @@
+"""metrics.py
+
+Timings and payload sizes of service calls.
+
+Each call of LappsService.execute() is measured in a StepMetrics object, with
+the time spent serializing the input to JSON, waiting for the service and
+parsing the result, the sizes of the request and the response, and the number
+of annotations in the result. The measurements are added to histograms that are
+kept for each service identifier:
+
+>>> step = StepMetrics(service.identifier)
+>>> result = service.execute(data, step)
+>>> METRICS.prometheus()
+'# HELP lapps_service_seconds ...'
+
+The histograms are available in the Prometheus text format on /metrics. The
+durations of the last LATENCY_WINDOW successful calls of each service are kept
+as well, for percentiles of the recent latency of a service:
+
+>>> METRICS.latency_percentile(service.identifier, 95)
+0.231
+
+"""
+
+import time
+import threading
+from collections import deque
+
+import config
+
+
+# Upper bounds of the histogram buckets for seconds, bytes and annotations.
+SECONDS_BUCKETS = getattr(
+    config, 'METRICS_SECONDS_BUCKETS',
+    (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+BYTES_BUCKETS = getattr(
+    config, 'METRICS_BYTES_BUCKETS',
+    tuple(2**n for n in range(10, 31, 2)))
+ANNOTATIONS_BUCKETS = getattr(
+    config, 'METRICS_ANNOTATIONS_BUCKETS',
+    tuple(10**n for n in range(0, 8)))
+
+# Number of recent calls of a service used for latency percentiles.
+LATENCY_WINDOW = getattr(config, 'METRICS_LATENCY_WINDOW', 1000)
+
+PHASES = ('serialize', 'network', 'deserialize')
+
+
+def utf8_size(string):
+    """Return the number of bytes of the string in UTF-8, without encoding it if
+    the string is ASCII."""
+    return len(string) if string.isascii() else len(string.encode('utf-8'))
+
+
+def count_annotations(json_obj):
+    """Return the number of annotations in all views of a LIF object."""
+    try:
+        views = json_obj['payload']['views']
+        return sum(len(view.get('annotations', [])) for view in views)
+    except (KeyError, TypeError, AttributeError):
+        return 0
+
+
+class StepMetrics(object):
+
+    """Timings in seconds and sizes in bytes of one call of a service."""
+
+    def __init__(self, service):
+        self.service = service
+        self.serialize = 0.0
+        self.network = 0.0
+        self.deserialize = 0.0
+        # time spent on failed attempts and waiting before retries, which is
+        # not part of the latency of the service
+        self.retrying = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.annotations = 0
+        self.cached = False
+        self.error = False
+        # estimated bytes not transferred because the service was only sent the
+        # views it requires, and the identifiers of the views the service added
+        self.saved_bytes = 0
+        self.views = []
+
+    def seconds(self):
+        return self.serialize + self.network + self.deserialize
+
+    def outcome(self):
+        return 'error' if self.error else 'cached' if self.cached else 'ok'
+
+    def as_json(self):
+        return {'service': self.service,
+                'serialize': round(self.serialize, 6),
+                'network': round(self.network, 6),
+                'deserialize': round(self.deserialize, 6),
+                'retrying': round(self.retrying, 6),
+                'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes,
+                'annotations': self.annotations,
+                'saved_bytes': self.saved_bytes,
+                'views': self.views,
+                'cached': self.cached,
+                'error': self.error}
+
+    @classmethod
+    def from_json(cls, obj):
+        metrics = cls(obj['service'])
+        for name, value in obj.items():
+            setattr(metrics, name, value)
+        return metrics
+
+
+class Histogram(object):
+
+    """Cumulative histogram in the way of Prometheus, with a count for each upper
+    bound, the number of observations and their sum."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        """Generate the lines for the histogram in the Prometheus text format."""
+        for bound, count in zip(self.buckets, self.counts):
+            yield '%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count)
+        yield '%s_bucket{%s,le="+Inf"} %d' % (name, labels, self.count)
+        yield '%s_sum{%s} %s' % (name, labels, self.sum)
+        yield '%s_count{%s} %d' % (name, labels, self.count)
+
+
+class ServiceMetrics(object):
+
+    """Histograms and counters for the calls of one service."""
+
+    def __init__(self):
+        self.seconds = {phase: Histogram(SECONDS_BUCKETS) for phase in PHASES}
+        self.bytes = {'request': Histogram(BYTES_BUCKETS),
+                      'response': Histogram(BYTES_BUCKETS)}
+        self.annotations = Histogram(ANNOTATIONS_BUCKETS)
+        self.calls = {'ok': 0, 'cached': 0, 'error': 0}
+        self.saved_bytes = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, step):
+        self.calls[step.outcome()] += 1
+        self.saved_bytes += step.saved_bytes
+        if step.cached:
+            return
+        self.seconds['serialize'].observe(step.serialize)
+        self.seconds['network'].observe(step.network)
+        self.seconds['deserialize'].observe(step.deserialize)
+        self.bytes['request'].observe(step.request_bytes)
+        self.bytes['response'].observe(step.response_bytes)
+        if not step.error:
+            self.annotations.observe(step.annotations)
+            self.latencies.append(step.seconds())
+
+    def mean_seconds(self):
+        """Return the average time of the calls that were not cached, or None if
+        there were none."""
+        count = self.seconds['network'].count
+        if not count:
+            return None
+        return sum(self.seconds[phase].sum for phase in PHASES) / count
+
+    def latency_percentile(self, p):
+        """Return the p-th percentile of the durations of recent successful calls
+        using the nearest rank, or None if there were none."""
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[max(0, min(len(latencies) - 1, int(round(p / 100 * len(latencies))) - 1))]
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.services = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, step):
+        """Add the measurements of a StepMetrics object."""
+        with self._lock:
+            service_metrics = self.services.get(step.service)
+            if service_metrics is None:
+                service_metrics = self.services[step.service] = ServiceMetrics()
+            service_metrics.observe(step)
+
+    def mean_seconds(self):
+        """Return a dictionary with the average time of a call of each service
+        that was called at least once without using the cache."""
+        with self._lock:
+            means = ((service, metrics.mean_seconds())
+                     for service, metrics in self.services.items())
+            return {service: mean for service, mean in means if mean is not None}
+
+    def latency_percentile(self, service, p, min_calls=1):
+        """Return the p-th percentile of the recent latency of the service, or
+        None if it has fewer than min_calls recent successful calls."""
+        with self._lock:
+            service_metrics = self.services.get(service)
+            if service_metrics is None or len(service_metrics.latencies) < min_calls:
+                return None
+            return service_metrics.latency_percentile(p)
+
+    def latency(self, percentiles=(50, 90, 95, 99)):
+        """Return a dictionary with for each service that was called the number of
+        calls by outcome and the percentiles of its recent latency in seconds."""
+        with self._lock:
+            return {service: {'calls': dict(metrics.calls),
+                              'recent': len(metrics.latencies),
+                              'seconds': {'p%d' % p: _round(metrics.latency_percentile(p))
+                                          for p in percentiles}}
+                    for service, metrics in self.services.items()}
+
+    def prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            return '\n'.join(self._lines()) + '\n'
+
+    def _lines(self):
+        services = sorted(self.services.items())
+        yield '# HELP lapps_service_calls_total Calls of a service by outcome.'
+        yield '# TYPE lapps_service_calls_total counter'
+        for service, metrics in services:
+            for outcome, count in sorted(metrics.calls.items()):
+                yield 'lapps_service_calls_total{service="%s",outcome="%s"} %d' % (
+                    _escape(service), outcome, count)
+        yield '# HELP lapps_service_saved_bytes_total Estimated bytes not sent to and from a service.'
+        yield '# TYPE lapps_service_saved_bytes_total counter'
+        for service, metrics in services:
+            yield 'lapps_service_saved_bytes_total{service="%s"} %d' % (
+                _escape(service), metrics.saved_bytes)
+        yield '# HELP lapps_service_seconds Time spent in calls of a service by phase.'
+        yield '# TYPE lapps_service_seconds histogram'
+        for service, metrics in services:
+            for phase in PHASES:
+                labels = 'service="%s",phase="%s"' % (_escape(service), phase)
+                yield from metrics.seconds[phase].samples('lapps_service_seconds', labels)
+        yield '# HELP lapps_service_bytes Size of the requests and responses of a service.'
+        yield '# TYPE lapps_service_bytes histogram'
+        for service, metrics in services:
+            for direction in ('request', 'response'):
+                labels = 'service="%s",direction="%s"' % (_escape(service), direction)
+                yield from metrics.bytes[direction].samples('lapps_service_bytes', labels)
+        yield '# HELP lapps_service_annotations Annotations in the results of a service.'
+        yield '# TYPE lapps_service_annotations histogram'
+        for service, metrics in services:
+            labels = 'service="%s"' % _escape(service)
+            yield from metrics.annotations.samples('lapps_service_annotations', labels)
+        yield '# HELP lapps_uptime_seconds Seconds since the metrics were started.'
+        yield '# TYPE lapps_uptime_seconds gauge'
+        yield 'lapps_uptime_seconds %.3f' % (time.time() - self.started)
+
+
+def _round(seconds):
+    return None if seconds is None else round(seconds, 6)
+
+
+def _escape(label_value):
+    return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,447 @@
+"""mock_service.py
+
+A local stand-in for the LAPPS service managers and SOAP services, for testing
+and benchmarking without access to the Brandeis and Vassar servers.
+
+The mock implements getMetadata and execute for the tokenizers, sentence
+splitters, part-of-speech taggers, named entity recognizers and parsers used in
+the chains in services.CHAINS_FILE, and lists those services as the
+services on the Brandeis service manager. The execute operation adds a view
+with synthetic but well-formed annotations for the text of the input, so the
+size of the views grows with the size of the input text. Each call waits for a
+configurable latency. To test how the application copes with bad services, a
+fraction of the execute calls can fail with HTTP 503 and a fraction can be
+slow, taking 20 times the latency.
+
+To use it, start the mock and set SERVICE_BACKEND in config.py:
+
+$ python mock_service.py --port 5001 --latency 0.05
+
+SERVICE_BACKEND = 'http://127.0.0.1:5001'
+
+The mock can also run in a thread of another process:
+
+>>> server = serve(port=0, latency=0.01)
+>>> server.url
+'http://127.0.0.1:40321'
+>>> server.shutdown()
+
+"""
+
+import re
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from flask import Flask, Response, request, abort
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+import config
+
+
+# Seconds that each call waits, varied randomly by the jitter fraction.
+MOCK_LATENCY = getattr(config, 'MOCK_LATENCY', 0.05)
+MOCK_JITTER = getattr(config, 'MOCK_JITTER', 0.2)
+
+# Fractions of execute calls that fail and that are slow.
+MOCK_FAILURES = getattr(config, 'MOCK_FAILURES', 0.0)
+MOCK_SLOW = getattr(config, 'MOCK_SLOW', 0.0)
+SLOW_FACTOR = 20
+
+SOAP_ENV = 'http://schemas.xmlsoap.org/soap/envelope/'
+NAMESPACE = 'http://mock.lappsgrid.org/service'
+
+VOCAB = 'http://vocab.lappsgrid.org/'
+TEXT = 'http://vocab.lappsgrid.org/ns/media/text'
+LIF = 'http://vocab.lappsgrid.org/ns/media/jsonld#lif'
+ERROR = 'http://vocab.lappsgrid.org/ns/error'
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+PUNCTUATION_TAGS = {'.': '.', ',': ',', ':': ':', ';': ':', '!': '.', '?': '.'}
+FUNCTION_WORDS = {
+    'the': 'DT', 'a': 'DT', 'an': 'DT', 'and': 'CC', 'but': 'CC', 'or': 'CC',
+    'to': 'TO', 'of': 'IN', 'in': 'IN', 'on': 'IN', 'at': 'IN', 'is': 'VBZ',
+    'are': 'VBP', 'was': 'VBD', 'they': 'PRP', 'he': 'PRP', 'she': 'PRP',
+    'it': 'PRP', 'so': 'RB', 'really': 'RB', 'not': 'RB'}
+ENTITY_TYPES = ('Person', 'Location', 'Organization')
+
+WSDL = """<?xml version="1.0" encoding="UTF-8"?>
+<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+                  xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+                  xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+                  xmlns:tns="%(ns)s"
+                  targetNamespace="%(ns)s">
+  <wsdl:types>
+    <xsd:schema targetNamespace="%(ns)s" elementFormDefault="qualified">
+      <xsd:element name="getMetadata">
+        <xsd:complexType><xsd:sequence/></xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getMetadataResponse">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="getMetadataReturn" type="xsd:string"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+      <xsd:element name="execute">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="input" type="xsd:string"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+      <xsd:element name="executeResponse">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="executeReturn" type="xsd:string"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+    </xsd:schema>
+  </wsdl:types>
+  <wsdl:message name="getMetadataRequest"><wsdl:part name="parameters" element="tns:getMetadata"/></wsdl:message>
+  <wsdl:message name="getMetadataResponse"><wsdl:part name="parameters" element="tns:getMetadataResponse"/></wsdl:message>
+  <wsdl:message name="executeRequest"><wsdl:part name="parameters" element="tns:execute"/></wsdl:message>
+  <wsdl:message name="executeResponse"><wsdl:part name="parameters" element="tns:executeResponse"/></wsdl:message>
+  <wsdl:portType name="WebService">
+    <wsdl:operation name="getMetadata">
+      <wsdl:input message="tns:getMetadataRequest"/>
+      <wsdl:output message="tns:getMetadataResponse"/>
+    </wsdl:operation>
+    <wsdl:operation name="execute">
+      <wsdl:input message="tns:executeRequest"/>
+      <wsdl:output message="tns:executeResponse"/>
+    </wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="WebServiceBinding" type="tns:WebService">
+    <soap:binding style="document" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="getMetadata">
+      <soap:operation soapAction=""/>
+      <wsdl:input><soap:body use="literal"/></wsdl:input>
+      <wsdl:output><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+    <wsdl:operation name="execute">
+      <soap:operation soapAction=""/>
+      <wsdl:input><soap:body use="literal"/></wsdl:input>
+      <wsdl:output><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="%(name)s">
+    <wsdl:port name="WebServicePort" binding="tns:WebServiceBinding">
+      <soap:address location="%(location)s"/>
+    </wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+"""
+
+ENVELOPE = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<soapenv:Envelope xmlns:soapenv="%s"><soapenv:Body>%%s</soapenv:Body>'
+            '</soapenv:Envelope>' % SOAP_ENV)
+
+
+class MockTool(object):
+
+    """A kind of service, with the annotation types it requires and produces and
+    the function that adds its view to a LIF payload."""
+
+    def __init__(self, keyword, requires, produces, annotate):
+        self.keyword = keyword
+        self.requires = requires
+        self.produces = produces
+        self.annotate = annotate
+
+    def metadata(self, identifier):
+        version = identifier.rsplit('_', 1)[-1]
+        return {
+            'discriminator': 'http://vocab.lappsgrid.org/ns/meta',
+            'payload': {
+                '$schema': 'https://vocab.lappsgrid.org/schema/1.1.0/metadata-schema.json',
+                'name': identifier.split(':')[-1],
+                'version': version,
+                'toolVersion': version,
+                'vendor': 'http://mock.lappsgrid.org',
+                'allow': 'http://vocab.lappsgrid.org/ns/allow#any',
+                'license': 'http://vocab.lappsgrid.org/ns/license#apache-2.0',
+                'requires': {'format': [TEXT, LIF], 'language': ['en'],
+                             'annotations': [VOCAB + t for t in self.requires]},
+                'produces': {'format': [LIF], 'language': ['en'],
+                             'annotations': [VOCAB + t for t in self.produces]}}}
+
+    def execute(self, identifier, data):
+        """Return the LIF object with the view added by the tool, or a LIF error
+        object if the input cannot be read."""
+        try:
+            service_input = json.loads(data)
+            payload = service_input['payload']
+            if service_input.get('discriminator') == TEXT:
+                payload = {'@context': 'http://vocab.lappsgrid.org/context-1.0.0.jsonld',
+                           'metadata': {}, 'text': {'@value': payload}, 'views': []}
+            text = payload['text']['@value']
+        except (ValueError, KeyError, TypeError) as e:
+            return {'discriminator': ERROR, 'payload': 'Invalid input: %s' % e}
+        views = payload.setdefault('views', [])
+        view_id = 'v%d' % len(views)
+        annotations = self.annotate(text, views, view_id)
+        views.append({
+            'id': view_id,
+            'metadata': {'contains': {VOCAB + t: {'producer': identifier, 'type': t}
+                                      for t in self.produces}},
+            'annotations': annotations})
+        return {'discriminator': LIF, 'payload': payload}
+
+
+def _annotation(identifier, atype, start, end, features):
+    return {'id': identifier, 'start': start, 'end': end, '@type': VOCAB + atype,
+            'features': features}
+
+
+def _tokens(text):
+    """Return (start, end, word) triples for the tokens in the text."""
+    return [(m.start(), m.end(), m.group()) for m in TOKEN_RE.finditer(text)]
+
+
+def _sentences(text):
+    """Return (start, end) pairs for the sentences in the text."""
+    sentences = []
+    start = None
+    for p1, p2, word in _tokens(text):
+        if start is None:
+            start = p1
+        if word in ('.', '!', '?'):
+            sentences.append((start, p2))
+            start = None
+    if start is not None:
+        sentences.append((start, len(text)))
+    return sentences
+
+
+def _pos(word, first):
+    if word in PUNCTUATION_TAGS:
+        return PUNCTUATION_TAGS[word]
+    if word.lower() in FUNCTION_WORDS:
+        return FUNCTION_WORDS[word.lower()]
+    if word.isdigit():
+        return 'CD'
+    if word[0].isupper() and not first:
+        return 'NNP'
+    if word.endswith('ed'):
+        return 'VBD'
+    if word.endswith('s'):
+        return 'NNS' if zlib.crc32(word.encode()) % 3 else 'VBZ'
+    return 'JJ' if zlib.crc32(word.encode()) % 4 == 0 else 'NN'
+
+
+def tokenize(text, views, view_id):
+    return [_annotation('tk_%s_%d' % (view_id, i), 'Token', p1, p2, {'word': word})
+            for i, (p1, p2, word) in enumerate(_tokens(text))]
+
+
+def split(text, views, view_id):
+    return [_annotation('s_%s_%d' % (view_id, i), 'Sentence', p1, p2,
+                        {'sentence': text[p1:p2]})
+            for i, (p1, p2) in enumerate(_sentences(text))]
+
+
+def tag(text, views, view_id):
+    annotations = []
+    first = True
+    for i, (p1, p2, word) in enumerate(_tokens(text)):
+        annotations.append(_annotation('tk_%s_%d' % (view_id, i), 'Token#pos', p1, p2,
+                                       {'word': word, 'pos': _pos(word, first)}))
+        first = word in ('.', '!', '?')
+    return annotations
+
+
+def recognize(text, views, view_id):
+    """Mark sequences of capitalized words that do not start a sentence as named
+    entities, the entity type depends on the words only."""
+    annotations = []
+    entity = None
+    first = True
+    for p1, p2, word in _tokens(text) + [(len(text), len(text), '.')]:
+        if word[0].isupper() and not first:
+            entity = (entity[0], p2) if entity else (p1, p2)
+        else:
+            if entity is not None:
+                words = text[entity[0]:entity[1]]
+                atype = ENTITY_TYPES[zlib.crc32(words.encode()) % len(ENTITY_TYPES)]
+                annotations.append(_annotation('ne_%s_%d' % (view_id, len(annotations)),
+                                               atype, entity[0], entity[1], {'word': words}))
+            entity = None
+        first = word in ('.', '!', '?')
+    return annotations
+
+
+def parse(text, views, view_id):
+    """Return a flat parse for each sentence, with a PhraseStructure, a Token
+    with a part of speech for each word, and constituents for the sentence and
+    the words."""
+    annotations = []
+    for n, (s1, s2) in enumerate(_sentences(text)):
+        constituents = []
+        leaves = []
+        first = True
+        for p1, p2, word in _tokens(text[s1:s2]):
+            pos = _pos(word, first)
+            first = False
+            token_id = 'tk_%s_%d_%d' % (view_id, n, len(leaves))
+            annotations.append(_annotation(token_id, 'Token', s1 + p1, s1 + p2,
+                                           {'word': word, 'pos': pos}))
+            leaves.append('(%s %s)' % (pos, word))
+            constituent_id = 'c_%s_%d_%d' % (view_id, n, len(constituents))
+            annotations.append(_annotation(constituent_id, 'Constituent', s1 + p1, s1 + p2,
+                                           {'label': pos, 'children': [token_id]}))
+            constituents.append(constituent_id)
+        sentence_id = 'c_%s_%d_s' % (view_id, n)
+        annotations.append(_annotation(sentence_id, 'Constituent', s1, s2,
+                                       {'label': 'S', 'children': constituents}))
+        annotations.append(_annotation(
+            'ps_%s_%d' % (view_id, n), 'PhraseStructure', s1, s2,
+            {'sentence': text[s1:s2],
+             'penntree': '(ROOT\n  (S %s))' % ' '.join(leaves),
+             'constituents': constituents + [sentence_id]}))
+    return annotations
+
+
+TOOLS = [
+    MockTool('tokenizer', [], ['Token'], tokenize),
+    MockTool('splitter', [], ['Sentence'], split),
+    MockTool('postagger', ['Token'], ['Token#pos'], tag),
+    MockTool('namedentityrecognizer', ['Token'], ['NamedEntity'], recognize),
+    MockTool('parser', [], ['Token', 'PhraseStructure', 'Constituent'], parse)]
+
+
+def find_tool(identifier):
+    """Return the MockTool for the service identifier, or None."""
+    for tool in TOOLS:
+        if tool.keyword in identifier.split(':')[-1]:
+            return tool
+    return None
+
+
+def service_identifiers():
+    """Return the identifiers of all services in the chains that the mock can
+    stand in for."""
+    from services import ServiceChains
+    identifiers = set()
+    for steps in ServiceChains.load_definitions().values():
+        for step in steps:
+            if find_tool(step['service']) is not None:
+                identifiers.add(step['service'])
+    return sorted(identifiers)
+
+
+def create_app(latency=MOCK_LATENCY, jitter=MOCK_JITTER, failures=MOCK_FAILURES,
+               slow=MOCK_SLOW):
+
+    mock = Flask(__name__)
+
+    def wait(factor=1):
+        if latency:
+            time.sleep(factor * latency * random.uniform(1 - jitter, 1 + jitter))
+
+    @mock.route('/services/<server>')
+    def service_list(server):
+        identifiers = service_identifiers() if server == 'brandeis' else []
+        return {'elements': [{'serviceId': identifier,
+                              'serviceName': identifier.split(':')[-1],
+                              'serviceDescription': 'Mock of %s' % identifier,
+                              'serviceType': 'mock',
+                              'active': True} for identifier in identifiers]}
+
+    @mock.route('/wsdl/<identifier>')
+    def wsdl(identifier):
+        if find_tool(identifier) is None:
+            abort(404)
+        location = '%sservice/%s' % (request.host_url, identifier)
+        document = WSDL % {'ns': NAMESPACE, 'name': escape(identifier),
+                           'location': escape(location)}
+        return Response(document, mimetype='text/xml')
+
+    @mock.route('/service/<identifier>', methods=['POST'])
+    def service(identifier):
+        tool = find_tool(identifier)
+        if tool is None:
+            abort(404)
+        try:
+            body = ElementTree.fromstring(request.get_data()).find('{%s}Body' % SOAP_ENV)
+            operation = body[0]
+        except (ElementTree.ParseError, TypeError, IndexError):
+            return _fault('Client', 'Invalid SOAP request')
+        name = operation.tag.split('}')[-1]
+        if name == 'execute' and random.random() < failures:
+            wait()
+            return Response('Service unavailable', status=503)
+        wait(SLOW_FACTOR if name == 'execute' and random.random() < slow else 1)
+        if name == 'getMetadata':
+            result = json.dumps(tool.metadata(identifier))
+        elif name == 'execute':
+            data = operation.findtext('{%s}input' % NAMESPACE) or ''
+            result = json.dumps(tool.execute(identifier, data))
+        else:
+            return _fault('Client', 'Unknown operation %s' % name)
+        return _response(name, result)
+
+    return mock
+
+
+def _response(operation, result):
+    element = ('<tns:%sResponse xmlns:tns="%s"><tns:%sReturn>%s</tns:%sReturn>'
+               '</tns:%sResponse>' % (operation, NAMESPACE, operation, escape(result),
+                                      operation, operation))
+    return Response(ENVELOPE % element, mimetype='text/xml')
+
+
+def _fault(code, message):
+    element = ('<soapenv:Fault><faultcode>soapenv:%s</faultcode>'
+               '<faultstring>%s</faultstring></soapenv:Fault>' % (code, escape(message)))
+    return Response(ENVELOPE % element, status=500, mimetype='text/xml')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class MockServer(object):
+
+    """The mock running in a background thread of the current process, requests
+    are not logged."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=MOCK_LATENCY, jitter=MOCK_JITTER,
+                 failures=MOCK_FAILURES, slow=MOCK_SLOW):
+        self.server = make_server(host, port, create_app(latency, jitter, failures, slow),
+                                  threaded=True, request_handler=QuietRequestHandler)
+        self.url = 'http://%s:%d' % (host, self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def serve(host='127.0.0.1', port=0, latency=MOCK_LATENCY, jitter=MOCK_JITTER,
+          failures=MOCK_FAILURES, slow=MOCK_SLOW):
+    """Start the mock in a background thread and return the MockServer, with port
+    0 a free port is used."""
+    return MockServer(host, port, latency, jitter, failures, slow)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Mock LAPPS services')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--latency', type=float, default=MOCK_LATENCY,
+                        help='seconds that each call waits')
+    parser.add_argument('--jitter', type=float, default=MOCK_JITTER,
+                        help='random variation of the latency, as a fraction')
+    parser.add_argument('--failures', type=float, default=MOCK_FAILURES,
+                        help='fraction of execute calls that fail')
+    parser.add_argument('--slow', type=float, default=MOCK_SLOW,
+                        help='fraction of execute calls that take %d times the latency'
+                        % SLOW_FACTOR)
+    args = parser.parse_args()
+    create_app(args.latency, args.jitter, args.failures, args.slow).run(
+        host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,118 @@
+"""payloads.py
+
+Precomputed JSON responses for the REST API.
+
+Serialized payloads are stored in the rendered cache of the LappsServices
+registry, so they are computed once for each version of the registry and then
+handed out as bytes, with an ETag and, if the client accepts it, gzipped:
+
+>>> payload = services_payload(LAPPS_SERVICES, offset=0, limit=100, fields=['ids'])
+>>> payload.response(request)
+
+"""
+
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+
+# Maximum number of different paginated or filtered payloads kept per version.
+MAX_PAYLOADS = 64
+
+_lock = threading.Lock()
+
+
+class Payload(object):
+
+    """The bytes of a JSON response, its ETag, and a gzipped version created on
+    first use."""
+
+    def __init__(self, body):
+        self.body = body.encode('utf-8')
+        self.etag = hashlib.md5(self.body).hexdigest()
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body)
+        return self._gzipped
+
+    def response(self, request):
+        """Return the Flask response for the request, which is a 304 if the client
+        has the current version and gzipped if the client accepts that. The
+        gzipped body is a different representation, so it has its own ETag."""
+        gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+        etag = self.etag + '-gz' if gzipped else self.etag
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif gzipped:
+            response = Response(self.gzipped(), mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(self.body, mimetype='application/json')
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(etag)
+        return response
+
+
+def services_payload(services, offset=0, limit=None, fields=None):
+    """Return the Payload with the service manager information of the services.
+    Without arguments this is a dictionary of all services. With an offset or
+    limit only a slice of the services is included and the total number of
+    services is added. The fields argument is either None for all information,
+    ['ids'] for only a list of service keys, or a list of the keys in the
+    information to include."""
+    fields = tuple(fields) if fields else None
+    cache_key = (offset, limit, fields)
+    # the cache is taken once, a refresh of the registry may replace it while
+    # this runs and what is computed here then stays with the old version
+    rendered = services.rendered
+    payloads = rendered.setdefault('api_payloads', OrderedDict())
+    payload = payloads.get(cache_key)
+    if payload is None:
+        payload = Payload(_services_json(services, rendered, offset, limit, fields))
+        with _lock:
+            payloads[cache_key] = payload
+            if len(payloads) > MAX_PAYLOADS:
+                payloads.popitem(last=False)
+    return payload
+
+
+def _fragments(services, rendered):
+    """Return a list of (key, info_json) pairs for all services, created once for
+    each version of the services and kept in its rendered cache."""
+    fragments = rendered.get('api_fragments')
+    if fragments is None:
+        fragments = [(json.dumps("%s::%s" % (s.server, s.identifier)), json.dumps(s.info))
+                     for s in services]
+        rendered['api_fragments'] = fragments
+    return fragments
+
+
+def _services_json(services, rendered, offset, limit, fields):
+    paginated = offset or limit is not None
+    if paginated:
+        end = None if limit is None else offset + limit
+        selected = services.services[offset:end]
+    else:
+        selected = services.services
+    if fields is None:
+        fragments = _fragments(services, rendered)
+        if paginated:
+            fragments = fragments[offset:end]
+        body = '{"services": {%s}' % ', '.join("%s: %s" % f for f in fragments)
+    elif fields == ('ids',):
+        keys = ["%s::%s" % (s.server, s.identifier) for s in selected]
+        body = '{"services": %s' % json.dumps(keys)
+    else:
+        infos = {"%s::%s" % (s.server, s.identifier):
+                 {f: s.info.get(f) for f in fields} for s in selected}
+        body = '{"services": %s' % json.dumps(infos)
+    if paginated:
+        body += ', "total": %d, "offset": %d, "limit": %s' % (
+            len(services), offset, json.dumps(limit))
+    return body + '}'
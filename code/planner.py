@@ -0,0 +1,230 @@
+"""planner.py
+
+Plan a chain of services that produces a set of annotation types.
+
+Instead of picking one of the chains in data/chains.json you can ask for the
+annotation types you want and let the planner find a cheap chain of registered
+services that produces them:
+
+>>> planner = ChainPlanner(services)
+>>> chain = planner.plan(['Token#pos', 'NamedEntity'])
+>>> [service.identifier for service in chain.services]
+['...tokenizer...', '...postagger...', '...namedentityrecognizer...']
+
+Annotation types can be given as a short name or as the full URI. Whether a
+service can be used is decided by the annotation types it requires and produces
+in its metadata, services without that information are not used.
+
+The cost of a service is the average time of its calls in METRICS, or
+PLANNER_DEFAULT_COST seconds for services that were not called yet. The cost of
+an annotation type is the cost of the cheapest service producing it plus the
+costs of the types that service requires. Since this only changes when the
+registry or the metrics change it is computed for all types at once, using the
+generalization of Dijkstra's algorithm by Knuth (1977) on the graph of services
+and types. That is redone when the services are categorized again or when the
+costs are older than PLANNER_REFRESH seconds. Planning a chain then just follows
+the cheapest producers back from the requested types.
+
+This is a heuristic and the chain is not always the cheapest one. The cost of a
+type counts the types it requires separately, so a prerequisite shared by two
+of them, like tokens, is counted twice, and a service producing several of the
+requested types at once gets no credit for that. The cheapest chain is a set
+cover problem, which is not worth solving for the few services per type in the
+registry.
+
+"""
+
+import time
+import heapq
+import threading
+
+import config
+import lif
+
+from services import ServiceChain
+from metrics import METRICS
+from utils import info
+
+
+# Cost in seconds of a service that was not called yet.
+PLANNER_DEFAULT_COST = getattr(config, 'PLANNER_DEFAULT_COST', 1.0)
+
+# Seconds after which the costs are computed again from the metrics.
+PLANNER_REFRESH = getattr(config, 'PLANNER_REFRESH', 60)
+
+
+class NoPlan(Exception):
+    pass
+
+
+def parse_types(types):
+    """Return the short names of a list of annotation types or of a string with
+    comma-separated annotation types."""
+    if isinstance(types, str):
+        types = types.split(',')
+    return [lif.short_name(t.strip()) for t in types if t.strip()]
+
+
+class ChainPlanner(object):
+
+    """Plans chains with the services in a LappsServices registry.
+
+    Instance variables:
+       registry     the LappsServices object
+       version      the version of the registry the index was built for
+       services     the services that can be planned with
+       requires     for each service the tuple of types it requires
+       produces     for each service the tuple of types it produces
+       producers    the services producing each type
+       consumers    the services requiring each type
+       costs        the cost of each service
+       best         the cheapest service producing each type
+       type_costs   the cost of producing each type
+       solved       the time the costs were computed
+
+    Services are referred to by their position in the services list.
+
+    """
+
+    def __init__(self, services, metrics=METRICS):
+        self.registry = services
+        self.metrics = metrics
+        self.version = None
+        self.solved = None
+        self.best = {}
+        self.type_costs = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def _build_index(self):
+        self.services = []
+        self.requires = []
+        self.produces = []
+        self.producers = {}
+        self.consumers = {}
+        for service in self.registry.services:
+            requires = service.requires()
+            produces = service.produces()
+            if requires is None or not produces:
+                continue
+            s = len(self.services)
+            self.services.append(service)
+            self.requires.append(tuple(sorted(set(lif.short_name(t) for t in requires))))
+            self.produces.append(tuple(sorted(set(lif.short_name(t) for t in produces))))
+            for t in self.requires[s]:
+                self.consumers.setdefault(t, []).append(s)
+            for t in self.produces[s]:
+                self.producers.setdefault(t, []).append(s)
+        self.version = self.registry.version
+
+    def _solve(self):
+        """Compute the cheapest way to produce each annotation type on its own. A
+        service is considered when the costs of all the types it requires are
+        known, and the type with the lowest cost is the next one to be final.
+        Prerequisites shared by the required types are counted once for each of
+        them, see the module docstring."""
+        observed = self.metrics.mean_seconds()
+        self.costs = [observed.get(service.identifier, PLANNER_DEFAULT_COST)
+                      for service in self.services]
+        waiting = [len(requires) for requires in self.requires]
+        best = {}
+        type_costs = {}
+        heap = []
+
+        def ready(s):
+            cost = self.costs[s] + sum(type_costs[t] for t in self.requires[s])
+            for t in self.produces[s]:
+                if t not in best:
+                    heapq.heappush(heap, (cost, t, s))
+
+        for s, count in enumerate(waiting):
+            if count == 0:
+                ready(s)
+        while heap:
+            cost, t, s = heapq.heappop(heap)
+            if t in best:
+                continue
+            best[t] = s
+            type_costs[t] = cost
+            for consumer in self.consumers.get(t, ()):
+                waiting[consumer] -= 1
+                if waiting[consumer] == 0:
+                    ready(consumer)
+        self.best = best
+        self.type_costs = type_costs
+        self._plans = {}
+        self.solved = time.time()
+
+    def refresh(self, force=False):
+        """Rebuild the index if the registry changed and compute the costs again
+        if they are older than PLANNER_REFRESH seconds."""
+        with self._lock:
+            self._refresh(force)
+
+    def _refresh(self, force=False):
+        if force or self.version != self.registry.version:
+            t0 = time.perf_counter()
+            self._build_index()
+            self._solve()
+            info("Built planner index for %d services and %d annotation types in %.3f seconds"
+                 % (len(self.services), len(self.producers), time.perf_counter() - t0))
+        elif time.time() - self.solved > PLANNER_REFRESH:
+            self._solve()
+
+    def plan(self, types):
+        """Return a ServiceChain that produces all the annotation types, with the
+        services in an order where each service comes after the services it
+        needs. Raises NoPlan if a type cannot be produced."""
+        goals = tuple(sorted(set(parse_types(types))))
+        if not goals:
+            raise NoPlan("No annotation types given")
+        with self._lock:
+            self._refresh()
+            chain = self._plans.get(goals)
+            if chain is None:
+                steps = self._steps(goals)
+                identifier = 'plan:' + '+'.join(goals)
+                chain = ServiceChain(identifier, [self.services[s] for s in steps])
+                chain.costs = [self.costs[s] for s in steps]
+                self._plans[goals] = chain
+            return chain
+
+    def _steps(self, goals):
+        """Return the positions of the services producing the goals. Types that
+        are produced by an already selected service are not looked up again."""
+        best = self.best
+        steps = []
+        covered = set()
+
+        def visit(t):
+            if t in covered:
+                return
+            s = best.get(t)
+            if s is None:
+                raise NoPlan("No services can produce %s" % t)
+            for required in self.requires[s]:
+                visit(required)
+            if s not in steps:
+                steps.append(s)
+                covered.update(self.produces[s])
+
+        for goal in goals:
+            visit(goal)
+        return steps
+
+    def describe(self, chain):
+        """Return a JSON object with the steps of a planned chain, with for each
+        step the types the service requires and produces, its cost and the
+        steps it depends on. The total cost is the sum of the costs of all
+        steps, steps that run at the same time make the chain take less time."""
+        steps = []
+        for service, cost, after in zip(chain.services, chain.costs, chain.dependencies()):
+            steps.append({'service': service.identifier,
+                          'server': service.server,
+                          'requires': [lif.short_name(t) for t in service.requires()],
+                          'produces': [lif.short_name(t) for t in service.produces()],
+                          'cost': round(cost, 6),
+                          'after': sorted(after)})
+        return {'chain': chain.identifier,
+                'total_cost': round(sum(chain.costs), 6),
+                'steps': steps}
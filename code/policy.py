@@ -0,0 +1,315 @@
+"""policy.py
+
+Policies for calling LAPPS services, so that one slow or failing service does
+not hold up the chains that use it.
+
+Each call of LappsService.execute() and execute_async() goes through the
+CallPolicy of the service:
+
+>>> policy = POLICIES.get(service.identifier)
+>>> response = policy.call(lambda timeout: send_request(timeout))
+>>> response = await policy.call_async(lambda: send_request_async())
+
+A policy has:
+
+- A timeout in seconds for each call.
+- Retries of calls that failed because the service could not be reached, did
+  not answer in time or returned an HTTP error. The n-th retry waits about
+  backoff * 2**n seconds. SOAP faults are not retried since the service did
+  answer.
+- Optional hedging. When a call has not returned after the given percentile of
+  the recent latencies of the service, the same call is sent again and the
+  first successful answer is used. With call() the attempts of a hedged call
+  run in threads of their own so the caller can take whichever answers first.
+  Services do not change anything, so this is safe, but it adds load to slow
+  services and is switched off by default.
+- A circuit breaker. After a number of failed calls in a row the breaker opens
+  and calls fail right away with ServiceUnavailable. After breaker_reset
+  seconds one trial call is let through, which closes the breaker again if it
+  works.
+
+The defaults can be changed in config.py and overruled per service in
+SERVICE_POLICIES, see config.sample.py. The state of the breakers is available
+on /api/health.
+
+"""
+
+import time
+import queue
+import random
+import asyncio
+import threading
+
+import zeep
+
+import config
+from metrics import METRICS
+from utils import info
+
+
+# Seconds to wait for a call of a service, None to wait forever.
+SERVICE_TIMEOUT = getattr(config, 'SERVICE_TIMEOUT', 120)
+
+# Number of times a failed call is sent again, and the seconds to wait before
+# the first retry, which doubles for each next retry.
+SERVICE_RETRIES = getattr(config, 'SERVICE_RETRIES', 2)
+RETRY_BACKOFF = getattr(config, 'RETRY_BACKOFF', 0.5)
+
+# Percentile of the recent latencies of a service after which a call is sent a
+# second time, None to never do that, and the number of recent calls needed.
+HEDGE_PERCENTILE = getattr(config, 'HEDGE_PERCENTILE', None)
+HEDGE_MIN_CALLS = getattr(config, 'HEDGE_MIN_CALLS', 20)
+
+# Failed calls in a row after which the circuit breaker of a service opens, and
+# the seconds after which a trial call is let through.
+BREAKER_FAILURES = getattr(config, 'BREAKER_FAILURES', 5)
+BREAKER_RESET = getattr(config, 'BREAKER_RESET', 30)
+
+# Settings for single services, a dictionary with service identifiers as keys
+# and dictionaries with arguments of CallPolicy as values.
+SERVICE_POLICIES = getattr(config, 'SERVICE_POLICIES', {})
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class ServiceUnavailable(Exception):
+
+    """Raised for calls of a service whose circuit breaker is open."""
+
+
+def retryable(error):
+    """Return True if a call that failed with the error may work when it is
+    sent again."""
+    return not isinstance(error, (zeep.exceptions.Fault, ServiceUnavailable))
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.state = CLOSED
+        self.failures_in_row = 0
+        self.opened = None
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be sent. An open breaker becomes half-open
+        after reset seconds and then lets one trial call through."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened >= self.reset:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                info("circuit breaker of %s closed" % self.name)
+            self.state = CLOSED
+            self.failures_in_row = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures_in_row += 1
+            if self.state == HALF_OPEN or self.failures_in_row >= self.failures:
+                if self.state != OPEN:
+                    info("circuit breaker of %s opened after %d failed calls"
+                         % (self.name, self.failures_in_row))
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened = time.time()
+
+    def as_json(self):
+        with self._lock:
+            return {'state': self.state,
+                    'failures_in_row': self.failures_in_row,
+                    'opened': self.opened,
+                    'times_opened': self.times_opened}
+
+
+class CallPolicy(object):
+
+    """Timeout, retries, hedging and circuit breaker for the calls of one
+    service, see the module docstring."""
+
+    def __init__(self, name, timeout=SERVICE_TIMEOUT, retries=SERVICE_RETRIES,
+                 backoff=RETRY_BACKOFF, hedge_percentile=HEDGE_PERCENTILE,
+                 breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET,
+                 metrics=METRICS):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_percentile = hedge_percentile
+        self.breaker = CircuitBreaker(name, breaker_failures, breaker_reset)
+        self.metrics = metrics
+        # calls sent again after a failure, calls sent a second time because
+        # they were slow, and calls refused by the breaker
+        self.retried = 0
+        self.hedged = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def call(self, send):
+        """Return the response of send(timeout), which makes the call and should
+        give up after timeout seconds."""
+        for attempt in range(self.retries + 1):
+            self._check_breaker()
+            try:
+                response = self._send(send)
+            except Exception as e:
+                if not self._failed(e, attempt):
+                    raise
+                time.sleep(self._backoff(attempt))
+            else:
+                self.breaker.success()
+                return response
+
+    async def call_async(self, send):
+        """Like call(), but send() returns an awaitable, which is cancelled after
+        timeout seconds."""
+        for attempt in range(self.retries + 1):
+            self._check_breaker()
+            try:
+                response = await self._send_async(send)
+            except Exception as e:
+                if not self._failed(e, attempt):
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+            else:
+                self.breaker.success()
+                return response
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise ServiceUnavailable("circuit breaker of %s is open" % self.name)
+
+    def _failed(self, error, attempt):
+        """Record the failed call and return True if it is retried."""
+        if not retryable(error):
+            # the service answered
+            self.breaker.success()
+            return False
+        self.breaker.failure()
+        if attempt == self.retries:
+            return False
+        self._count('retried')
+        info("call of %s failed (%s: %s), retrying"
+             % (self.name, error.__class__.__name__, error))
+        return True
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _backoff(self, attempt):
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def hedge_delay(self):
+        """Return the seconds after which a call is sent a second time, or None
+        if the call is not hedged."""
+        if self.hedge_percentile is None:
+            return None
+        return self.metrics.latency_percentile(self.name, self.hedge_percentile, HEDGE_MIN_CALLS)
+
+    def _send(self, send):
+        """Send the call. When hedging, the attempts run in threads of their own
+        and the caller waits for the first one that succeeds. The second
+        attempt is only sent if the first has not returned after the hedge
+        delay."""
+        delay = self.hedge_delay()
+        if delay is None:
+            return send(self.timeout)
+        outcomes = queue.Queue()
+
+        def attempt():
+            try:
+                outcomes.put((True, send(self.timeout)))
+            except Exception as e:
+                outcomes.put((False, e))
+
+        threading.Thread(target=attempt, daemon=True).start()
+        try:
+            ok, value = outcomes.get(timeout=delay)
+        except queue.Empty:
+            self._count('hedged')
+            threading.Thread(target=attempt, daemon=True).start()
+            ok, value = outcomes.get()
+            if not ok:
+                # use the other attempt, which may still succeed
+                ok, value = outcomes.get()
+        if not ok:
+            raise value
+        return value
+
+    async def _send_async(self, send):
+        delay = self.hedge_delay()
+        first = asyncio.ensure_future(asyncio.wait_for(send(), self.timeout))
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        self._count('hedged')
+        pending = {first, asyncio.ensure_future(asyncio.wait_for(send(), self.timeout))}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not pending:
+                    # both failed
+                    return done.pop().result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def as_json(self):
+        with self._lock:
+            counts = {'retried': self.retried,
+                      'hedged': self.hedged,
+                      'rejected': self.rejected}
+        return dict({'timeout': self.timeout,
+                     'retries': self.retries,
+                     'hedge_percentile': self.hedge_percentile,
+                     'breaker': self.breaker.as_json()}, **counts)
+
+
+class CallPolicies(object):
+
+    """The call policies of all services, created when a service is first
+    called. The settings in defaults are used for all services, and are
+    updated with the settings for the service in the overrides."""
+
+    def __init__(self, overrides=SERVICE_POLICIES, metrics=METRICS, defaults=None):
+        self.overrides = overrides
+        self.metrics = metrics
+        self.defaults = defaults or {}
+        self.policies = {}
+        self._lock = threading.Lock()
+
+    def get(self, identifier):
+        with self._lock:
+            policy = self.policies.get(identifier)
+            if policy is None:
+                settings = dict(self.defaults, **self.overrides.get(identifier, {}))
+                policy = CallPolicy(identifier, metrics=self.metrics, **settings)
+                self.policies[identifier] = policy
+            return policy
+
+    def as_json(self):
+        with self._lock:
+            policies = list(self.policies.items())
+        return {identifier: policy.as_json() for identifier, policy in policies}
+
+
+POLICIES = CallPolicies()
@@ -0,0 +1,226 @@
+"""refresh.py
+
+Refreshing the service registry while the application runs.
+
+The lists of services and their metadata are cached in data/services and used to
+be refreshed only by deleting the cache. A RegistryRefresher asks the service
+managers for their lists of services every REFRESH_INTERVAL seconds and compares
+them to the services in the registry:
+
+>>> refresher = RegistryRefresher(LAPPS_SERVICES)
+>>> refresher.start()
+>>> refresher.refresh()
+{'added': [...], 'removed': [...], 'changed': [...], 'expired': [...], ...}
+
+Metadata are retrieved again only for new services, for services whose entry
+in the service manager changed and for services whose cached metadata are older
+than METADATA_TTL seconds, using REFRESH_WORKERS threads. Metadata files and
+service lists are replaced atomically. Services that are already in the
+registry are updated in place and the list of services and the categories are
+swapped when all metadata are in, so requests are never blocked by a refresh.
+
+Each refresh returns a report of what changed, the report of the last refresh
+is kept in the report instance variable and is available on /api/registry.
+
+"""
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from services import BRANDEIS, VASSAR, registry_lock
+from utils import info, write_json
+
+
+# Seconds between refreshes, None to only refresh on request.
+REFRESH_INTERVAL = getattr(config, 'REFRESH_INTERVAL', 24 * 3600)
+
+# Seconds after which cached metadata are retrieved again.
+METADATA_TTL = getattr(config, 'METADATA_TTL', 7 * 24 * 3600)
+
+# Number of metadata requests sent at the same time by a refresh.
+REFRESH_WORKERS = getattr(config, 'REFRESH_WORKERS', 4)
+
+
+class RegistryRefresher(object):
+
+    def __init__(self, registry, interval=REFRESH_INTERVAL, ttl=METADATA_TTL,
+                 workers=REFRESH_WORKERS):
+        self.registry = registry
+        self.interval = interval
+        self.ttl = ttl
+        self.workers = workers
+        self.report = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        # separate from _lock, which is held during a refresh
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start refreshing in a background thread every interval seconds, or
+        whenever trigger() is called. Concurrent calls start only one thread."""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def trigger(self):
+        """Have the background thread start a refresh now."""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                info("Refreshing the registry failed: %s" % e)
+
+    def refresh(self):
+        """Refresh the registry and return a report of what changed. Only one
+        refresh runs at a time. The service lists and metadata are fetched
+        without holding the lock shared by the processes using the registry
+        files, so a slow service manager does not hold up the other processes.
+        That lock is only taken to load the snapshot another process may have
+        written in the meantime, apply the changes and write the snapshot.
+        Metadata saved by another process since the refresh started are used
+        instead of fetching them again, see LappsService.refresh_metadata()."""
+        with self._lock:
+            t0 = time.time()
+            report = {'started': t0, 'seconds': None,
+                      'reloaded': self.registry.reload_snapshot(),
+                      'added': [], 'removed': [], 'changed': [], 'expired': [],
+                      'metadata_changed': [], 'errors': {}}
+            listings = self._fetch_service_lists(report)
+            identifiers, updates = self._compare(listings, report)
+            fetched = self._fetch_metadata(updates, report)
+            with registry_lock():
+                report['reloaded'] = self.registry.reload_snapshot() or report['reloaded']
+                saved = self._save_service_lists(listings)
+                if fetched or report['removed'] or saved:
+                    self._apply(listings, identifiers, fetched)
+            report['seconds'] = round(time.time() - t0, 3)
+            info("Refreshed registry in %.2f seconds: %d added, %d removed, %d changed, "
+                 "%d expired, %d with new metadata, %d errors"
+                 % (report['seconds'], len(report['added']), len(report['removed']),
+                    len(report['changed']), len(report['expired']),
+                    len(report['metadata_changed']), len(report['errors'])))
+            self.report = report
+            return report
+
+    def _apply(self, listings, identifiers, fetched):
+        """Update the registry with the fetched services. The services are looked
+        up again, since loading a snapshot may have added some of them."""
+        current = self.registry.services_idx
+        added = {}
+        for _, new_service in fetched:
+            service = current.get(new_service.identifier)
+            if service is None:
+                added[new_service.identifier] = new_service
+            else:
+                self._update(service, new_service)
+        services = [current.get(identifier) or added[identifier]
+                    for identifier in identifiers
+                    if identifier in current or identifier in added]
+        services.extend(s for s in self.registry.services if s.server not in listings)
+        self.registry.replace_services(services)
+
+    def _fetch_service_lists(self, report):
+        """Return a dictionary with the list of services of each server whose
+        service manager could be reached."""
+        listings = {}
+        for server in (BRANDEIS, VASSAR):
+            try:
+                listings[server] = self.registry.fetch_service_list(server)
+            except Exception as e:
+                report['errors'][server] = str(e)
+        return listings
+
+    def _save_service_lists(self, listings):
+        """Replace the local copies of the service lists that changed, returns
+        True if any did."""
+        saved = False
+        for server, elements in listings.items():
+            local_info = self.registry.service_list_locations(server)[0]
+            try:
+                with open(local_info) as fh:
+                    if json.load(fh) == elements:
+                        continue
+            except (OSError, ValueError):
+                pass
+            write_json(local_info, elements)
+            saved = True
+        return saved
+
+    def _compare(self, listings, report):
+        """Compare the service lists to the registry. Returns the identifiers of
+        the listed services, in the order of the lists, and a list of pairs of a
+        service in the registry, or None for new services, and a new service
+        object whose metadata should be fetched. Services on servers that could
+        not be reached are not removed."""
+        current = self.registry.services_idx
+        listed = set()
+        updates = []
+        identifiers = []
+        for server, elements in listings.items():
+            for service_info in elements:
+                new_service = self.registry.create_service(server, service_info)
+                if new_service is None or new_service.identifier in listed:
+                    continue
+                identifier = new_service.identifier
+                listed.add(identifier)
+                identifiers.append(identifier)
+                service = current.get(identifier)
+                if service is None:
+                    report['added'].append(identifier)
+                elif service.info != service_info:
+                    report['changed'].append(identifier)
+                elif self._expired(service):
+                    report['expired'].append(identifier)
+                else:
+                    continue
+                updates.append((service, new_service))
+        for service in self.registry.services:
+            if service.server in listings and service.identifier not in listed:
+                report['removed'].append(service.identifier)
+        return identifiers, updates
+
+    def _expired(self, service):
+        try:
+            return time.time() - os.path.getmtime(service.metadata_file) > self.ttl
+        except OSError:
+            return True
+
+    def _fetch_metadata(self, updates, report):
+        """Fetch the metadata for the new service objects in the updates and save
+        them. Returns the updates for which that worked."""
+
+        def fetch(update):
+            service, new_service = update
+            try:
+                new_service.refresh_metadata(report['started'])
+            except Exception as e:
+                report['errors'][new_service.identifier] = str(e)
+                return None
+            if service is not None and service.metadata != new_service.metadata:
+                report['metadata_changed'].append(new_service.identifier)
+            return update
+
+        if not updates:
+            return []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return [update for update in pool.map(fetch, updates) if update is not None]
+
+    @staticmethod
+    def _update(service, new_service):
+        """Give a service in the registry the information and metadata of the new
+        service object. It no longer uses the registry snapshot."""
+        service.info = new_service.info
+        service.metadata_string = new_service.metadata_string
+        service.metadata = new_service.metadata
+        service.snapshot = None
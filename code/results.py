@@ -0,0 +1,149 @@
+"""results.py
+
+Server-side storage of chain results.
+
+Result pages do not contain everything that can be shown for a result, parts of
+the page are requested later using the identifier of the stored result:
+
+>>> result_id = RESULTS.add(result)
+>>> RESULTS.get(result_id).result
+
+The store keeps the most recently used results, the number of results kept can
+be set with RESULT_STORE_SIZE in config.py. When the application runs in more
+than one process, see wsgi.py, the request for a part of a page may end up in a
+process that did not create the page. The store can then be shared: results
+are also written to RESULT_STORE_DIR and read from there when they are not in
+memory.
+
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+import config
+from lif import LifView
+from utils import dump, write_json
+
+
+RESULT_STORE_SIZE = getattr(config, 'RESULT_STORE_SIZE', 50)
+RESULT_STORE_DIR = getattr(config, 'RESULT_STORE_DIR', 'data/cache/stored')
+
+
+class StoredResult(object):
+
+    """A LIF result with a dictionary to cache things computed from it."""
+
+    def __init__(self, identifier, result):
+        self.identifier = identifier
+        self.result = result
+        self.created = time.time()
+        self.cache = {}
+
+    def text(self):
+        return self.result['payload']['text']['@value']
+
+    def views(self):
+        return self.result['payload']['views']
+
+    def view(self, n):
+        """Return view n or None if there is no such view."""
+        views = self.views()
+        return views[n] if 0 <= n < len(views) else None
+
+    def lif_view(self, n):
+        """Return view n as a LifView, which is created once and then cached, or
+        None if there is no such view."""
+        key = ('lif_view', n)
+        lif_view = self.cache.get(key)
+        if lif_view is None:
+            view = self.view(n)
+            if view is None:
+                return None
+            lif_view = self.cache[key] = LifView(view)
+        return lif_view
+
+    def annotations_json(self, n):
+        """Return the annotations of view n as indented JSON, this is created once
+        and used for the annotations tab of the view and for the LIF tab."""
+        key = ('annotations_json', n)
+        annotations_json = self.cache.get(key)
+        if annotations_json is None:
+            annotations_json = self.cache[key] = dump(self.view(n).get('annotations'))
+        return annotations_json
+
+
+class ResultStore(object):
+
+    def __init__(self, size=RESULT_STORE_SIZE):
+        self.size = size
+        self.results = OrderedDict()
+        # directory shared with other processes, None if the store is not shared
+        self.directory = None
+        self._lock = threading.Lock()
+
+    def share(self, directory=RESULT_STORE_DIR):
+        """Share the store with other processes that use the same directory."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def add(self, result, identifier=None):
+        """Store the result and return its identifier, which is generated unless
+        it is given."""
+        with self._lock:
+            if identifier in self.results:
+                self.results.move_to_end(identifier)
+                return identifier
+            if identifier is None:
+                identifier = uuid.uuid4().hex
+            self.results[identifier] = StoredResult(identifier, result)
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+        if self.directory is not None:
+            write_json(self._path(identifier), result, indent=None)
+            self._remove_old_files()
+        return identifier
+
+    def get(self, identifier):
+        """Return the StoredResult or None if it is not or no longer stored."""
+        with self._lock:
+            stored = self.results.get(identifier)
+            if stored is not None:
+                self.results.move_to_end(identifier)
+                return stored
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(identifier)) as fh:
+                result = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            stored = self.results.setdefault(identifier, StoredResult(identifier, result))
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+            return stored
+
+    def _path(self, identifier):
+        # identifiers come from URLs, so only use their name part
+        return os.path.join(self.directory, os.path.basename(identifier) + '.json')
+
+    def _remove_old_files(self):
+        """Keep the files of the last size results added by any process."""
+        try:
+            paths = [os.path.join(self.directory, fname)
+                     for fname in os.listdir(self.directory) if fname.endswith('.json')]
+            paths.sort(key=os.path.getmtime, reverse=True)
+        except OSError:
+            return
+        for path in paths[self.size:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+RESULTS = ResultStore()
@@ -43,28 +43,50 @@ Update: it seems like you can go without the views, but not the metadata.
 
 import os
 import sys
+import asyncio
 import io
 import json
-import urllib
-import requests
-import zeep
+import time
+import urllib.parse
+import urllib.request
+import zlib
 import operator
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 import lif_examples
+import config
+import batch
+import lif
 
-from utils import info, debug
-from config import BRANDEIS_USER, BRANDEIS_PASSWORD
-from config import VASSAR_USER, VASSAR_PASSWORD
+from snapshot import RegistrySnapshot, SnapshotError, source_times
+from utils import info, debug, write_json, file_lock
+from clients import CLIENTS, ASYNC_CLIENTS
+from cache import RESULT_CACHE, digest
+from metrics import METRICS, StepMetrics, count_annotations, utf8_size
+from policy import POLICIES
 
 
 # set to True if yu want to save the output of each step in a chain
 SAVE_STEPS = False
 
+# File with the chain definitions, if it does not exist the chains in
+# ServiceChains.CHAINS are used, and the maximum number of steps of one chain
+# that run at the same time.
+CHAINS_FILE = getattr(config, 'CHAINS_FILE', 'data/chains.json')
+CHAIN_WORKERS = getattr(config, 'CHAIN_WORKERS', 8)
+
+# send services only the views with annotation types they require instead of
+# the whole document, and merge the views they add into the document locally
+DELTA_TRANSFER = getattr(config, 'DELTA_TRANSFER', True)
+
 # set to True in order to use the output example as the output of the LAPPS
 # processing, useful while debugging when you have no internet connection
 BYPASS_CHAIN_PROCEESING = False
 
 
+ERROR = 'http://vocab.lappsgrid.org/ns/error'
+
 BRANDEIS = 'brandeis'
 VASSAR = 'vassar'
 
@@ -82,6 +104,75 @@ SERVICE_METADATA = 'data/services/metadata'
 BRANDEIS_SERVICES_INFO = 'data/services/info/brandeis.json'
 VASSAR_SERVICES_INFO = 'data/services/info/vassar.json'
 
+# Snapshot of the registry with the information and metadata of all services in
+# one file, used at startup when the files above did not change, see
+# snapshot.py. Set to None to always load the registry from the files above.
+REGISTRY_SNAPSHOT = getattr(config, 'REGISTRY_SNAPSHOT', 'data/services/registry.snapshot')
+
+# URL of a server that stands in for the service managers and the services of
+# both Brandeis and Vassar, for example the mock in mock_service.py. None means
+# that the LAPPS Grid is used.
+SERVICE_BACKEND = getattr(config, 'SERVICE_BACKEND', None)
+
+# Number of lock files used to make sure that only one process at a time
+# retrieves the metadata of a service, see metadata_lock().
+METADATA_LOCKS = 256
+
+# Number of threads used at startup to retrieve metadata that is not in the
+# local cache, and the number of seconds we wait for one getMetadata() call.
+# Both can be overruled in config.py.
+BOOTSTRAP_WORKERS = getattr(config, 'BOOTSTRAP_WORKERS', 16)
+METADATA_TIMEOUT = getattr(config, 'METADATA_TIMEOUT', 30)
+
+# Maximum number of documents that each step of a chain works on at the same
+# time in batch mode, and the maximum number of documents in the pipeline.
+BATCH_STEP_WORKERS = getattr(config, 'BATCH_STEP_WORKERS', 4)
+BATCH_WINDOW = getattr(config, 'BATCH_WINDOW', 64)
+
+
+def use_service_backend(url):
+    """Get service lists, WSDLs and metadata from the server at the URL instead of
+    from the LAPPS Grid. The local caches of service information and metadata
+    for that server are kept apart from the caches for the LAPPS Grid. Only
+    services created after this call use the new server."""
+    global BRANDEIS_SERVICES, VASSAR_SERVICES, WSDL_PATH_BRANDEIS, WSDL_PATH_VASSAR
+    global SERVICE_METADATA, BRANDEIS_SERVICES_INFO, VASSAR_SERVICES_INFO, REGISTRY_SNAPSHOT
+    url = url.rstrip('/')
+    BRANDEIS_SERVICES = url + '/services/brandeis'
+    VASSAR_SERVICES = url + '/services/vassar'
+    WSDL_PATH_BRANDEIS = WSDL_PATH_VASSAR = url + '/wsdl/'
+    local = os.path.join('data/services/backends', urllib.parse.quote(url, safe=''))
+    SERVICE_METADATA = os.path.join(local, 'metadata')
+    BRANDEIS_SERVICES_INFO = os.path.join(local, 'info/brandeis.json')
+    VASSAR_SERVICES_INFO = os.path.join(local, 'info/vassar.json')
+    if REGISTRY_SNAPSHOT is not None:
+        REGISTRY_SNAPSHOT = os.path.join(local, 'registry.snapshot')
+    for directory in (SERVICE_METADATA, os.path.dirname(BRANDEIS_SERVICES_INFO)):
+        os.makedirs(directory, exist_ok=True)
+
+
+if SERVICE_BACKEND is not None:
+    use_service_backend(SERVICE_BACKEND)
+
+
+def _lock_file(name):
+    return os.path.join(os.path.dirname(SERVICE_METADATA), 'locks', name)
+
+
+def registry_lock():
+    """Return a lock that is held while the registry is loaded from its sources
+    or refreshed, so that when several processes need to do that at the same
+    time one of them does the work and the others use its snapshot."""
+    return file_lock(_lock_file('registry.lock'))
+
+
+def metadata_lock(identifier):
+    """Return a lock that is held while the metadata of a service are retrieved,
+    so that processes and threads never retrieve the same metadata at the same
+    time. Services share METADATA_LOCKS lock files."""
+    stripe = zlib.crc32(identifier.encode('utf-8')) % METADATA_LOCKS
+    return file_lock(_lock_file('metadata-%03d.lock' % stripe))
+
 
 class LappsServices(object):
 
@@ -92,57 +183,210 @@ class LappsServices(object):
        services       list of all services
        services_idx   services indexed on serviceId
        categories     services grouped on output types
+       version        incremented each time the services are categorized
+       rendered       cache for presentations of the services, for example
+                      the HTML on the index page, emptied with a new version
+
+    The services are loaded from REGISTRY_SNAPSHOT if it is current, otherwise
+    from the service managers and the metadata of each service, after which a
+    new snapshot is written.
 
     """
 
-    def __init__(self):
+    def __init__(self, workers=BOOTSTRAP_WORKERS, snapshot=None):
+        """The snapshot argument overrules REGISTRY_SNAPSHOT, use False to not
+        use a snapshot."""
         info("Loading LAPPS services...")
-        brandeis_services = self._load_services(BRANDEIS)
-        vassar_services = self._load_services(VASSAR)
+        t0 = time.time()
         self.services = []
         self.services_idx = {}
         self.categories = {}
+        self.version = 0
+        self.rendered = {}
+        self.snapshot = REGISTRY_SNAPSHOT if snapshot is None else snapshot or None
+        # modification time of the snapshot file that was loaded or written
+        self.snapshot_time = None
+        if not self._load_snapshot():
+            with registry_lock():
+                # another process may have written the snapshot in the meantime
+                if not self._load_snapshot():
+                    self._load_sources(workers)
+                    self._write_snapshot()
+        info("Loaded %d services in %.2f seconds" % (len(self.services), time.time() - t0))
+
+    def _sources(self):
+        """Return the modification times of the files the registry is loaded from
+        when there is no current snapshot."""
+        return source_times([BRANDEIS_SERVICES_INFO, VASSAR_SERVICES_INFO, SERVICE_METADATA])
+
+    def _load_snapshot(self):
+        """Load the services from the snapshot, the information and metadata of
+        each service are read from the snapshot when first used. Returns False
+        if there is no current snapshot."""
+        if self.snapshot is None or not os.path.exists(self.snapshot):
+            return False
+        try:
+            snapshot_time = os.stat(self.snapshot).st_mtime_ns
+            snapshot = RegistrySnapshot(self.snapshot)
+        except (OSError, SnapshotError) as e:
+            info("Ignoring registry snapshot: %s" % e)
+            return False
+        if not snapshot.is_current(self._sources()):
+            info("Registry snapshot %s is out of date" % self.snapshot)
+            snapshot.close()
+            return False
+        info("Loading registry snapshot %s..." % self.snapshot)
+        services = []
+        for position, (server, identifier, summary) in enumerate(snapshot.entries):
+            # when the snapshot is loaded again the service objects are kept, so
+            # that chains built earlier use the new information and metadata
+            service = self.services_idx.get(identifier)
+            if service is None or service.server != server:
+                service = LappsService(server, identifier, load_metadata=False)
+            service.info = None
+            service.metadata_string = None
+            service.metadata = None
+            service.snapshot = snapshot
+            service.position = position
+            service.summary = summary
+            services.append(service)
+        self.services = services
+        self.services_idx = {service.identifier: service for service in services}
+        self.categorize({tuple(annotation_types): [services[p] for p in positions]
+                         for annotation_types, positions in snapshot.categories})
+        self.snapshot_time = snapshot_time
+        return True
+
+    def reload_snapshot(self):
+        """Load the snapshot again if another process wrote a new one after it
+        was loaded or written by this registry. Services that are still in the
+        registry are updated in place. Returns True if it was loaded."""
+        if self.snapshot is None:
+            return False
+        snapshot_time = source_times([self.snapshot])[self.snapshot]
+        if snapshot_time is None or snapshot_time == self.snapshot_time:
+            return False
+        return self._load_snapshot()
+
+    def _write_snapshot(self):
+        if self.snapshot is None:
+            return
+        t0 = time.time()
+        positions = {service: p for p, service in enumerate(self.services)}
+        entries = [[service.server, service.identifier, service._summary(),
+                    json.dumps(service.info),
+                    service.metadata_string or json.dumps(service.metadata)]
+                   for service in self.services]
+        categories = [[list(annotation_types), [positions[s] for s in services]]
+                      for annotation_types, services in self.categories.items()]
+        try:
+            RegistrySnapshot.write(self.snapshot, entries, categories, self._sources())
+            self.snapshot_time = os.stat(self.snapshot).st_mtime_ns
+        except OSError as e:
+            info("Could not write registry snapshot: %s" % e)
+            return
+        info("Wrote registry snapshot %s in %.2f seconds" % (self.snapshot, time.time() - t0))
+
+    def _load_sources(self, workers):
+        # the two service managers are independent so ask them both at once
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            brandeis_services = pool.submit(self._load_services, BRANDEIS)
+            vassar_services = pool.submit(self._load_services, VASSAR)
+            brandeis_services = brandeis_services.result()
+            vassar_services = vassar_services.result()
+        candidates = []
         for service_info in brandeis_services:
-            self._add_service(BRANDEIS, service_info)
+            candidates.append(self.create_service(BRANDEIS, service_info))
         for service_info in vassar_services:
-            self._add_service(VASSAR, service_info)
+            candidates.append(self.create_service(VASSAR, service_info))
+        candidates = [c for c in candidates if c is not None]
+        failed = self._load_all_metadata(candidates, workers)
+        for service in candidates:
+            if service not in failed:
+                self.services.append(service)
+                self.services_idx[service.identifier] = service
         self.categorize()
-        
-    def _load_services(self, server):
-        """Return the service information from all services registered in the
-        ServiceManager on the server. Use local cached results if available."""
+
+    @staticmethod
+    def service_list_locations(server):
+        """Return the local cache and the URL of the list of services on the
+        server."""
         if server == BRANDEIS:
-            local_info = BRANDEIS_SERVICES_INFO
-            services_url = BRANDEIS_SERVICES
+            return BRANDEIS_SERVICES_INFO, BRANDEIS_SERVICES
         elif server == VASSAR:
-            local_info = VASSAR_SERVICES_INFO
-            services_url = VASSAR_SERVICES
+            return VASSAR_SERVICES_INFO, VASSAR_SERVICES
         else:
             exit("Unknown server: %s" % server)
+
+    @classmethod
+    def fetch_service_list(cls, server):
+        """Return the service information from all services registered in the
+        ServiceManager on the server, asking the ServiceManager."""
+        services_url = cls.service_list_locations(server)[1]
+        http_response = urllib.request.urlopen(services_url, timeout=METADATA_TIMEOUT)
+        return json.loads(http_response.read())['elements']
+
+    def _load_services(self, server):
+        """Return the service information from all services registered in the
+        ServiceManager on the server. Use local cached results if available."""
+        local_info = self.service_list_locations(server)[0]
         if os.path.exists(local_info):
             info("Loading local cache with information for services on %s..." % server)
             with open(local_info) as fh:
                 services = json.loads(fh.read())
         else:
             info("Pinging %s service manager for list of services..." % server)
-            http_response = urllib.request.urlopen(services_url)
-            response_code = http_response.getcode()
-            services = json.loads(http_response.read())['elements']
-            json.dump(services, open(local_info, 'w'), indent=4)
+            services = self.fetch_service_list(server)
+            write_json(local_info, services)
         return services
     
-    def _add_service(self, server, service_info):
+    def create_service(self, server, service_info):
+        """Return a LappsService without metadata, returns None for services we
+        are not interested in."""
         service_id = service_info['serviceId']
         if server == VASSAR:
             if 'opennlp' in service_id or 'gost' in service_id:
-                return
+                return None
+        return LappsService(server, service_id, service_info, load_metadata=False)
+
+    def _load_all_metadata(self, services, workers):
+        """Load the metadata for all services and return the set of services for
+        which that failed. Metadata from the local cache are read in sequence,
+        missing metadata are retrieved using a pool of threads."""
+        failed = set()
+        missing = []
+        for service in services:
+            if os.path.exists(service.metadata_file):
+                if not self._try_load_metadata(service):
+                    failed.add(service)
+            else:
+                missing.append(service)
+        if missing:
+            t0 = time.time()
+            info("Retrieving metadata for %d services using %d threads..."
+                 % (len(missing), workers))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(self._try_load_metadata, service): service
+                           for service in missing}
+                done = 0
+                for future in as_completed(futures):
+                    done += 1
+                    if not future.result():
+                        failed.add(futures[future])
+                    if done % 10 == 0 or done == len(missing):
+                        info("Retrieved metadata for %d/%d services (%d errors, %.2f seconds)"
+                             % (done, len(missing), len(failed), time.time() - t0))
+        return failed
+
+    @staticmethod
+    def _try_load_metadata(service):
         try:
-            service = LappsService(server, service_id, service_info)
-            self.services.append(service)
-            self.services_idx[service_id] = service
+            service._load_metadata()
+            return True
         except Exception as e:
-            print('ERROR with %s' % service_id)
+            print('ERROR with %s' % service.identifier)
             print(e)
+            return False
 
     def __len__(self):
         return len(self.services)
@@ -153,15 +397,28 @@ class LappsServices(object):
     def get_service(self, identifier):
         return self.services_idx.get(identifier)
 
-    def categorize(self):
-        self.categories = {}
-        for service in self.services:
-            try:
-                produces = service.metadata['payload']['produces']['annotations']
-            except KeyError:
-                produces = tuple()
-            produces = tuple(sorted(produces))
-            self.categories.setdefault(produces, []).append(service)
+    def replace_services(self, services):
+        """Replace the services with a new list of services. The list, the index
+        and the categories are swapped in one go, so requests that are running
+        keep using either the old or the new services. Writes a new snapshot."""
+        services_idx = {service.identifier: service for service in services}
+        self.services, self.services_idx = services, services_idx
+        self.categorize()
+        self._write_snapshot()
+
+    def categorize(self, categories=None):
+        """Group the services on their outputs. This should be done after every
+        change to the services or their metadata, it creates a new version and
+        clears all cached presentations. The groups can be given, as they are
+        when loading a registry snapshot."""
+        if categories is None:
+            categories = {}
+            for service in self.services:
+                produces = tuple(sorted(service.produces() or ()))
+                categories.setdefault(produces, []).append(service)
+        self.categories = categories
+        self.rendered = {}
+        self.version += 1
 
     def print_categorized_services(self, fh=sys.stdout):
         fh.write('\n')
@@ -184,24 +441,72 @@ class LappsService(object):
     """An object that has all the information needed to allow our interface to
     interact with a LAPPS service."""
     
-    def __init__(self, server, tool_identifier, service_manager_info=None):
+    def __init__(self, server, tool_identifier, service_manager_info=None,
+                 load_metadata=True):
         """Initialize a service and extract its metadata. A service is identified
         by the server, the service id and may optionally be given the information
-        from the ServiceManager."""
+        from the ServiceManager. With load_metadata=False it is up to the caller
+        to run _load_metadata()."""
         self.server = server
         self.identifier = tool_identifier
-        self.info = service_manager_info
         self.wsdl = self._get_wsdl_path()
         self.metadata_file = self._get_metadata_file()
         # Lazy initialization of the zeep client, will initialize if needed when
         # you get the metadata from the service or when you run its execute()
         # method.
         self.client = None
-        self._load_metadata()
+        self._info = service_manager_info
+        self._metadata = None
+        self._metadata_string = None
+        # A RegistrySnapshot and the position of the service in it, for services
+        # whose information and metadata are read from the snapshot when first
+        # used.
+        self.snapshot = None
+        self.position = None
+        # The version and the annotation types required and produced, taken
+        # from the metadata or from the snapshot, see _summary().
+        self.summary = None
+        # Incremented each time the metadata are replaced, for example by a
+        # refresh of the registry, so that chains can update their dependencies.
+        self.metadata_changes = 0
+        if load_metadata:
+            self._load_metadata()
 
     def __str__(self):
         return "<Service id='%s'>" % self.identifier
 
+    @property
+    def info(self):
+        if self._info is None and self.snapshot is not None:
+            self._info = json.loads(self.snapshot.info(self.position))
+        return self._info
+
+    @info.setter
+    def info(self, info):
+        self._info = info
+
+    @property
+    def metadata_string(self):
+        if self._metadata_string is None and self.snapshot is not None:
+            self._metadata_string = self.snapshot.metadata(self.position)
+        return self._metadata_string
+
+    @metadata_string.setter
+    def metadata_string(self, metadata_string):
+        self._metadata_string = metadata_string
+
+    @property
+    def metadata(self):
+        if self._metadata is None and self.snapshot is not None:
+            self._metadata = json.loads(self.metadata_string)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
+        self.summary = None
+        self.metadata_changes += 1
+
     def _get_wsdl_path(self):
         if self.server == BRANDEIS:
             return WSDL_PATH_BRANDEIS + self.identifier
@@ -212,43 +517,62 @@ class LappsService(object):
         return os.path.join(SERVICE_METADATA, self.identifier + '.json')
         
     def _connect(self):
-        """Connect the object to the service by creating the zeep client. Only done
-        if needed, that is, when self.client is None and the client is required."""
-        if self.client is None:
-            session = requests.Session()
-            if self.server == BRANDEIS:
-                user, password = BRANDEIS_USER, BRANDEIS_PASSWORD
-            elif self.server == VASSAR:
-                user, password = VASSAR_USER, VASSAR_PASSWORD
-            else:
-                exit("Unknown server: %s" % self.server)
-            session.auth = requests.auth.HTTPBasicAuth(user, password)
-            transport = zeep.transports.Transport(session=session)
-            self.client = zeep.Client(self.wsdl, transport=transport)
+        """Connect the object to the service by getting the zeep client from the
+        client factory. The client and its HTTP session are shared with all other
+        objects for the same WSDL and server. The client is looked up each time,
+        so that processes forked from this one use their own clients."""
+        self.client = CLIENTS.get_client(self.server, self.wsdl)
         
     def _load_metadata(self):
         """Load metadata from local directory if you have it, if not, get it from
         the service itself and save it to disk. There is now no mechansim in the
         code to update the local metadata, but you can do it simply delete the
-        contents of data/services/metadata."""
-        if os.path.exists(self.metadata_file):
-            with open(self.metadata_file) as fh:
-                self.metadata_string = fh.read()
-            self.metadata = json.loads(self.metadata_string)
-        else:
-            self._connect()
-            info("Retrieving metadata from %s" % self.identifier)
-            self.metadata_string = self.client.service.getMetadata()
-            self._fix_return_type()
-            self.metadata = json.loads(self.metadata_string)
-            json.dump(self.metadata, open(self.metadata_file, 'w'), indent=4)
-
-    def _fix_return_type(self):
+        contents of data/services/metadata. Metadata can also be refreshed while
+        the application runs, see refresh.py."""
+        if not os.path.exists(self.metadata_file):
+            with metadata_lock(self.identifier):
+                # another process may have retrieved them in the meantime
+                if not os.path.exists(self.metadata_file):
+                    self._save_metadata(self.fetch_metadata())
+                    return
+        self._read_metadata()
+
+    def refresh_metadata(self, since):
+        """Retrieve the metadata from the service and save them, unless another
+        process saved them after the time since, then those are used."""
+        with metadata_lock(self.identifier):
+            try:
+                fresh = os.path.getmtime(self.metadata_file) >= since
+            except OSError:
+                fresh = False
+            if fresh:
+                self._read_metadata()
+            else:
+                self._save_metadata(self.fetch_metadata())
+
+    def _read_metadata(self):
+        with open(self.metadata_file) as fh:
+            self.metadata_string = fh.read()
+        self.metadata = json.loads(self.metadata_string)
+
+    def _save_metadata(self, metadata_string):
+        self.metadata_string = metadata_string
+        self.metadata = json.loads(metadata_string)
+        write_json(self.metadata_file, self.metadata)
+
+    def fetch_metadata(self):
+        """Return the metadata string retrieved from the service itself."""
+        self._connect()
+        info("Retrieving metadata from %s" % self.identifier)
+        with self.client.transport.call_timeout(METADATA_TIMEOUT):
+            return self._fix_return_type(self.client.service.getMetadata())
+
+    @staticmethod
+    def _fix_return_type(metadata_string):
         """Sometimes when getting the metadata the zeep client returns a string
         and sometimes an object with type <class 'zeep.objects.string'>. In the
         latter case the JSON metadata string is embedded in a field named
-        '_value_1', this code retrieves that field and uses it to set the
-        metadata string.
+        '_value_1', this code retrieves that field and returns it.
 
         You can see the difference with
         
@@ -260,23 +584,192 @@ class LappsService(object):
         either xsd:string or soapenc:string.
 
         """
-        if not isinstance(self.metadata_string, str):
-            self.metadata_string = self.metadata_string['_value_1']
+        if not isinstance(metadata_string, str):
+            metadata_string = metadata_string['_value_1']
+        return metadata_string
 
     def getMetadata(self):
-        """Return service metadata as a JSON object."""
+        """Return service metadata as a JSON object, loading it if that was not
+        done yet."""
+        if self.metadata is None:
+            self._load_metadata()
         return self.metadata
 
-    def execute(self, service_input):
-        """Execute the service on an input JSON object, returns a JSON object."""
+    def _summary(self):
+        """Return a dictionary with the version and the annotation types required
+        and produced by the service. It is taken from the metadata once and then
+        kept, so it does not need the metadata of services from a snapshot."""
+        if self.summary is None:
+            payload = self.getMetadata()['payload']
+            summary = {'version': payload.get('version')}
+            for direction in ('requires', 'produces'):
+                try:
+                    summary[direction] = payload[direction]['annotations']
+                except (KeyError, TypeError):
+                    summary[direction] = None
+            self.summary = summary
+        return self.summary
+
+    def requires(self):
+        """Return the annotation types the service requires from its metadata, or
+        None if they are not known."""
+        try:
+            return self._summary()['requires']
+        except Exception:
+            return None
+
+    def produces(self):
+        """Return the annotation types the service produces from its metadata, or
+        None if they are not known."""
+        try:
+            return self._summary()['produces']
+        except Exception:
+            return None
+
+    def version(self):
+        """Return the version of the service from its metadata."""
+        try:
+            return self._summary()['version']
+        except (KeyError, TypeError, AttributeError):
+            return None
+
+    def execute(self, service_input, metrics=None):
+        """Execute the service on an input JSON object, returns a JSON object.
+        Results are cached on the service, its version and the input, results
+        taken from the cache should not be changed. Timings and sizes of the
+        call are added to METRICS and, if given, written to the metrics, which
+        is a StepMetrics object. The call is made with the timeout, retries and
+        circuit breaker of the service, see policy.py."""
+        metrics, service_input, key = self._prepare_call(service_input, metrics)
+        result = self._get_cached(metrics, key)
+        if result is not None:
+            return result
         self._connect()
+        send = functools.partial(self._send, self.client, service_input)
+        send = functools.partial(self._timed, send)
+        t1 = time.perf_counter()
+        try:
+            response, network = POLICIES.get(self.identifier).call(send)
+        except Exception:
+            self._call_failed(metrics, t1)
+            raise
+        result = self._finish_call(response, metrics, t1, network)
+        self._put_cached(metrics, key, result)
+        return result
+
+    async def execute_async(self, service_input, metrics=None):
+        """Like execute(), but the SOAP call is sent with an asyncio client from
+        ASYNC_CLIENTS, so many calls can wait for their responses in one thread.
+        Must be awaited in the event loop that uses ASYNC_CLIENTS. The result
+        cache is read and written in a thread so the event loop is not blocked
+        by disk access."""
+        loop = asyncio.get_running_loop()
+        metrics, service_input, key = self._prepare_call(service_input, metrics)
+        if key is not None:
+            result = await loop.run_in_executor(None, self._get_cached, metrics, key)
+            if result is not None:
+                return result
+        client = await ASYNC_CLIENTS.get_client(self.server, self.wsdl)
+        send = functools.partial(client.service.execute, service_input)
+        send = functools.partial(self._timed_async, send)
+        t1 = time.perf_counter()
+        try:
+            response, network = await POLICIES.get(self.identifier).call_async(send)
+        except Exception:
+            self._call_failed(metrics, t1)
+            raise
+        result = self._finish_call(response, metrics, t1, network)
+        if key is not None:
+            await loop.run_in_executor(None, self._put_cached, metrics, key, result)
+        return result
+
+    @staticmethod
+    def _send(client, service_input, timeout):
+        with client.transport.call_timeout(timeout):
+            return client.service.execute(service_input)
+
+    def _prepare_call(self, service_input, metrics):
+        """Return the metrics, the input as a string and the cache key, which is
+        None if there is no result cache."""
+        if metrics is None:
+            metrics = StepMetrics(self.identifier)
         # the client expects a string so get it from the JSON
+        t0 = time.perf_counter()
         service_input = json.dumps(service_input)
-        return json.loads(self.client.service.execute(service_input))
+        metrics.serialize = time.perf_counter() - t0
+        metrics.request_bytes = utf8_size(service_input)
+        key = None
+        if RESULT_CACHE is not None:
+            key = RESULT_CACHE.key(self.identifier, self.version(), digest(service_input))
+        return metrics, service_input, key
+
+    def _get_cached(self, metrics, key):
+        """Return the cached result for the key, or None if the service has to
+        be called."""
+        if key is None:
+            return None
+        result = RESULT_CACHE.get(key)
+        if result is not None:
+            info("cache hit for %s" % self.identifier)
+            metrics.cached = True
+            metrics.annotations = count_annotations(result)
+            METRICS.observe(metrics)
+        return result
+
+    @staticmethod
+    def _put_cached(metrics, key, result):
+        if key is not None and not metrics.error:
+            RESULT_CACHE.put(key, result)
+
+    @staticmethod
+    def _timed(send, timeout):
+        """Return the response of one attempt of a call and its duration, so
+        that the time of failed attempts and of waiting for retries is not
+        counted as network time."""
+        t0 = time.perf_counter()
+        response = send(timeout)
+        return response, time.perf_counter() - t0
+
+    @staticmethod
+    async def _timed_async(send):
+        t0 = time.perf_counter()
+        response = await send()
+        return response, time.perf_counter() - t0
+
+    @staticmethod
+    def _call_failed(metrics, t1):
+        metrics.network = time.perf_counter() - t1
+        metrics.error = True
+        METRICS.observe(metrics)
+
+    def _finish_call(self, response, metrics, t1, network):
+        """Return the JSON object of the response of a call that was sent at t1,
+        and record it. The network time is that of the attempt that answered,
+        the rest of the time since t1 went to failed attempts and retries."""
+        t2 = time.perf_counter()
+        result = json.loads(response)
+        metrics.network = network
+        metrics.retrying = max(0.0, t2 - t1 - network)
+        metrics.deserialize = time.perf_counter() - t2
+        metrics.response_bytes = utf8_size(response)
+        metrics.error = is_error(result)
+        metrics.annotations = count_annotations(result)
+        METRICS.observe(metrics)
+        return result
 
 
 class ServiceChains(object):
 
+    """The service chains defined in CHAINS_FILE, a JSON dictionary with for each
+    chain identifier a list of steps like
+
+        {"server": "brandeis", "service": "brandeis_eldrad_grid_1:stanfordnlp.tokenizer_2.0.4"}
+
+    A step may have an "after" property with the identifiers of the services in
+    earlier steps it depends on, otherwise the dependencies are taken from the
+    metadata of the services, see ServiceChain.dependencies(). The chains below
+    are used if there is no such file."""
+
     CHAINS = {
         'stanford-tok-pos': (
             ('brandeis', 'brandeis_eldrad_grid_1:stanfordnlp.tokenizer_2.0.4'),
@@ -294,11 +787,47 @@ class ServiceChains(object):
             ('brandeis', 'brandeis_eldrad_grid_1:stanfordnlp.parser_2.0.4'))
     }
 
-    def __init__(self, services):
+    def __init__(self, services, definitions=None):
+        """Build the chains from the services in the LappsServices registry, so
+        that all chains share the same already loaded service objects. The
+        definitions default to the ones from load_definitions()."""
+        t0 = time.time()
+        if definitions is None:
+            definitions = self.load_definitions()
+        self.registry = services
         self.chains = {}
-        for chain_id, chain in ServiceChains.CHAINS.items():
-            services = [LappsService(server, s) for server, s in chain]
-            self.chains[chain_id] = ServiceChain(chain_id, services)
+        # services that are not in the registry, created when first needed
+        self.fallbacks = {}
+        for chain_id, steps in definitions.items():
+            chain_services = [self._get_service(step['server'], step['service'])
+                              for step in steps]
+            after = [step.get('after') for step in steps]
+            self.chains[chain_id] = ServiceChain(chain_id, chain_services, after)
+        info("Created %d service chains in %.3f seconds (%d services not in registry)"
+             % (len(self.chains), time.time() - t0, len(self.fallbacks)))
+
+    @classmethod
+    def load_definitions(cls, fname=None):
+        """Return the chain definitions from the file, which defaults to
+        CHAINS_FILE, or from CHAINS if there is no such file."""
+        fname = CHAINS_FILE if fname is None else fname
+        if fname is not None and os.path.exists(fname):
+            with open(fname) as fh:
+                return json.load(fh)
+        return {chain_id: [{'server': server, 'service': service} for server, service in steps]
+                for chain_id, steps in cls.CHAINS.items()}
+
+    def _get_service(self, server, identifier):
+        """Return the service from the registry. If it is not there, return a
+        service whose metadata will be loaded when first needed."""
+        service = self.registry.get_service(identifier)
+        if service is None:
+            service = self.fallbacks.get(identifier)
+            if service is None:
+                info("Service %s not in registry, loading it lazily" % identifier)
+                service = LappsService(server, identifier, load_metadata=False)
+                self.fallbacks[identifier] = service
+        return service
 
     def get_chain(self, chain_identifier):
         return self.chains.get(chain_identifier)
@@ -314,36 +843,401 @@ class ServiceChains(object):
 class ServiceChain(object):
 
     """Defines a service chain, which is a sequence of LappsService objects. With
-    this, you can run a sequence of services on some input."""
+    this, you can run a sequence of services on some input. Steps that do not
+    depend on each other run at the same time."""
 
-    def __init__(self, identifier, services):
+    def __init__(self, identifier, services, after=None):
+        """The after argument has for each step either None or the identifiers of
+        the services of earlier steps that the step depends on."""
         self.identifier = identifier
         self.services = services
-
-    def run(self, chain_input):
-        """Run all the services in sequence on the JSON input."""
+        self.after = after or [None] * len(services)
+        # the metadata changes of the services and the dependencies computed
+        # from those metadata
+        self._dependencies = (None, None)
+
+    def dependencies(self):
+        """Return for each step the set of earlier steps it depends on. A step
+        depends on the steps listed in its after property, or else on the
+        earlier steps that produce an annotation type it requires. Types are
+        matched in full, so a step requiring Token depends on a tokenizer and
+        not on a tagger producing Token#pos, unless no earlier step produces
+        Token itself. Steps whose service has no metadata depend on all earlier
+        steps and are depended on by all later steps that require something.
+        The dependencies are computed again when the metadata of a service
+        changed."""
+        changes = [service.metadata_changes for service in self.services]
+        computed_for, dependencies = self._dependencies
+        if changes != computed_for:
+            dependencies = []
+            produced = []
+            for j, service in enumerate(self.services):
+                after = self.after[j]
+                requires = service.requires()
+                if after is not None:
+                    steps = set(i for i in range(j) if self.services[i].identifier in after)
+                elif requires is None:
+                    steps = set(range(j))
+                else:
+                    steps = set(i for i in range(j) if produced[i] is None)
+                    for required in requires:
+                        steps.update(self._producers(required, produced[:j]))
+                dependencies.append(steps)
+                produces = service.produces()
+                produced.append(None if produces is None else set(produces))
+            self._dependencies = (changes, dependencies)
+        return dependencies
+
+    @staticmethod
+    def _producers(required, produced):
+        """Return the steps that produce the required type, or if there are none
+        the steps that produce a type with the same base type."""
+        steps = [i for i, types in enumerate(produced) if types is not None and required in types]
+        if not steps:
+            base = lif.base_type(required)
+            steps = [i for i, types in enumerate(produced)
+                     if types is not None and any(lif.base_type(t) == base for t in types)]
+        return steps
+
+    def ancestors(self):
+        """Return for each step the set of steps it depends on directly or
+        through other steps."""
+        ancestors = []
+        for steps in self.dependencies():
+            closure = set(steps)
+            for i in steps:
+                closure |= ancestors[i]
+            ancestors.append(closure)
+        return ancestors
+
+    def cache_key(self, chain_input):
+        """Return the key used to cache the result of the entire chain."""
+        versions = ["%s@%s" % (s.identifier, s.version()) for s in self.services]
+        return RESULT_CACHE.key('chain', *versions, digest(json.dumps(chain_input)))
+
+    def get_cached(self, chain_input):
+        """Return the cache key for the input and the cached result of the entire
+        chain, the result is None if there is none and both are None if there
+        is no cache."""
+        if RESULT_CACHE is None:
+            return None, None
+        key = self.cache_key(chain_input)
+        result = RESULT_CACHE.get(key)
+        if result is not None:
+            info("cache hit for chain %s" % self.identifier)
+        return key, result
+
+    def put_cached(self, key, result):
+        if key is not None and not is_error(result):
+            RESULT_CACHE.put(key, result)
+
+    def run(self, chain_input, progress=None, metrics=None):
+        """Run all the services in sequence on the JSON input. The result of the
+        entire chain is cached and each service caches its own results, so if
+        the results of the first steps are cached the chain will effectively
+        resume from the last step that was cached. If given, progress is called
+        as progress(step, service, done) before and after each step, and a
+        StepMetrics object for each step is added to the metrics list. Each
+        step is given only the views it needs, see run_step()."""
         if BYPASS_CHAIN_PROCEESING:
             return json.loads(open('data/example.lif').read())
             #return {"payload": json.loads(open('data/example.lif').read())}
-        json_obj = chain_input
-        step = 0
-        for service in self.services:
-            step += 1
-            info("service=%s" % service.identifier)
-            json_obj = service.execute(json_obj)
-            info("discriminator=%s" % json_obj.get('discriminator'))
-            if SAVE_STEPS:
-                tmp_file = "%02d-%s.lif" % (step, service.identifier.split(':')[-1])
-                with open(tmp_file, 'w') as fh:
-                    json.dump(json_obj, fh, indent=4)
+        key, result = self.get_cached(chain_input)
+        if result is not None:
+            return result
+        step_metrics = [StepMetrics(service.identifier) for service in self.services]
+        started = []
+        try:
+            json_obj = self._run_graph(chain_input, progress, step_metrics, started)
+        finally:
+            if metrics is not None:
+                metrics.extend(step_metrics[i] for i in sorted(started))
+        self._log_transfer(step_metrics)
+        self.put_cached(key, json_obj)
+        return json_obj
+
+    async def run_async(self, chain_input, progress=None, metrics=None):
+        """Like run(), but the services are called with execute_async(), so one
+        thread can run many chains at the same time. Must be awaited in the event
+        loop that uses ASYNC_CLIENTS."""
+        if BYPASS_CHAIN_PROCEESING:
+            return json.loads(open('data/example.lif').read())
+        # the cache and the metadata of the services may have to be read from
+        # disk, which is done in a thread so the event loop is not blocked
+        loop = asyncio.get_running_loop()
+        key, result = await loop.run_in_executor(None, self.get_cached, chain_input)
+        if result is not None:
+            return result
+        await loop.run_in_executor(None, self.dependencies)
+        step_metrics = [StepMetrics(service.identifier) for service in self.services]
+        started = []
+        try:
+            json_obj = await self._run_graph_async(chain_input, progress, step_metrics, started)
+        finally:
+            if metrics is not None:
+                metrics.extend(step_metrics[i] for i in sorted(started))
+        self._log_transfer(step_metrics)
+        await loop.run_in_executor(None, self.put_cached, key, json_obj)
         return json_obj
 
+    def _log_transfer(self, step_metrics):
+        if DELTA_TRANSFER:
+            transferred = sum(m.request_bytes + m.response_bytes for m in step_metrics)
+            saved = sum(m.saved_bytes for m in step_metrics)
+            info("chain %s transferred %d bytes, saved about %d bytes by sending only required views"
+                 % (self.identifier, transferred, saved))
+
+    def _run_graph(self, chain_input, progress, step_metrics, started):
+        """Run the steps in the order of their dependencies, each step is started
+        as soon as the steps it depends on are done, with the views added by
+        those steps, see ChainGraph. In the result the views are in the order
+        of the steps that added them. The numbers of the steps are added to
+        started. Stops at the first step that returns an error or raises an
+        exception and returns that error."""
+        graph = ChainGraph(self, chain_input, progress, step_metrics, started)
+        running = {}
+        workers = max(1, min(CHAIN_WORKERS, len(self.services)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while not graph.finished():
+                for i, document, sizes in graph.start_steps():
+                    future = pool.submit(self.run_step, self.services[i], document,
+                                         step_metrics[i], sizes)
+                    running[future] = (i, sizes)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i, sizes = running.pop(future)
+                    error = graph.finish_step(i, sizes, future)
+                    if error is not None:
+                        for other in running:
+                            other.cancel()
+                        return error
+        return graph.result()
+
+    async def _run_graph_async(self, chain_input, progress, step_metrics, started):
+        """Like _run_graph(), with the steps running as asyncio tasks."""
+        graph = ChainGraph(self, chain_input, progress, step_metrics, started)
+        running = {}
+        try:
+            while not graph.finished():
+                for i, document, sizes in graph.start_steps():
+                    task = asyncio.ensure_future(self.run_step_async(
+                        self.services[i], document, step_metrics[i], sizes))
+                    running[task] = (i, sizes)
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    i, sizes = running.pop(task)
+                    error = graph.finish_step(i, sizes, task)
+                    if error is not None:
+                        return error
+        finally:
+            for task in running:
+                task.cancel()
+        return graph.result()
+
+    def run_step(self, service, json_obj, metrics=None, view_sizes=None):
+        """Run one service on the document and return the new document and the
+        list of views that the service added. With DELTA_TRANSFER a LIF document
+        is sent with only the views that have annotation types the service
+        requires, and the views the service adds are merged into the document
+        here. Services without metadata get the whole document. The view_sizes
+        dictionary has the estimated sizes in bytes of the views so far, it is
+        updated with the added views and used to estimate the number of bytes
+        saved, which is stored in metrics."""
+        if metrics is None:
+            metrics = StepMetrics(service.identifier)
+        if view_sizes is None:
+            view_sizes = {}
+        service_input = self._step_input(service, json_obj, metrics, view_sizes)
+        result = service.execute(service_input, metrics)
+        return self._step_result(json_obj, service_input, result, metrics, view_sizes)
+
+    async def run_step_async(self, service, json_obj, metrics=None, view_sizes=None):
+        """Like run_step(), but the service is called with execute_async()."""
+        if metrics is None:
+            metrics = StepMetrics(service.identifier)
+        if view_sizes is None:
+            view_sizes = {}
+        service_input = self._step_input(service, json_obj, metrics, view_sizes)
+        result = await service.execute_async(service_input, metrics)
+        return self._step_result(json_obj, service_input, result, metrics, view_sizes)
+
+    @staticmethod
+    def _step_input(service, json_obj, metrics, view_sizes):
+        """Return the input for the service, with only the views it needs."""
+        required = None
+        if DELTA_TRANSFER and lif.is_lif(json_obj):
+            required = service.requires()
+        if required is None:
+            return json_obj
+        selected = lif.select_views(json_obj, required)
+        selected_ids = set(view.get('id') for view in selected)
+        omitted = sum(view_sizes.get(view.get('id'), 0)
+                      for view in lif.views(json_obj) if view.get('id') not in selected_ids)
+        # the omitted views would have gone to the service and back
+        metrics.saved_bytes = 2 * omitted
+        return lif.with_views(json_obj, selected)
+
+    @staticmethod
+    def _step_result(json_obj, service_input, result, metrics, view_sizes):
+        """Return the new document and the added views for the result of the
+        service on the input that was made from the document."""
+        if is_error(result) or not lif.is_lif(result):
+            return result, []
+        sent = lif.views(service_input) if lif.is_lif(service_input) else []
+        added = lif.views(result)[len(sent):]
+        if service_input is json_obj:
+            document = result
+        else:
+            document, added = lif.merge_views(json_obj, added)
+        growth = max(0, metrics.response_bytes - metrics.request_bytes)
+        for view in added:
+            view_sizes[view.get('id')] = growth // len(added)
+        metrics.views = [view.get('id') for view in added]
+        return document, added
+
+    @staticmethod
+    def _save_step(step, service, json_obj, added, first):
+        """Save the document after the first step that finished, and after that
+        only the views added by each step."""
+        name = service.identifier.split(':')[-1]
+        if first or not lif.is_lif(json_obj):
+            with open("%02d-%s.lif" % (step, name), 'w') as fh:
+                json.dump(json_obj, fh, indent=4)
+        else:
+            with open("%02d-%s.views.json" % (step, name), 'w') as fh:
+                json.dump(added, fh, indent=4)
+
+    def run_batch(self, documents, step_workers=BATCH_STEP_WORKERS, window=BATCH_WINDOW):
+        """Run the chain on many documents, where documents is a list, the path to
+        a directory or a JSONL stream, see batch.iter_documents(). Documents are
+        pipelined through the steps of the chain. Returns a generator of
+        dictionaries with the identifier of the document and either the result
+        or an error message, in the order of the input."""
+        documents = batch.iter_documents(documents)
+        if BYPASS_CHAIN_PROCEESING:
+            return ({'id': doc_id, 'result': self.run(doc)} for doc_id, doc in documents)
+        runner = batch.BatchRunner(self, step_workers=step_workers, window=window)
+        return runner.run(documents)
+
     def pp(self):
         print(self.identifier)
         for service in self.services:
             print('   ', service.identifier)
 
-                
+
+class ChainGraph(object):
+
+    """The state of one run of a chain as a graph of steps, see
+    ServiceChain._run_graph(). It keeps the views added by each step that is
+    done and decides which steps can start. The input of a step is the chain
+    input with the views added by the steps it depends on, directly or not,
+    and the result has the views of all steps. Views are always merged in the
+    order of the steps, so the input of a step, the cache key of its result and
+    the identifiers of the views do not depend on which steps happened to be
+    done first. Running the steps is left to the caller, which can use threads
+    or asyncio tasks."""
+
+    def __init__(self, chain, chain_input, progress, step_metrics, started):
+        self.chain = chain
+        self.chain_input = chain_input
+        self.dependencies = chain.dependencies()
+        self.ancestors = chain.ancestors()
+        self.progress = progress
+        self.step_metrics = step_metrics
+        self.started = started
+        # for each step that is done its result, the views it added and their
+        # estimated sizes in bytes
+        self.outputs = {}
+        self.done = set()
+
+    def finished(self):
+        return len(self.done) == len(self.chain.services)
+
+    def start_steps(self):
+        """Mark the steps whose dependencies are done as started and return them
+        as triples of the step number, its input and the view sizes of the
+        input, which are updated with the sizes of the added views."""
+        steps = []
+        for i, service in enumerate(self.chain.services):
+            if i in self.done or i in self.started or not self.dependencies[i] <= self.done:
+                continue
+            info("service=%s" % service.identifier)
+            if self.progress is not None:
+                self.progress(i + 1, service, False)
+            self.started.append(i)
+            document, sizes, _ = self._merge(self.ancestors[i])
+            steps.append((i, document, sizes))
+        return steps
+
+    def finish_step(self, i, sizes, future):
+        """Record the views added by step i, the future is the thread or asyncio
+        future of ServiceChain.run_step(). Returns the result of the step if it
+        failed and None otherwise. An exception raised by the step is turned
+        into an error result."""
+        service = self.chain.services[i]
+        try:
+            result, added = future.result()
+        except Exception as e:
+            result, added = error_result("%s failed: %s: %s" % (
+                service.identifier, e.__class__.__name__, e)), []
+        self.done.add(i)
+        if self.progress is not None:
+            self.progress(i + 1, service, True)
+        info("discriminator=%s (%.3f seconds)"
+             % (result.get('discriminator'), self.step_metrics[i].seconds()))
+        if is_error(result) or not lif.is_lif(result):
+            info("step %d of chain %s failed" % (i + 1, self.chain.identifier))
+            return result
+        self.outputs[i] = (result, added, [sizes.get(view.get('id'), 0) for view in added])
+        if SAVE_STEPS:
+            self.chain._save_step(i + 1, service, result, added, len(self.done) == 1)
+        return None
+
+    def _merge(self, steps):
+        """Return the chain input with the views added by the steps merged in the
+        order of the steps, the sizes of the views by identifier, and for each
+        step the identifiers its views got. If the chain input is not LIF, the
+        result of the first step without its views is used instead."""
+        document = self.chain_input
+        sizes = {}
+        identifiers = {}
+        for j in sorted(steps):
+            result, added, added_sizes = self.outputs[j]
+            if not lif.is_lif(document):
+                document = lif.with_views(result, lif.views(result)[:-len(added) or None])
+            document, renamed = lif.merge_views(document, added)
+            identifiers[j] = [view.get('id') for view in renamed]
+            sizes.update(zip(identifiers[j], added_sizes))
+        return document, sizes, identifiers
+
+    def result(self):
+        """Return the document with the views of all steps, in the order of the
+        steps that added them."""
+        document, _, identifiers = self._merge(self.outputs)
+        for j, views in identifiers.items():
+            self.step_metrics[j].views = views
+        return document
+
+
+def error_result(message):
+    """Return an error message in the form that services return them."""
+    return {'discriminator': ERROR, 'payload': message}
+
+
+def is_error(json_obj):
+    """Return True if the object returned by a service is an error message."""
+    discriminator = json_obj.get('discriminator') or ''
+    return discriminator.endswith('/error')
+
+
+def result_error(json_obj):
+    """Return the error message for the result of a step or a chain, or None if
+    the result is a LIF document and the chain can go on."""
+    if not is_error(json_obj) and lif.is_lif(json_obj):
+        return None
+    return json_obj.get('payload') or 'unexpected result %s' % json_obj.get('discriminator')
+
+
 def print_separator(c):
     print()
     print(c * 80)
@@ -0,0 +1,147 @@
+"""snapshot.py
+
+A single file with the information and metadata of all registered services.
+
+Without a snapshot the registry is loaded from the service manager listings in
+data/services/info and from one metadata file per service, which are all read
+and parsed at startup. The snapshot is written after such a load and used at the
+next startup if the listings and the metadata directory did not change since:
+
+>>> RegistrySnapshot.write(fname, entries, categories, sources)
+>>> snapshot = RegistrySnapshot(fname)
+>>> snapshot.is_current(sources)
+True
+>>> json.loads(snapshot.metadata(0))
+
+The file starts with a fixed size header, followed by a compressed JSON object
+with for each service its server, identifier and summary (the version and the
+annotation types it requires and produces) and the services grouped on what
+they produce. Then there is an index with for each service the offsets and
+lengths of its information and metadata, which are stored as separately
+compressed JSON strings in the rest of the file. The file is memory-mapped and
+the information and metadata of a service are only read and decompressed when
+they are asked for.
+
+"""
+
+import os
+import json
+import mmap
+import zlib
+import struct
+import tempfile
+
+
+MAGIC = b'LAPPSREG'
+FORMAT_VERSION = 1
+
+# magic, format version and length of the compressed JSON header
+HEADER = struct.Struct('<8sII')
+
+# offset and length of the information and of the metadata of a service
+INDEX_ENTRY = struct.Struct('<QIQI')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def source_times(paths):
+    """Return a dictionary with the modification times of the paths, None for
+    paths that do not exist. A snapshot is current if these did not change."""
+    times = {}
+    for path in paths:
+        try:
+            times[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            times[path] = None
+    return times
+
+
+class RegistrySnapshot(object):
+
+    """A registry snapshot opened for reading.
+
+    Instance variables:
+       sources      modification times of the sources of the snapshot
+       entries      for each service a list with server, identifier and summary
+       categories   list of pairs of a list of annotation types and the positions
+                    of the services that produce them
+
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, header_length = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise SnapshotError("%s is not a registry snapshot of version %d"
+                                    % (fname, FORMAT_VERSION))
+            start = HEADER.size
+            header = json.loads(zlib.decompress(self._mmap[start:start + header_length]))
+        except (struct.error, zlib.error, ValueError) as e:
+            self._mmap.close()
+            raise SnapshotError("cannot read %s: %s" % (fname, e))
+        self.sources = header['sources']
+        self.entries = header['services']
+        self.categories = header['categories']
+        self._index = start + header_length
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _blob(self, offset, length):
+        return zlib.decompress(self._mmap[offset:offset + length]).decode('utf-8')
+
+    def info(self, i):
+        """Return the service manager information of service i as a string."""
+        offset, length, _, _ = INDEX_ENTRY.unpack_from(self._mmap, self._index + i * INDEX_ENTRY.size)
+        return self._blob(offset, length)
+
+    def metadata(self, i):
+        """Return the metadata of service i as a string."""
+        _, _, offset, length = INDEX_ENTRY.unpack_from(self._mmap, self._index + i * INDEX_ENTRY.size)
+        return self._blob(offset, length)
+
+    def is_current(self, sources):
+        return self.sources == sources
+
+    def close(self):
+        self._mmap.close()
+
+    @staticmethod
+    def write(fname, entries, categories, sources, level=6):
+        """Write a snapshot. The entries are lists with the server, identifier,
+        summary, information string and metadata string of each service, and
+        categories has pairs of annotation types and positions in entries. The
+        file is written under a temporary name and then renamed, so readers
+        never see a partial snapshot."""
+        header = {'sources': sources,
+                  'services': [entry[:3] for entry in entries],
+                  'categories': categories}
+        header = zlib.compress(json.dumps(header).encode('utf-8'), level)
+        blobs = []
+        index = []
+        offset = HEADER.size + len(header) + len(entries) * INDEX_ENTRY.size
+        for entry in entries:
+            lengths = []
+            for string in entry[3:5]:
+                blob = zlib.compress(string.encode('utf-8'), level)
+                blobs.append(blob)
+                lengths.append((offset, len(blob)))
+                offset += len(blob)
+            index.append(INDEX_ENTRY.pack(*lengths[0], *lengths[1]))
+        directory = os.path.dirname(fname) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(header)))
+                fh.write(header)
+                fh.writelines(index)
+                fh.writelines(blobs)
+            os.replace(tmp_path, fname)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
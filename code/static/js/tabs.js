@@ -18,6 +18,65 @@ function display(evt, identifier, content, tab)
 
     // Show the current tab, and add an "active" class to the button that opened
     // the tab.
-    document.getElementById(identifier).style.display = "block";
+    var element = document.getElementById(identifier);
+    element.style.display = "block";
     evt.currentTarget.className += " active";
+
+    // Tabs with a URL are filled in from the server the first time they are
+    // shown, after that the content stays in the page
+    var url = element.getAttribute("data-url");
+    if (url !== null) {
+        element.removeAttribute("data-url");
+        var request = new XMLHttpRequest();
+        request.open("GET", url);
+        request.onload = function () {
+            element.innerHTML = request.responseText;
+            loadTables(element);
+        };
+        request.send();
+    } else {
+        loadTables(element);
+    }
+}
+
+
+function loadTables(element)
+{
+    // Load the first page of the annotation table in this tab if that was not
+    // done yet, tables in sub tabs are loaded when the sub tab is shown
+    var i, tables = element.getElementsByClassName("annotations");
+    for (i = 0; i < tables.length; i++) {
+        if (tables[i].parentNode === element
+            && tables[i].getAttribute("data-offset") == "0") {
+            loadAnnotations(tables[i].getElementsByClassName("more")[0]);
+        }
+    }
+}
+
+
+function loadAnnotations(button)
+{
+    // Get the next page of annotations from the server and add it to the
+    // table, the button is hidden when there are no more annotations.
+    var container = button.parentNode;
+    var offset = container.getAttribute("data-offset");
+    var request = new XMLHttpRequest();
+    button.disabled = true;
+    request.open("GET", container.getAttribute("data-url") + "?offset=" + offset);
+    request.onload = function () {
+        var rows = container.getElementsByClassName("rows")[0];
+        if (offset == "0") {
+            rows.innerHTML = "";
+        }
+        rows.insertAdjacentHTML("beforeend", request.responseText);
+        var next = parseInt(request.getResponseHeader("X-Offset"))
+            + parseInt(request.getResponseHeader("X-Limit"));
+        var total = parseInt(request.getResponseHeader("X-Total"));
+        container.setAttribute("data-offset", next);
+        button.disabled = false;
+        if (next >= total) {
+            button.style.display = "none";
+        }
+    };
+    request.send();
 }
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+
+CODE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules are imported from the code directory and use paths relative to it
+sys.path.insert(0, CODE)
+os.chdir(CODE)
+
+
+@pytest.fixture(scope='session')
+def mock_backend():
+    """Run the mock services and point the services module at them, with result
+    caching switched off."""
+    import services
+    import mock_service
+    mock = mock_service.serve(latency=0.02, jitter=0)
+    services.use_service_backend(mock.url)
+    services.RESULT_CACHE = None
+    yield mock
+    mock.shutdown()
+
+
+@pytest.fixture(scope='session')
+def chains(mock_backend):
+    import services
+    return services.ServiceChains(services.LappsServices())
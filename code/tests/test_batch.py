@@ -0,0 +1,65 @@
+import io
+import json
+
+import pytest
+
+from batch import batch_directory, DirectoryNotAllowed
+from services import error_result
+
+
+def test_bad_lines_do_not_stop_the_batch(chains):
+    chain = chains.get_chain('stanford-tok-pos-sen-ner-par')
+    lines = [json.dumps({'id': 'good', 'text': 'The door is open.'}),
+             '{"id": "broken", "text": ',
+             json.dumps({'id': 'empty'}),
+             json.dumps(['not', 'a', 'document']),
+             json.dumps('Another good one.')]
+    source = io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8') + b'\xff\xfe\n')
+    results = list(chain.run_batch(source))
+    assert [result['id'] for result in results] == ['good', 1, 'empty', 3, 4, 5]
+    assert [('error' in result) for result in results] == [False, True, True, True, False, True]
+    assert 'malformed JSON' in results[1]['error']
+    assert 'no text or input' in results[2]['error']
+    assert 'not UTF-8' in results[5]['error']
+
+
+def test_unreadable_files_do_not_stop_the_batch(chains, tmp_path):
+    (tmp_path / 'a.txt').write_text('The door is open.', encoding='utf-8')
+    (tmp_path / 'b.txt').write_bytes(b'caf\xe9')
+    (tmp_path / 'c.txt').write_text('Hi there.', encoding='utf-8')
+    chain = chains.get_chain('stanford-tok-pos-sen-ner-par')
+    results = list(chain.run_batch(str(tmp_path)))
+    assert [result['id'] for result in results] == ['a.txt', 'b.txt', 'c.txt']
+    assert [('error' in result) for result in results] == [False, True, False]
+    assert results[1]['error'].startswith('DocumentError: cannot read b.txt')
+
+
+def test_failed_steps_end_the_document(chains, monkeypatch):
+    chain = chains.get_chain('stanford-tok-pos-sen-ner-par')
+    run_step = chain.run_step
+    calls = []
+
+    def failing_run_step(service, json_obj, metrics=None, view_sizes=None):
+        text = json_obj['payload'] if isinstance(json_obj['payload'], str) else ''
+        calls.append((service.identifier, text))
+        if text == 'fail':
+            return error_result("%s failed" % service.identifier), []
+        return run_step(service, json_obj, metrics, view_sizes)
+
+    monkeypatch.setattr(chain, 'run_step', failing_run_step)
+    results = list(chain.run_batch(['The door is open.', 'fail', 'Hi there.']))
+    assert [('error' in result) for result in results] == [False, True, False]
+    assert results[1]['error'].endswith('failed')
+    # the document that failed was not sent to the other services
+    assert [text for _, text in calls].count('fail') == 1
+
+
+def test_batch_directories_stay_below_the_root(tmp_path):
+    (tmp_path / 'corpus').mkdir()
+    root = str(tmp_path)
+    assert batch_directory('corpus', root) == str(tmp_path / 'corpus')
+    for directory in ('/etc', '../..', 'corpus/../..', 'missing'):
+        with pytest.raises(DirectoryNotAllowed):
+            batch_directory(directory, root)
+    with pytest.raises(DirectoryNotAllowed):
+        batch_directory('corpus', None)
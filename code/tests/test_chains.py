@@ -0,0 +1,52 @@
+import copy
+
+import lif
+import mock_service
+
+
+TEXT_INPUT = {"discriminator": "http://vocab.lappsgrid.org/ns/media/text",
+              "payload": mock_service.TEXT}
+
+
+def short_names(chain):
+    return [service.identifier.split(':')[-1].split('.')[1].split('_')[0]
+            for service in chain.services]
+
+
+def test_tagger_and_recognizer_start_together(chains):
+    chain = chains.get_chain('stanford-tok-pos-sen-ner-par')
+    steps = short_names(chain)
+    pos = steps.index('postagger')
+    ner = steps.index('namedentityrecognizer')
+    # both only need the tokens of the tokenizer, not the tags of the tagger
+    assert chain.dependencies()[pos] == chain.dependencies()[ner] == {steps.index('tokenizer')}
+    events = []
+    chain.run(TEXT_INPUT, progress=lambda step, service, done: events.append((step - 1, done)))
+    assert events.index((pos, False)) < events.index((ner, True))
+    assert events.index((ner, False)) < events.index((pos, True))
+
+
+def test_results_do_not_depend_on_timing(chains):
+    chain = chains.get_chain('stanford-tok-pos-sen-ner-par')
+    results = [chain.run(TEXT_INPUT) for _ in range(4)]
+    assert all(result == results[0] for result in results)
+    views = lif.views(results[0])
+    assert [view['id'] for view in views] == ['v%d' % n for n in range(len(views))]
+
+
+def test_dependencies_follow_metadata_changes(chains):
+    chain = chains.get_chain('stanford-tok-pos-sen-ner-par')
+    steps = short_names(chain)
+    pos = steps.index('postagger')
+    ner = chain.services[steps.index('namedentityrecognizer')]
+    metadata = ner.metadata
+    assert pos not in chain.dependencies()[steps.index('namedentityrecognizer')]
+    # a refresh gives the recognizer metadata saying it needs the tags
+    changed = copy.deepcopy(metadata)
+    changed['payload']['requires']['annotations'].append('http://vocab.lappsgrid.org/Token#pos')
+    ner.metadata = changed
+    try:
+        assert pos in chain.dependencies()[steps.index('namedentityrecognizer')]
+    finally:
+        ner.metadata = metadata
+    assert pos not in chain.dependencies()[steps.index('namedentityrecognizer')]
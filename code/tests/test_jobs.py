@@ -0,0 +1,62 @@
+import time
+
+import jobs
+import mock_service
+from metrics import StepMetrics
+from services import error_result
+
+
+def wait_for(manager, job_identifier):
+    while not manager.get(job_identifier).is_finished():
+        time.sleep(0.01)
+
+
+def test_jobs_can_be_polled_in_another_process(chains, tmp_path):
+    def load_chain(identifier, service_identifiers):
+        return chains.get_chain(identifier)
+
+    # two managers sharing a directory, as in two worker processes
+    runner, poller = jobs.JobManager(workers=1), jobs.JobManager(workers=1)
+    runner.share(load_chain, str(tmp_path))
+    poller.share(load_chain, str(tmp_path))
+    chain = chains.get_chain('stanford-tok-pos-sen-ner-par')
+    job = runner.submit(chain, 'http://example.org/text', lambda url: mock_service.TEXT)
+    assert poller.get(job.identifier) is not None
+    # the job is written after it finished
+    wait_for(poller, job.identifier)
+    polled = poller.get(job.identifier)
+    assert polled.status == jobs.DONE
+    assert polled.chain is chain
+    assert polled.result == job.result
+    assert polled.as_json() == job.as_json()
+    assert poller.get('no-such-job') is None
+
+
+class FailingChain(object):
+
+    """A chain whose first step returns an error, as ServiceChain.run() does."""
+
+    identifier = 'failing'
+
+    def __init__(self, services):
+        self.services = services
+
+    def run(self, chain_input, progress=None, metrics=None):
+        service = self.services[0]
+        progress(1, service, False)
+        step_metrics = StepMetrics(service.identifier)
+        step_metrics.error = True
+        metrics.append(step_metrics)
+        progress(1, service, True)
+        return error_result("%s failed" % service.identifier)
+
+
+def test_failed_steps_fail_the_job(chains):
+    chain = FailingChain(chains.get_chain('stanford-tok-pos-sen-ner-par').services)
+    manager = jobs.JobManager(workers=1)
+    job = manager.submit(chain, 'http://example.org/text', lambda url: 'text')
+    wait_for(manager, job.identifier)
+    assert job.status == jobs.FAILED
+    assert job.error.endswith('failed')
+    statuses = [step['status'] for step in job.as_json()['steps']]
+    assert statuses == [jobs.FAILED] + [jobs.SKIPPED] * (len(chain.services) - 1)
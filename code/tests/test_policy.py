@@ -0,0 +1,59 @@
+import threading
+import time
+
+import policy
+
+
+class FixedLatency(object):
+
+    def latency_percentile(self, name, percentile, min_calls):
+        return 0.02
+
+
+def hedged_policy(**settings):
+    return policy.CallPolicy('service', hedge_percentile=90, metrics=FixedLatency(), **settings)
+
+
+def test_hedge_answers_before_a_slow_first_attempt():
+    calls = []
+    lock = threading.Lock()
+
+    def send(timeout):
+        with lock:
+            calls.append(len(calls))
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.05)
+        return 'first' if first else 'hedge'
+
+    call_policy = hedged_policy()
+    t0 = time.perf_counter()
+    assert call_policy.call(send) == 'hedge'
+    # the caller does not wait for the slow first attempt
+    assert time.perf_counter() - t0 < 0.5
+    assert call_policy.as_json()['hedged'] == 1
+
+
+def test_hedge_is_used_when_the_first_attempt_fails():
+    calls = []
+    lock = threading.Lock()
+
+    def send(timeout):
+        with lock:
+            calls.append(len(calls))
+            first = len(calls) == 1
+        time.sleep(0.05)
+        if first:
+            raise OSError("first attempt failed")
+        return 'hedge'
+
+    call_policy = hedged_policy(retries=0)
+    assert call_policy.call(send) == 'hedge'
+    assert call_policy.as_json()['hedged'] == 1
+    assert call_policy.as_json()['retried'] == 0
+
+
+def test_fast_calls_are_not_hedged():
+    call_policy = hedged_policy()
+    assert call_policy.call(lambda timeout: 'answer') == 'answer'
+    time.sleep(0.05)
+    assert call_policy.as_json()['hedged'] == 0
@@ -1,4 +1,17 @@
+import os
 import json
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    # no locks between processes on Windows
+    fcntl = None
+
+
+# Indentation used when dumping JSON.
+INDENT = 4
 
 
 def info(message):
@@ -10,7 +23,102 @@ def debug(message):
 
 
 def dump(obj):
-    return json.dumps(obj, indent=4)
+    return json.dumps(obj, indent=INDENT)
+
+
+def write_json(fname, obj, indent=INDENT):
+    """Write the JSON object to a file. The object is written to a temporary
+    file first which then replaces the file, so readers never see a partially
+    written file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(fname) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(obj, fh, indent=indent)
+        os.replace(tmp_path, fname)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(fname):
+    """Hold an exclusive lock on the file, which is created if needed. The lock
+    is shared by all processes and threads that use the same file."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    with open(fname, 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def iterdump(obj, level=0):
+    """Generate the string of dump(obj) in chunks, indented as if obj was nested
+    at the given level in a larger object."""
+    encoder = json.JSONEncoder(indent=INDENT)
+    newline = '\n' + ' ' * INDENT * level
+    for chunk in chunked(encoder.iterencode(obj)):
+        yield chunk.replace('\n', newline) if level else chunk
+
+
+def iterdump_payload(payload, dump_annotations):
+    """Generate the string of dump(payload) in chunks for a LIF payload. The
+    annotations of view n are taken from dump_annotations(n), so annotations
+    that were serialized for a view do not have to be serialized again."""
+    if not payload:
+        yield dump(payload)
+        return
+    indent = ' ' * INDENT
+    separator = '{'
+    for key, value in payload.items():
+        yield '%s\n%s%s: ' % (separator, indent, json.dumps(key))
+        separator = ','
+        if key == 'views' and isinstance(value, list) and value:
+            yield from _iterdump_views(value, dump_annotations)
+        else:
+            yield from iterdump(value, level=1)
+    yield '\n}'
+
+
+def _iterdump_views(views, dump_annotations):
+    indent = ' ' * INDENT
+    newline = '\n' + indent * 3
+    separator = '['
+    for n, view in enumerate(views):
+        yield '%s\n%s' % (separator, indent * 2)
+        separator = ','
+        if not isinstance(view, dict) or not view:
+            yield from iterdump(view, level=2)
+            continue
+        view_separator = '{'
+        for key, value in view.items():
+            yield '%s\n%s%s: ' % (view_separator, indent * 3, json.dumps(key))
+            view_separator = ','
+            if key == 'annotations':
+                yield dump_annotations(n).replace('\n', newline)
+            else:
+                yield from iterdump(value, level=3)
+        yield '\n%s}' % (indent * 2)
+    yield '\n%s]' % indent
+
+
+def chunked(strings, size=16 * 1024):
+    """Join the strings into chunks of at least size characters."""
+    parts = []
+    length = 0
+    for string in strings:
+        parts.append(string)
+        length += len(string)
+        if length >= size:
+            yield ''.join(parts)
+            parts = []
+            length = 0
+    if parts:
+        yield ''.join(parts)
 
 
 def get_vars(request, var_names):
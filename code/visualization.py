@@ -1,6 +1,29 @@
+"""visualization.py
+
+Visualizations of the annotations in a LIF view. All functions take the view as
+a lif.LifView, which indexes the annotations on their type so that each
+visualization only looks at the annotations it shows.
+
+"""
+
 import io
+from html import escape
 
 from html_utils import Tag, Text
+from lif import NO_OFFSET
+
+
+# Annotations shown on one page of an annotation table.
+PAGE_SIZE = 200
+
+# Suffixes of identifiers that have their own visualization.
+VISUALIZATIONS = ('Token', 'Token#pos', 'Sentence', 'NamedEntity', 'PhraseStructure')
+
+
+def has_visualization(identifier):
+    """Return True if there is a specific visualization for the identifier, False
+    if the default table of annotations is used."""
+    return identifier.endswith(VISUALIZATIONS)
 
 
 def visualize(identifier, view, text):
@@ -23,19 +46,17 @@ def visualize(identifier, view, text):
 def tab_separated_tokens(view):
     """Print tokens separated by whitespace."""
     s = io.StringIO()
-    for token in view['annotations']:
-        if token['@type'].endswith('Token'):
-            s.write('%s ' % token['features']['word'])
+    for i in view.indices('Token'):
+        s.write('%s ' % view.features(i)['word'])
     return s.getvalue()
 
 
 def tab_separated_tokens_with_pos(view):
     """Print tokens separated by whitespace and in the tok/pos format."""
     s = io.StringIO()
-    for token in view['annotations']:
-        if token['@type'].endswith('Token#pos'):
-            s.write('%s/%s ' % (token['features']['word'],
-                                token['features']['pos']))
+    for i in view.indices('Token#pos'):
+        features = view.features(i)
+        s.write('%s/%s ' % (features['word'], features['pos']))
     return s.getvalue()
 
 
@@ -43,72 +64,157 @@ def one_sentence_per_line(view, text):
     """Print one sentence per line, but do not use changes of whitespace to indicate
     token boundaries."""
     s = io.StringIO()
-    for sent in view['annotations']:
-        if sent['@type'].endswith('Sentence'):
-            p1 = sent.get('start')
-            p2 = sent.get('end')
-            s.write('%s\n\n' % text[p1:p2])
+    for i in view.indices('Sentence'):
+        p1, p2 = view.offsets(i)
+        s.write('%s\n\n' % text[p1:p2])
     return s.getvalue()
 
 
 def entities(view, text):
-    entities = []
-    starts = {}
-    ends = {}
-    for a in view['annotations']:
-        atype = a['@type'].split('/')[-1]
-        # TODO: a bit of a hack, and incomplete to boot
-        if atype in ('NamedEntity', 'Person', 'Location'):
-            entities.append(a)
-            starts[a.get('start')] = atype
-            ends[a.get('end')] = atype
-    s = io.StringIO()
-    for (i, c) in enumerate(text):
-        if i in starts:
-            s.write('<e style="color:blue;">')
-        if i in ends:
-            s.write('</e>')
-            s.write('<sup>%s</sup>' % _abbreviate_entity_type(ends[i]))
-        s.write(c)
-    return s.getvalue()
+    """Return the text with entities highlighted and the abbreviated entity type
+    as a superscript after each entity. Text between entity boundaries is copied
+    as one slice, so this is linear in the number of entities rather than the
+    number of characters. Nested entities are nested in the output and crossing
+    entities are closed and reopened so the tags are always well-formed."""
+    length = len(text)
+    starts = view.starts
+    ends = view.ends
+    spans = []
+    for type_id, short_type in enumerate(view.short_names):
+        if short_type not in ENTITY_TYPES:
+            continue
+        abbreviation = _abbreviate_entity_type(short_type)
+        for i in view.positions[type_id]:
+            p1 = starts[i]
+            p2 = ends[i]
+            if p1 == NO_OFFSET or p2 == NO_OFFSET:
+                continue
+            p1 = 0 if p1 < 0 else length if p1 > length else p1
+            p2 = p1 if p2 < p1 else length if p2 > length else p2
+            # sorting on the negative end opens outer entities before the
+            # entities nested in them
+            spans.append((p1, -p2, abbreviation))
+    spans.sort()
+    needs_escape = '&' in text or '<' in text or '>' in text
+    out = []
+    write = out.append
+    # open entities as (end, abbreviation) pairs, with the innermost entity on
+    # top, and whether open entities cross each other
+    stack = []
+    crossing = False
+    previous = 0
+    for p1, p2, abbreviation in spans:
+        p2 = -p2
+        if stack and (crossing or stack[-1][0] <= p1):
+            previous, crossing = _close_entities(
+                write, text, needs_escape, stack, previous, p1)
+        segment = text[previous:p1]
+        write(escape(segment, quote=False) if needs_escape else segment)
+        previous = p1
+        write(ENTITY_OPEN)
+        if p1 == p2:
+            write('</e><sup>%s</sup>' % abbreviation)
+        else:
+            if stack and p2 > stack[-1][0]:
+                crossing = True
+            stack.append((p2, abbreviation))
+    if stack:
+        previous, crossing = _close_entities(
+            write, text, needs_escape, stack, previous, length)
+    segment = text[previous:]
+    write(escape(segment, quote=False) if needs_escape else segment)
+    return ''.join(out)
+
+
+ENTITY_TYPES = ('NamedEntity', 'Person', 'Location')
+ENTITY_OPEN = '<e style="color:blue;">'
+
+
+def _close_entities(write, text, needs_escape, stack, previous, position):
+    """Write the text up to the position and close all entities on the stack
+    that end at or before the position. Entities above them on the stack that
+    end later are closed and then reopened. Returns the new offset in the text
+    and whether the remaining open entities still cross each other."""
+    while stack:
+        end = min(stack)[0]
+        if end > position:
+            break
+        segment = text[previous:end]
+        write(escape(segment, quote=False) if needs_escape else segment)
+        previous = end
+        reopen = []
+        while stack:
+            span = stack.pop()
+            if span[0] == end:
+                write('</e><sup>%s</sup>' % span[1])
+                if all(s[0] != end for s in stack):
+                    break
+            else:
+                write('</e>')
+                reopen.append(span)
+        for span in reversed(reopen):
+            write(ENTITY_OPEN)
+            stack.append(span)
+    crossing = any(stack[i][0] < stack[i + 1][0] for i in range(len(stack) - 1))
+    return previous, crossing
 
 
 def phrase_structure(view, text):
     """Simply return the penntree feature."""
     # TODO: horribly naieve and limited
     s = io.StringIO()
-    phrases = []
-    for a in view['annotations']:
-        atype = a['@type'].split('/')[-1]
-        if atype in ('PhraseStructure',):
-            phrases.append(a)
-    for phrase in phrases:
-        s.write(phrase['features']['sentence'] + '\n\n')
-        s.write(phrase['features']['penntree'] + '\n')
+    for i in view.indices('PhraseStructure'):
+        features = view.features(i)
+        s.write(features['sentence'] + '\n\n')
+        s.write(features['penntree'] + '\n')
     return s.getvalue()
 
 
-def table_of_annotations(view, text):
-    """Print all annotations in a table."""
+def table_of_annotations(view, text, offset=0, limit=None):
+    """Print annotations in a table, by default all of them, but with an offset
+    and limit only the annotations on that page."""
+    return str(annotations_table(view, text, offset, limit))
+
+
+def annotations_table(view, text, offset=0, limit=None):
+    """Return the Tag for the table printed by table_of_annotations(), use its
+    stream() method to write it in chunks."""
     table = Tag('table', attrs={'cellpadding': 5, 'cellspacing': 0, 'border': 1})
-    for token in view['annotations']:
+    for i in _page(view, offset, limit):
         tr = table.add(Tag('tr', attrs={'valign': 'top'}))
-        p1 = token.get('start')
-        p2 = token.get('end')
-        word = text[p1:p2] if (p1 is not None and p2 is not None) else '-'
-        tr.add(Tag('td', dtrs=Text(token['@type'].split('/')[-1])))
+        p1, p2 = view.offsets(i)
+        tr.add(Tag('td', dtrs=Text(view.short_type(i))))
         # TODO: add the target feature if it is used
         if p1 is not None and p2 is not None:
             tr.add(Tag('td', dtrs=Text("%s:%s" % (p1, p2))))
         else:
             tr.add(Tag('td', dtrs=Text("&nbsp;")))
-        tr.add(Tag('td', dtrs=Text(features(token))))
-    return str(table)
+        tr.add(Tag('td', dtrs=Text(features(view.label(i), view.features(i)))))
+    return table
+
+
+def annotation_records(view, text, offset=0, limit=None):
+    """Return a list of dictionaries for a page of annotations, with the short
+    annotation type, the offsets, the text covered and the features."""
+    records = []
+    for i in _page(view, offset, limit):
+        p1, p2 = view.offsets(i)
+        word = text[p1:p2] if (p1 is not None and p2 is not None) else None
+        features = view.features(i)
+        if view.label(i) is not None:
+            features['label'] = view.label(i)
+        records.append({'id': view.ids[i], 'type': view.short_type(i),
+                        'start': p1, 'end': p2, 'text': word, 'features': features})
+    return records
+
+
+def _page(view, offset, limit):
+    """Return the positions of the annotations on a page."""
+    end = len(view) if limit is None else min(len(view), offset + limit)
+    return range(offset, end)
 
 
-def features(token):
-    label = token.get('label')
-    features = token.get('features', {})
+def features(label, features):
     table = Tag('table', attrs={'cellpadding': 0, 'cellspacing': 0, })
     # this part is a bit of a hack to deal with some old services that had the
     # label feature on the annotation type instead of in the features dictionary
@@ -0,0 +1,41 @@
+"""wsgi.py
+
+Entry point for running the application in several processes with gunicorn:
+
+$ cd code
+$ gunicorn -c gunicorn.conf.py
+
+The settings in gunicorn.conf.py load the application once in the gunicorn
+master process, which then forks the workers. The registry of services, the
+chains and everything else created when app.py is imported are shared by all
+workers, with the memory pages copied only when a worker writes to them. To
+keep it that way the objects created at startup are moved out of reach of the
+garbage collector before forking, see gunicorn.conf.py.
+
+Things that are created later are kept by each worker:
+
+- Each worker creates its own zeep clients and HTTP connections, see clients.py.
+- Each worker refreshes its registry in the background, starting with its first
+  request. The refreshes run one after the other, and after the first refresh
+  the other workers load the registry snapshot it wrote instead of retrieving
+  the metadata again, see refresh.py.
+- Results are shared through RESULT_STORE_DIR, so any worker can return the
+  parts of a result page.
+- Background jobs run in the worker they were submitted to, their state is
+  shared through JOB_STORE_DIR so they can be polled from any worker.
+- The metrics on /metrics are kept by the worker that made the service call.
+  Use one worker with more threads if all metrics have to be scraped.
+
+Metadata of a service are only ever retrieved by one process at a time. When
+several processes start with an empty cache, one loads the registry and the
+others wait for its snapshot.
+
+"""
+
+from app import app as application, job_chain
+from jobs import JOBS
+from results import RESULTS
+
+
+RESULTS.share()
+JOBS.share(job_chain)